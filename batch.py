@@ -0,0 +1,142 @@
+import argparse
+import ast
+import inspect
+import json
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import cv2
+
+from controllers.directory import list_images
+from controllers.loaders import load_image
+from controllers.registry import FILTERS, filter_key
+from controllers.threads import configure, configure_from_environment
+from controllers.tiling import run_tiled
+
+""" Headless counterpart of mvc_app.py: applies one filter from the registry to every
+    image of a directory, spreading the files over a pool of processes.
+
+    Example:
+        python batch.py ./images sobel --set kernel_size=5 --set direction=vertical -o ./out """
+
+
+def parse_setting(text):
+    """ 'name=value' -> (name, value), the value is read as a Python literal when possible. """
+    if '=' not in text:
+        raise argparse.ArgumentTypeError(f"Expected name=value, got '{text}'")
+    name, value = text.split('=', 1)
+    lowered = value.strip().lower()
+    if lowered in ('true', 'false'):
+        return name.strip(), lowered == 'true'
+    try:
+        return name.strip(), ast.literal_eval(value)
+    except (ValueError, SyntaxError):
+        return name.strip(), value
+
+
+def _init_worker():
+    # Every process gets its own core, the OpenCV and BLAS pools would only oversubscribe them.
+    # EDGE_DETECTION_*_THREADS set in the environment still win.
+    configure(opencv=1, blas=1)
+    configure_from_environment()
+
+
+def process_image(path, key, settings, output_dir, extension, memory_budget=None):
+    """ Runs in a worker process. Returns (path, output_path, pixels, seconds, error). """
+    start = time.perf_counter()
+    try:
+        name = os.path.splitext(os.path.basename(path))[0]
+        output_path = os.path.join(output_dir, f"{name}_{key[:-len('_button')]}.{extension}")
+
+        if memory_budget:
+            # Tiled mode: the tiling engine writes the output itself
+            result = run_tiled(path, key, settings, output=output_path, memory_budget=memory_budget)
+        else:
+            # The same loader as the viewer: .npy, raw and TIFF scans as well as what OpenCV reads
+            image = load_image(path)
+            if image is None:
+                raise ValueError('the file could not be decoded')
+            result = FILTERS[key](image, **settings)
+            if not cv2.imwrite(output_path, result):
+                raise ValueError(f'the result could not be written to {output_path}')
+    except Exception as e:
+        return path, None, 0, time.perf_counter() - start, f'{type(e).__name__}: {e}'
+    pixels = result.shape[0] * result.shape[1]
+    return path, output_path, pixels, time.perf_counter() - start, None
+
+
+def run_batch(directory, filter_name, settings, output_dir, workers=None, extension='png', memory_budget=None):
+    key = filter_key(filter_name)
+    # Fail before spawning anything if the settings do not match the filter
+    inspect.signature(FILTERS[key]).bind(None, **settings)
+
+    paths = [item.path for item in list_images(directory)]
+    os.makedirs(output_dir, exist_ok=True)
+    workers = workers or os.cpu_count()
+
+    results = []
+    start = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker) as executor:
+        futures = [executor.submit(process_image, path, key, settings, output_dir, extension, memory_budget)
+                   for path in paths]
+        for i, future in enumerate(as_completed(futures), 1):
+            path, output_path, pixels, seconds, error = future.result()
+            status = 'FAILED ' + error if error else f'{seconds:.2f}s'
+            print(f'[{i}/{len(paths)}] {os.path.basename(path)}: {status}')
+            results.append({'path': path, 'output': output_path, 'pixels': pixels,
+                            'seconds': seconds, 'error': error})
+    elapsed = time.perf_counter() - start
+
+    done = [x for x in results if x['error'] is None]
+    megapixels = sum(x['pixels'] for x in done) / 1e6
+    summary = {'directory': directory,
+               'filter': key,
+               'settings': settings,
+               'workers': workers,
+               'memory_budget': memory_budget,
+               'images': len(paths),
+               'processed': len(done),
+               'failed': len(results) - len(done),
+               'elapsed_s': elapsed,
+               'images_per_s': len(done) / elapsed if elapsed else 0.0,
+               'megapixels_per_s': megapixels / elapsed if elapsed else 0.0,
+               'mean_image_s': sum(x['seconds'] for x in done) / len(done) if done else 0.0,
+               'files': sorted(results, key=lambda x: x['path'])}
+
+    with open(os.path.join(output_dir, 'summary.json'), 'w') as f:
+        json.dump(summary, f, indent=2)
+    return summary
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Apply an edge detection filter to every image in a directory.')
+    parser.add_argument('directory')
+    parser.add_argument('filter', help='one of: ' + ', '.join(x[:-len('_button')] for x in FILTERS))
+    parser.add_argument('--set', dest='settings', action='append', type=parse_setting, default=[],
+                        metavar='NAME=VALUE', help='filter setting, can be repeated')
+    parser.add_argument('-o', '--output', help='output directory (default: <directory>/filtered)')
+    parser.add_argument('-j', '--workers', type=int, help='number of processes (default: all cores)')
+    parser.add_argument('--format', default='png', help='extension of the written images')
+    parser.add_argument('--tile-budget', type=float, metavar='MB',
+                        help='process every image in tiles within this memory budget per worker')
+    args = parser.parse_args(argv)
+
+    try:
+        summary = run_batch(args.directory, args.filter, dict(args.settings),
+                            args.output or os.path.join(args.directory, 'filtered'),
+                            args.workers, args.format,
+                            int(args.tile_budget * 2**20) if args.tile_budget else None)
+    except (KeyError, TypeError) as e:
+        parser.error(e.args[0] if e.args else str(e))
+
+    print(f"\n{summary['processed']}/{summary['images']} images processed "
+          f"({summary['failed']} failed) with {summary['workers']} workers "
+          f"in {summary['elapsed_s']:.2f}s: {summary['images_per_s']:.2f} images/s, "
+          f"{summary['megapixels_per_s']:.2f} MP/s")
+    return 1 if summary['failed'] else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
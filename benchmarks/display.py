@@ -0,0 +1,112 @@
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+from benchmarks.filters import synthetic_image
+
+""" Memory used to put an image on screen.
+
+    pixmap  the previous display path: rgbSwapped() copy of the image, drawn into a
+            transparent QPixmap padded by 1000 px on every side for panning
+    shared  ImageViewer: one BGRA buffer shared with the QImage painted by ImageItem
+
+    Every case runs in its own process (offscreen Qt platform), so that the RSS numbers
+    are not polluted by the allocator state of the previous case. Linux only (/proc).
+
+    Example:
+        python -m benchmarks.display --sizes 1 12 24 -o display.json """
+
+PAN_MARGIN = 1000
+
+
+def memory_mb():
+    """ (current, peak) resident set size of this process in MB. """
+    values = {}
+    with open('/proc/self/status') as f:
+        for line in f:
+            name, _, value = line.partition(':')
+            if name in ('VmRSS', 'VmHWM'):
+                values[name] = int(value.split()[0]) / 1024
+    return values['VmRSS'], values['VmHWM']
+
+
+def show_pixmap(scene, image):
+    from PyQt5 import QtGui, QtCore
+    from PyQt5.QtGui import QImage
+    height, width = image.shape[:2]
+    q_image = QImage(image.data, width, height, 3 * width, QImage.Format_RGB888).rgbSwapped()
+    pixmap = QtGui.QPixmap(width + 2 * PAN_MARGIN, height + 2 * PAN_MARGIN)
+    pixmap.fill(QtCore.Qt.transparent)
+    painter = QtGui.QPainter(pixmap)
+    painter.drawImage(QtCore.QPoint(PAN_MARGIN, PAN_MARGIN), q_image)
+    painter.end()
+    return scene.addPixmap(pixmap)
+
+
+def child(mode, megapixels):
+    os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+    from PyQt5 import QtWidgets
+    from views.widgets.image_viewer import ImageViewer
+
+    app = QtWidgets.QApplication.instance() or QtWidgets.QApplication([])
+    viewer = ImageViewer()
+    viewer.resize(1280, 960)
+    viewer.show()
+    image = synthetic_image(megapixels)
+    app.processEvents()
+    before, _ = memory_mb()
+
+    if mode == 'pixmap':
+        show_pixmap(viewer.scene, image)
+        viewer.setScene(viewer.scene)
+    else:
+        viewer.loadImage(image)
+    # Paint once, the first paint may allocate the backing store
+    viewer.viewport().repaint()
+    app.processEvents()
+    after, peak = memory_mb()
+
+    print(json.dumps({'mode': mode,
+                      'megapixels': megapixels,
+                      'shape': list(image.shape),
+                      'image_mb': image.nbytes / 2**20,
+                      'display_mb': after - before,
+                      'peak_rss_mb': peak}))
+
+
+def run(sizes, modes):
+    results = []
+    for megapixels in sizes:
+        for mode in modes:
+            output = subprocess.run([sys.executable, '-m', 'benchmarks.display', '--child', mode, str(megapixels)],
+                                    check=True, capture_output=True, text=True).stdout
+            result = json.loads(output.strip().splitlines()[-1])
+            results.append(result)
+            print(f"{mode:>7} {megapixels:>6} MP  image {result['image_mb']:8.1f} MB  "
+                  f"display {result['display_mb']:8.1f} MB  peak RSS {result['peak_rss_mb']:8.1f} MB")
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', nargs='+', type=float, default=[1, 4, 12, 24], help='image sizes in megapixels')
+    parser.add_argument('--modes', nargs='+', choices=['pixmap', 'shared'], default=['pixmap', 'shared'])
+    parser.add_argument('-o', '--output')
+    parser.add_argument('--child', nargs=2, metavar=('MODE', 'MEGAPIXELS'), help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.child:
+        child(args.child[0], float(args.child[1]))
+        return 0
+
+    results = run(args.sizes, args.modes)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,222 @@
+import argparse
+import gc
+import itertools
+import json
+import os
+import platform
+import statistics
+import sys
+import time
+import tracemalloc
+from datetime import datetime, timezone
+
+import cv2
+import numpy as np
+import skimage
+
+from controllers.cache import settings_key
+from controllers.profiling import record_stages
+from controllers.registry import FILTERS, filter_key
+from controllers.scale_space import clear_cache
+from controllers.threads import blas_threads
+
+""" Benchmarks of the functions in controllers/transformation.py.
+
+    run      times every filter over a grid of image sizes and settings and stores the
+             wall time, the peak memory and the per-stage breakdown as JSON
+    compare  matches two such files and reports the cases that got slower
+
+    Examples:
+        python -m benchmarks.filters run -o before.json
+        python -m benchmarks.filters run --quick --filters sobel canny -o after.json
+        python -m benchmarks.filters compare before.json after.json --threshold 0.1 """
+
+SIZES = [0.25, 1, 4, 12, 24, 50] # megapixels
+QUICK_SIZES = [0.25, 1, 4]
+
+DIRECTIONS = ['combined', 'vertical', 'horizontal']
+
+# Every combination the option menus can produce
+GRIDS = {'sobel_button': {'kernel_size': [3, 5, 7], 'direction': DIRECTIONS},
+         'scharr_button': {'direction': DIRECTIONS},
+         'prewitt_button': {'direction': DIRECTIONS},
+         'farid_button': {'direction': DIRECTIONS},
+         'canny_button': {'threshold1': [0.15], 'threshold2': [0.35], 'sigma': [3, 5, 7]},
+         'hessian_button': {'sigmas': list(range(1, 11)), 'black_ridges': [False, True]},
+         'sato_button': {'sigmas': list(range(1, 11)), 'black_ridges': [False, True]},
+         'meijering_button': {'sigmas': list(range(1, 11)), 'black_ridges': [False, True]},
+         'scale_space_button': {'sigmas': list(range(1, 11)), 'black_ridges': [False, True]}}
+
+QUICK_GRIDS = {'sobel_button': {'kernel_size': [3, 7], 'direction': ['combined']},
+               'scharr_button': {'direction': ['combined']},
+               'prewitt_button': {'direction': ['combined']},
+               'farid_button': {'direction': ['combined']},
+               'canny_button': {'threshold1': [0.15], 'threshold2': [0.35], 'sigma': [3]},
+               'hessian_button': {'sigmas': [3, 10], 'black_ridges': [False]},
+               'sato_button': {'sigmas': [3, 10], 'black_ridges': [False]},
+               'meijering_button': {'sigmas': [3, 10], 'black_ridges': [False]},
+               'scale_space_button': {'sigmas': [3, 10], 'black_ridges': [False]}}
+
+
+def synthetic_image(megapixels, seed=0):
+    """ Reproducible 4:3 BGR test image: shading, lines, circles (ridges and edges) and noise. """
+    width = int(round((megapixels * 1e6 * 4 / 3) ** 0.5))
+    height = int(round(megapixels * 1e6 / width))
+    rng = np.random.default_rng(seed)
+
+    row = np.linspace(0, 96, width, dtype=np.float32)
+    column = np.linspace(0, 64, height, dtype=np.float32)
+    gray = (row[None, :] + column[:, None]).astype(np.uint8)
+    image = cv2.merge([gray, gray, gray])
+
+    scale = max(1, width // 1000)
+    for _ in range(int(200 * megapixels ** 0.5)):
+        color = tuple(int(x) for x in rng.integers(0, 256, 3))
+        x1, x2 = rng.integers(0, width, 2)
+        y1, y2 = rng.integers(0, height, 2)
+        cv2.line(image, (int(x1), int(y1)), (int(x2), int(y2)), color, int(rng.integers(1, 4 * scale + 1)))
+        radius = int(rng.integers(5, 50 * scale))
+        cv2.circle(image, (int(x1), int(y2)), radius, color, int(rng.integers(-1, 3 * scale + 1)) or 1)
+
+    noise = rng.normal(0, 8, image.shape).astype(np.int16)
+    return np.clip(image.astype(np.int16) + noise, 0, 255).astype(np.uint8)
+
+
+def grid_settings(grid):
+    names = list(grid)
+    for values in itertools.product(*(grid[name] for name in names)):
+        yield dict(zip(names, values))
+
+
+def measure(func, image, settings, repeat):
+    times, stages = [], []
+    for _ in range(repeat):
+        # Every run computes its scales, none is served from the scale-space cache
+        clear_cache()
+        gc.collect()
+        with record_stages() as recorded:
+            start = time.perf_counter()
+            func(image, **settings)
+            elapsed = time.perf_counter() - start
+        times.append(elapsed)
+        recorded['compute'] = max(0.0, elapsed - sum(recorded.values()))
+        stages.append(recorded)
+
+    # Memory is measured in a separate call, tracing slows the allocations down
+    clear_cache()
+    gc.collect()
+    tracemalloc.start()
+    try:
+        func(image, **settings)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    best = times.index(min(times))
+    return {'wall_s': times[best],
+            'wall_median_s': statistics.median(times),
+            'wall_all_s': times,
+            'peak_mb': peak / 2**20,
+            'stages_s': stages[best]}
+
+
+def environment():
+    return {'timestamp': datetime.now(timezone.utc).isoformat(),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'processor': platform.processor(),
+            'cpu_count': os.cpu_count(),
+            'numpy': np.__version__,
+            'opencv': cv2.__version__,
+            'opencv_threads': cv2.getNumThreads(),
+            'blas_threads': blas_threads(),
+            'skimage': skimage.__version__}
+
+
+def run(filters, sizes, grids, repeat, seed, output):
+    report = {'environment': environment(), 'repeat': repeat, 'seed': seed, 'results': []}
+    for megapixels in sizes:
+        image = synthetic_image(megapixels, seed)
+        for key in filters:
+            for settings in grid_settings(grids[key]):
+                result = measure(FILTERS[key], image, settings, repeat)
+                result.update({'filter': key,
+                               'settings': settings,
+                               'megapixels': megapixels,
+                               'shape': list(image.shape)})
+                report['results'].append(result)
+                print(f"{key[:-len('_button')]:>10} {megapixels:>6} MP {settings_key(settings):<50} "
+                      f"{result['wall_s'] * 1000:10.1f} ms {result['peak_mb']:9.1f} MB")
+
+                # Keep partial results if a long run is interrupted
+                with open(output, 'w') as f:
+                    json.dump(report, f, indent=2)
+        del image
+    return report
+
+
+def case_key(result):
+    return (result['filter'], tuple(result['shape']), settings_key(result['settings']))
+
+
+def compare(baseline_path, candidate_path, threshold):
+    with open(baseline_path) as f:
+        baseline = {case_key(x): x for x in json.load(f)['results']}
+    with open(candidate_path) as f:
+        candidate = {case_key(x): x for x in json.load(f)['results']}
+
+    regressions = []
+    common = [key for key in candidate if key in baseline]
+    for key in common:
+        old, new = baseline[key], candidate[key]
+        ratio = new['wall_s'] / old['wall_s'] if old['wall_s'] else float('inf')
+        memory = new['peak_mb'] / old['peak_mb'] if old['peak_mb'] else float('inf')
+        flag = ''
+        if ratio > 1 + threshold:
+            flag = 'SLOWER'
+            regressions.append(key)
+        elif ratio < 1 - threshold:
+            flag = 'faster'
+        print(f"{key[0][:-len('_button')]:>10} {new['megapixels']:>6} MP {key[2]:<50} "
+              f"{old['wall_s'] * 1000:10.1f} -> {new['wall_s'] * 1000:10.1f} ms (x{ratio:.2f}) "
+              f"mem x{memory:.2f} {flag}")
+
+    print(f'\n{len(common)} cases compared, {len(regressions)} slower by more than {threshold:.0%}, '
+          f'{len(baseline) - len(common)} only in the baseline, {len(candidate) - len(common)} only in the candidate')
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    run_parser = commands.add_parser('run', help='benchmark the filters')
+    run_parser.add_argument('-o', '--output', default='benchmark.json')
+    run_parser.add_argument('--filters', nargs='+', default=list(GRIDS), help='filter names, default: all')
+    run_parser.add_argument('--sizes', nargs='+', type=float, help='image sizes in megapixels')
+    run_parser.add_argument('--repeat', type=int, default=3)
+    run_parser.add_argument('--seed', type=int, default=0)
+    run_parser.add_argument('--quick', action='store_true', help='fewer sizes and settings')
+
+    compare_parser = commands.add_parser('compare', help='compare two benchmark files')
+    compare_parser.add_argument('baseline')
+    compare_parser.add_argument('candidate')
+    compare_parser.add_argument('--threshold', type=float, default=0.1,
+                                help='relative slowdown reported as a regression (default: 0.1)')
+
+    args = parser.parse_args(argv)
+    if args.command == 'compare':
+        return 1 if compare(args.baseline, args.candidate, args.threshold) else 0
+
+    try:
+        filters = [filter_key(x) for x in args.filters]
+    except KeyError as e:
+        parser.error(e.args[0])
+    sizes = args.sizes or (QUICK_SIZES if args.quick else SIZES)
+    grids = QUICK_GRIDS if args.quick else GRIDS
+    run(filters, sizes, grids, args.repeat, args.seed, args.output)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,114 @@
+import argparse
+import json
+import os
+import sys
+
+import numpy as np
+
+from benchmarks.filters import QUICK_GRIDS, environment, grid_settings, measure, synthetic_image
+from benchmarks.reference import REFERENCE_FILTERS
+from controllers.cache import settings_key
+from controllers.registry import FILTERS, filter_key
+
+""" float32 against float64: speed, peak memory and accuracy of every filter.
+
+    Both precisions run on the same image and settings and are compared with the output
+    of the original filter (benchmarks.reference), so that a change of the float64 path
+    is caught too. A precision fails when more than --max-mismatch of its pixels differ
+    from the reference by more than --tolerance gray levels. The exit status is 1 when
+    any case fails. Filters without an original version are compared with their float64
+    output.
+
+    --baseline stores the reference outputs in a .npz file the first time and compares
+    with the stored ones afterwards, e.g. kept from a release.
+
+    Example:
+        python -m benchmarks.precision --sizes 1 12 --baseline baseline.npz -o precision.json """
+
+
+def compare_outputs(reference, candidate, tolerance):
+    difference = np.abs(reference.astype(np.int16) - candidate.astype(np.int16))
+    return {'max_difference': int(difference.max()),
+            'mean_difference': float(difference.mean()),
+            'mismatch': float(np.count_nonzero(difference > tolerance) / difference.size)}
+
+
+def case_id(key, settings, megapixels, seed):
+    return f'{key}|{megapixels}|{seed}|{settings_key(settings)}'
+
+
+def run(filters, sizes, repeat, tolerance, max_mismatch, baseline=None, seed=0):
+    """ baseline: {case_id: reference output}, missing cases are added to it. """
+    baseline = {} if baseline is None else baseline
+    report = {'environment': environment(), 'tolerance': tolerance, 'max_mismatch': max_mismatch, 'results': []}
+    failures = 0
+    for megapixels in sizes:
+        image = synthetic_image(megapixels, seed)
+        for key in filters:
+            for settings in grid_settings(QUICK_GRIDS[key]):
+                func = FILTERS[key]
+                timings = {precision: measure(func, image, dict(settings, precision=precision), repeat)
+                           for precision in ('float64', 'float32')}
+                outputs = {precision: func(image, **settings, precision=precision)
+                           for precision in ('float64', 'float32')}
+                case = case_id(key, settings, megapixels, seed)
+                if case not in baseline:
+                    reference = REFERENCE_FILTERS.get(key)
+                    baseline[case] = outputs['float64'] if reference is None else reference(image, **settings)
+                accuracy = {precision: compare_outputs(baseline[case], output, tolerance)
+                            for precision, output in outputs.items()}
+                passed = all(x['mismatch'] <= max_mismatch for x in accuracy.values())
+                failures += not passed
+
+                report['results'].append({'filter': key, 'settings': settings, 'megapixels': megapixels,
+                                          'float64': timings['float64'], 'float32': timings['float32'],
+                                          'accuracy': accuracy, 'passed': passed})
+                speedup = timings['float64']['wall_s'] / timings['float32']['wall_s']
+                memory = timings['float32']['peak_mb'] / timings['float64']['peak_mb'] if timings['float64']['peak_mb'] else 0
+                differences = '  '.join(f"{precision} max diff {x['max_difference']:3d} mismatch {x['mismatch']:.4%}"
+                                        for precision, x in accuracy.items())
+                print(f"{key[:-len('_button')]:>11} {megapixels:>6} MP {settings_key(settings):<45} "
+                      f"x{speedup:5.2f} faster  mem x{memory:4.2f}  {differences}"
+                      f"{'' if passed else '  FAIL'}")
+    return report, failures
+
+
+def load_baseline(path):
+    if not path or not os.path.exists(path):
+        return {}
+    with np.load(path) as stored:
+        return {case: stored[case] for case in stored.files}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--filters', nargs='+', default=list(QUICK_GRIDS), help='filter names, default: all')
+    parser.add_argument('--sizes', nargs='+', type=float, default=[1, 4], help='image sizes in megapixels')
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--tolerance', type=int, default=1, help='allowed difference in gray levels (default: 1)')
+    parser.add_argument('--max-mismatch', type=float, default=0.001,
+                        help='allowed fraction of pixels above the tolerance (default: 0.001)')
+    parser.add_argument('--baseline', help='.npz of reference outputs, written when it does not exist')
+    parser.add_argument('-o', '--output')
+    args = parser.parse_args(argv)
+
+    try:
+        filters = [filter_key(x) for x in args.filters]
+    except KeyError as e:
+        parser.error(e.args[0])
+    # cv_ridge_filter has no float computation to compare
+    filters = [x for x in filters if x in QUICK_GRIDS]
+    baseline = load_baseline(args.baseline)
+    stored = len(baseline)
+    report, failures = run(filters, args.sizes, args.repeat, args.tolerance, args.max_mismatch, baseline)
+    if args.baseline and len(baseline) > stored:
+        np.savez_compressed(args.baseline, **baseline)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+    print(f"\n{len(report['results'])} cases, {failures} outside the tolerance")
+    return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
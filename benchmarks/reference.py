@@ -0,0 +1,85 @@
+import cv2
+import numpy as np
+from skimage.feature import canny
+from skimage.filters import hessian, sato, meijering, prewitt, farid
+
+""" The filters as they were before the float32, shared-gradient and scale-space work,
+    written out again from the first version of controllers/transformation.py. Their
+    outputs are the ground truth of benchmarks.precision, so that both precisions of the
+    current filters are checked against what the application used to produce and not
+    only against each other. scale_space has no earlier version. """
+
+AXES = {'vertical': 1, 'horizontal': 0}
+
+
+def _gray(image):
+    return cv2.cvtColor(image, cv2.COLOR_BGR2GRAY) if image.ndim == 3 else image
+
+
+def _to_uint8(response):
+    return cv2.normalize(response, None, 0, 255, cv2.NORM_MINMAX, cv2.CV_8U)
+
+
+def _ridge_to_uint8(response):
+    response = response - np.min(response)
+    response = response / np.max(response)
+    return cv2.equalizeHist((response * 255).astype(np.uint8))
+
+
+def _derivative(image, operator, direction, kernel_size=None):
+    ksize = {} if kernel_size is None else {'ksize': kernel_size}
+    dx = operator(image, cv2.CV_64F, 1, 0, **ksize)
+    dy = operator(image, cv2.CV_64F, 0, 1, **ksize)
+    match direction:
+        case 'combined':
+            return _to_uint8(np.sqrt(dx**2 + dy**2))
+        case 'vertical':
+            return _to_uint8(dx)
+        case 'horizontal':
+            return _to_uint8(dy)
+
+
+def sobel_filter(image, kernel_size=3, direction='combined'):
+    return _derivative(_gray(image), cv2.Sobel, direction, kernel_size)
+
+
+def scharr_filter(image, direction='combined'):
+    return _derivative(_gray(image), cv2.Scharr, direction)
+
+
+def prewitt_filter(image, direction='combined'):
+    image = _gray(image)
+    return _to_uint8(prewitt(image) if direction == 'combined' else prewitt(image, axis=AXES[direction]))
+
+
+def farid_filter(image, direction='combined'):
+    image = _gray(image)
+    return _to_uint8(farid(image) if direction == 'combined' else farid(image, axis=AXES[direction]))
+
+
+def canny_edge_detection(image, threshold1, threshold2, sigma=3):
+    edges = canny(_gray(image), sigma=sigma, low_threshold=threshold1, high_threshold=threshold2,
+                  use_quantiles=True)
+    return edges.astype(np.uint8) * 255
+
+
+def hessian_filter(image, black_ridges=False, sigmas=10):
+    return _ridge_to_uint8(hessian(_gray(image), sigmas=(1, sigmas), black_ridges=black_ridges))
+
+
+def sato_filter(image, black_ridges=False, sigmas=10):
+    return _ridge_to_uint8(sato(_gray(image), sigmas=(1, sigmas), black_ridges=black_ridges))
+
+
+def meijering_filter(image, black_ridges=False, sigmas=10):
+    return _ridge_to_uint8(meijering(_gray(image), sigmas=(1, sigmas), black_ridges=black_ridges))
+
+
+REFERENCE_FILTERS = {'sobel_button': sobel_filter,
+                     'scharr_button': scharr_filter,
+                     'prewitt_button': prewitt_filter,
+                     'farid_button': farid_filter,
+                     'canny_button': canny_edge_detection,
+                     'hessian_button': hessian_filter,
+                     'sato_button': sato_filter,
+                     'meijering_button': meijering_filter}
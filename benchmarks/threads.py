@@ -0,0 +1,111 @@
+import argparse
+import json
+import os
+import sys
+
+from benchmarks.filters import QUICK_GRIDS, environment, grid_settings, measure, synthetic_image
+from controllers.cache import settings_key
+from controllers.registry import FILTERS, filter_key
+from controllers.threads import thread_limits
+from controllers.tiling import TILED_FILTERS, run_tiled
+
+""" Thread scaling of every filter: how much faster it gets with more threads.
+
+    library  the filter itself with the OpenCV and BLAS pools limited to 1..N threads
+    tiled    the tiled implementation with 1..N tile workers (the libraries single-threaded)
+
+    The speedup is against the first thread count (1 by default), the efficiency is the
+    speedup per added thread. The 'saturates at' column is the fewest threads reaching 90%
+    of the best speedup, the number worth giving the filter (EDGE_DETECTION_OPENCV_THREADS,
+    EDGE_DETECTION_FILTER_WORKERS).
+
+    Example:
+        python -m benchmarks.threads --threads 1 2 4 8 --tiled -o threads.json """
+
+SATURATION = 0.9
+
+
+def default_threads():
+    counts, n = [], 1
+    while n < (os.cpu_count() or 1):
+        counts.append(n)
+        n *= 2
+    return counts + [os.cpu_count() or 1]
+
+
+def tiled(key):
+    """ The tiled filter with the tile workers as a setting, for measure. """
+    def run(image, workers, **settings):
+        return run_tiled(image, key, settings, workers=workers)
+    return run
+
+
+def saturation(results):
+    best = max(x['speedup'] for x in results)
+    return min(x['threads'] for x in results if x['speedup'] >= SATURATION * best)
+
+
+def scale(func, image, settings, threads, repeat, mode):
+    """ [{threads, wall_s, speedup, efficiency}] of func at every thread count. """
+    results = []
+    for count in threads:
+        if mode == 'library':
+            with thread_limits(opencv=count, blas=count):
+                timing = measure(func, image, settings, repeat)
+        else:
+            with thread_limits(opencv=1, blas=1):
+                timing = measure(func, image, dict(settings, workers=count), repeat)
+        results.append({'threads': count, 'wall_s': timing['wall_s'], 'peak_mb': timing['peak_mb']})
+    baseline = results[0]
+    for x in results:
+        x['speedup'] = baseline['wall_s'] / x['wall_s']
+        x['efficiency'] = x['speedup'] * baseline['threads'] / x['threads']
+    return results
+
+
+def run(filters, megapixels, threads, repeat, with_tiled, seed=0):
+    image = synthetic_image(megapixels, seed)
+    report = {'environment': environment(), 'megapixels': megapixels, 'threads': threads, 'results': []}
+    modes = ('library', 'tiled') if with_tiled else ('library',)
+    print(f"{'filter':>11} {'mode':>8} {'settings':<40}" + ''.join(f'{n:>9}' for n in threads) + '  saturates at')
+    for key in filters:
+        for settings in grid_settings(QUICK_GRIDS[key]):
+            for mode in modes:
+                if mode == 'tiled' and key not in TILED_FILTERS:
+                    continue
+                func = FILTERS[key] if mode == 'library' else tiled(key)
+                results = scale(func, image, settings, threads, repeat, mode)
+                report['results'].append({'filter': key, 'mode': mode, 'settings': settings,
+                                          'scaling': results, 'saturates_at': saturation(results)})
+                print(f"{key[:-len('_button')]:>11} {mode:>8} {settings_key(settings):<40}"
+                      + ''.join(f"{'x' + format(x['speedup'], '.2f'):>9}" for x in results)
+                      + f"  {saturation(results)}")
+    return report
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--filters', nargs='+', default=list(QUICK_GRIDS), help='filter names, default: all')
+    parser.add_argument('--size', type=float, default=4, help='image size in megapixels (default: 4)')
+    parser.add_argument('--threads', nargs='+', type=int, default=default_threads(),
+                        help='thread counts, the smallest is the baseline (default: 1, 2, 4... up to the cores)')
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--tiled', action='store_true', help='also scale the tile workers of the tiled filters')
+    parser.add_argument('-o', '--output')
+    args = parser.parse_args(argv)
+
+    try:
+        filters = [filter_key(x) for x in args.filters]
+    except KeyError as e:
+        parser.error(e.args[0])
+    # cv_ridge_filter has no settings grid
+    filters = [x for x in filters if x in QUICK_GRIDS]
+    report = run(filters, args.size, sorted(set(args.threads)), args.repeat, args.tiled)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
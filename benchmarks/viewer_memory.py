@@ -0,0 +1,61 @@
+import argparse
+import os
+import sys
+
+from benchmarks.display import memory_mb
+from benchmarks.filters import synthetic_image
+from controllers.registry import FILTERS, filter_key
+
+""" Memory stability of the viewer: applies a filter many times to the same image and
+    shows every result, as repeated clicks on Apply do. After the undo history is full
+    the resident set size has to stay flat; the exit status is 1 when it grew by more
+    than the tolerance between the end of the warm-up and the last iteration.
+
+    Example:
+        python -m benchmarks.viewer_memory --iterations 500 --megapixels 4 """
+
+
+def run(filter_name, megapixels, iterations, warmup, tolerance_mb):
+    os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+    from PyQt5 import QtWidgets
+    from views.widgets.image_viewer import ImageViewer
+
+    app = QtWidgets.QApplication.instance() or QtWidgets.QApplication([])
+    viewer = ImageViewer()
+    viewer.resize(1280, 960)
+    viewer.show()
+    image = synthetic_image(megapixels)
+    func = FILTERS[filter_key(filter_name)]
+
+    baseline = None
+    for i in range(1, iterations + 1):
+        viewer.loadImage(func(image))
+        viewer.viewport().repaint()
+        app.processEvents()
+        rss, _ = memory_mb()
+        if i == warmup:
+            baseline = rss
+        if i % 50 == 0 or i == iterations:
+            print(f'{i:>6} results  RSS {rss:8.1f} MB  history {len(viewer.history)}')
+
+    growth = rss - baseline
+    print(f'RSS growth after the warm-up: {growth:.1f} MB (tolerance {tolerance_mb} MB)')
+    return growth <= tolerance_mb
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--filter', default='sobel')
+    parser.add_argument('--megapixels', type=float, default=4)
+    parser.add_argument('--iterations', type=int, default=500)
+    parser.add_argument('--warmup', type=int, default=50,
+                        help='iterations before the reference measurement, more than the history size')
+    parser.add_argument('--tolerance', type=float, default=64, help='allowed RSS growth in MB')
+    args = parser.parse_args(argv)
+    if args.warmup >= args.iterations:
+        parser.error('--warmup has to be smaller than --iterations')
+    return 0 if run(args.filter, args.megapixels, args.iterations, args.warmup, args.tolerance) else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
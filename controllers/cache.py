@@ -0,0 +1,215 @@
+import functools
+import hashlib
+import inspect
+import json
+import os
+import tempfile
+import threading
+import weakref
+from collections import OrderedDict
+import numpy as np
+
+""" Memoization of the transformation results.
+    Results are keyed by (image content hash, filter name, normalized settings) and kept
+    in a memory LRU bounded by the total size of the arrays, with an optional directory
+    of .npy files as a second, larger tier. """
+
+# id(image) -> (weak reference, digest), so the same array is hashed only once
+_digests = {}
+_digests_lock = threading.Lock()
+
+
+def image_digest(image):
+    """ Content hash of an array. Arrays are never modified in place in this application,
+        so the digest of an array object is computed once and remembered while it lives. """
+    with _digests_lock:
+        entry = _digests.get(id(image))
+        if entry is not None and entry[0]() is image:
+            return entry[1]
+
+    h = hashlib.blake2b(digest_size=16)
+    h.update(f'{image.shape}{image.dtype.str}'.encode())
+    h.update(np.ascontiguousarray(image).data)
+    digest = h.hexdigest()
+
+    image_id = id(image)
+    def forget(_, image_id=image_id):
+        with _digests_lock:
+            _digests.pop(image_id, None)
+    with _digests_lock:
+        _digests[image_id] = (weakref.ref(image, forget), digest)
+    return digest
+
+
+def settings_key(settings):
+    """ Stable text form of a settings dict (order independent, numpy scalars as numbers). """
+    def default(value):
+        if isinstance(value, np.generic):
+            return value.item()
+        return repr(value)
+    return json.dumps(settings, sort_keys=True, default=default)
+
+
+class LRUCache():
+    """ Thread-safe LRU mapping bounded by the total size of the values in bytes. """
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self._items = OrderedDict() # key -> (value, nbytes)
+        self._nbytes = 0
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def sizeof(value):
+        if isinstance(value, np.ndarray):
+            return value.nbytes
+        if isinstance(value, (tuple, list)):
+            return sum(LRUCache.sizeof(x) for x in value)
+        if isinstance(value, dict):
+            return sum(LRUCache.sizeof(x) for x in value.values())
+        return 0
+
+    @property
+    def nbytes(self):
+        return self._nbytes
+
+    def __len__(self):
+        return len(self._items)
+
+    def __contains__(self, key):
+        return key in self._items
+
+    def get(self, key, default=None):
+        with self._lock:
+            if key not in self._items:
+                return default
+            self._items.move_to_end(key)
+            return self._items[key][0]
+
+    def put(self, key, value, nbytes=None):
+        nbytes = self.sizeof(value) if nbytes is None else nbytes
+        if nbytes > self.max_bytes:
+            return False
+        with self._lock:
+            if key in self._items:
+                self._nbytes -= self._items.pop(key)[1]
+            self._items[key] = (value, nbytes)
+            self._nbytes += nbytes
+            while self._nbytes > self.max_bytes:
+                _, (_, size) = self._items.popitem(last=False)
+                self._nbytes -= size
+        return True
+
+    def pop(self, key, default=None):
+        with self._lock:
+            if key not in self._items:
+                return default
+            value, nbytes = self._items.pop(key)
+            self._nbytes -= nbytes
+            return value
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+            self._nbytes = 0
+
+
+class DiskCache():
+    """ Directory of .npy files, evicting the least recently used ones above max_bytes. """
+
+    def __init__(self, directory, max_bytes):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, key):
+        return os.path.join(self.directory, f'{key}.npy')
+
+    def get(self, key):
+        path = self._path(key)
+        try:
+            value = np.load(path, allow_pickle=False)
+        except (OSError, ValueError):
+            return None
+        os.utime(path) # mark as recently used
+        return value
+
+    def put(self, key, value):
+        if value.nbytes > self.max_bytes:
+            return
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                np.save(f, value, allow_pickle=False)
+            os.replace(tmp_path, self._path(key))
+        except OSError:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            return
+        self._evict()
+
+    def _evict(self):
+        with self._lock:
+            entries = []
+            for entry in os.scandir(self.directory):
+                if entry.name.endswith('.npy'):
+                    stat = entry.stat()
+                    entries.append((stat.st_mtime, stat.st_size, entry.path))
+            total = sum(x[1] for x in entries)
+            for _, size, path in sorted(entries):
+                if total <= self.max_bytes:
+                    break
+                try:
+                    os.remove(path)
+                except OSError:
+                    continue
+                total -= size
+
+
+class ResultCache():
+    def __init__(self, max_bytes=512 * 2**20, directory=None, max_disk_bytes=4 * 2**30):
+        self.memory = LRUCache(max_bytes)
+        self.disk = DiskCache(directory, max_disk_bytes) if directory else None
+
+    def key(self, image, name, settings):
+        text = f'{image_digest(image)}|{name}|{settings_key(settings)}'
+        return hashlib.blake2b(text.encode(), digest_size=16).hexdigest()
+
+    def get(self, key):
+        result = self.memory.get(key)
+        if result is None and self.disk is not None:
+            result = self.disk.get(key)
+            if result is not None:
+                self.memory.put(key, result)
+        return result
+
+    def put(self, key, result):
+        if not isinstance(result, np.ndarray):
+            return
+        self.memory.put(key, result)
+        if self.disk is not None:
+            self.disk.put(key, result)
+
+    def clear(self):
+        self.memory.clear()
+
+    def wrap(self, name, func):
+        """ Returns func memoized on (image, name, settings). The settings are completed
+            with the defaults of func, so omitting an argument or passing its default
+            value end up in the same entry. """
+        signature = inspect.signature(func)
+
+        @functools.wraps(func)
+        def cached(image, **settings):
+            arguments = signature.bind(image, **settings)
+            arguments.apply_defaults()
+            normalized = dict(list(arguments.arguments.items())[1:])
+
+            key = self.key(image, name, normalized)
+            result = self.get(key)
+            if result is None:
+                result = func(image, **settings)
+                self.put(key, result)
+            return result
+        return cached
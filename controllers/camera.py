@@ -0,0 +1,249 @@
+import threading
+import time
+import traceback
+from collections import namedtuple, deque
+from PyQt5.QtCore import QObject, pyqtSignal
+import cv2
+from .display import to_display_buffer
+from .stream import DEFAULT_FPS, open_capture
+
+""" Live edge detection on a camera.
+
+    Capture, filter and display run on their own threads (the display on the GUI thread)
+    and hand frames over through single-item slots where a newer frame replaces the one
+    not taken yet: a slow filter or a busy GUI skips frames instead of falling behind the
+    camera. Every frame carries the time of each stage (capture: retrieving the grabbed
+    frame, filter, convert to the display buffer, paint) and the time it was grabbed, from
+    which LatencyStats makes the per-stage latency, the end-to-end latency and the
+    displayed frame rate. The wait for the device to deliver a frame is not counted.
+
+    FakeCamera plays a video file or an image sequence at a camera-like pace, for tests
+    and demos without a device. """
+
+STAGES = ('capture', 'filter', 'convert', 'paint')
+
+# timings: {stage: seconds}, display: the (buffer, QImage) of to_display_buffer
+Frame = namedtuple('Frame', ['index', 'image', 'display', 'captured', 'timings'])
+
+
+class LatestSlot():
+    """ One-item handoff between threads, put() replaces the item not taken yet. """
+
+    def __init__(self):
+        self._item = None
+        self._condition = threading.Condition()
+        self.replaced = 0
+
+    def put(self, item):
+        with self._condition:
+            if self._item is not None:
+                self.replaced += 1
+            self._item = item
+            self._condition.notify()
+
+    def take(self, timeout=None):
+        """ The newest item, waiting up to timeout for one. None when there is none. """
+        with self._condition:
+            if self._item is None:
+                self._condition.wait(timeout)
+            item, self._item = self._item, None
+            return item
+
+    def __bool__(self):
+        return self._item is not None
+
+
+class FakeCamera():
+    """ A camera played from a video file or an image sequence (see open_capture): frames
+        come at fps, the rate of the file by default, and the file loops. Has the part of
+        the cv2.VideoCapture interface that LiveCamera uses. """
+
+    def __init__(self, path, fps=None, loop=True):
+        self.path = path
+        self.loop = loop
+        self._capture = open_capture(path)
+        self.fps = fps or self._capture.get(cv2.CAP_PROP_FPS) or DEFAULT_FPS
+        self._next_frame = None
+
+    def isOpened(self):
+        return self._capture.isOpened()
+
+    def grab(self):
+        # A camera delivers at its own rate, however fast the frames are grabbed
+        now = time.perf_counter()
+        if self._next_frame is not None and now < self._next_frame:
+            time.sleep(self._next_frame - now)
+        self._next_frame = max(now, self._next_frame or now) + 1 / self.fps
+
+        ok = self._capture.grab()
+        if not ok and self.loop:
+            # Reopened: seeking back is not supported by every backend (image sequences)
+            self._capture.release()
+            self._capture = open_capture(self.path)
+            ok = self._capture.grab()
+        return ok
+
+    def retrieve(self):
+        return self._capture.retrieve()
+
+    def read(self):
+        if not self.grab():
+            return False, None
+        return self.retrieve()
+
+    def get(self, prop):
+        if prop == cv2.CAP_PROP_FPS:
+            return self.fps
+        return self._capture.get(prop)
+
+    def release(self):
+        self._capture.release()
+
+
+def open_camera(device):
+    """ A camera index (0, '0') opens that device, anything else is the path of a FakeCamera.
+        Raises OSError when it cannot be opened. """
+    if isinstance(device, str) and device.isdigit():
+        device = int(device)
+    if isinstance(device, int):
+        camera = cv2.VideoCapture(device)
+        if not camera.isOpened():
+            raise OSError(f"Cannot open camera {device}")
+        return camera
+    return FakeCamera(device)
+
+
+class LiveCamera(QObject):
+    """ start(), then frameAvailable whenever takeFrame() has a frame to show; the GUI calls
+        frameShown() once it is painted, no other frame is announced before that. """
+    frameAvailable = pyqtSignal()
+    failed = pyqtSignal(str)
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self._threads = []
+        self._stop = threading.Event()
+        self._filter = (None, {})
+        self._frames = LatestSlot()
+        self._results = LatestSlot()
+        self._display_lock = threading.Lock()
+        self._display_pending = False
+
+    def start(self, device, func=None, settings=None):
+        """ Shows the camera (see open_camera) through func(frame, **settings), unfiltered
+            when func is None. """
+        self.stop()
+        camera = open_camera(device)
+        self._stop = threading.Event()
+        self._filter = (func, dict(settings or {}))
+        self._frames = LatestSlot()
+        self._results = LatestSlot()
+        self._display_pending = False
+        self._threads = [threading.Thread(target=self._capture, args=(camera, self._stop),
+                                          name='camera-capture', daemon=True),
+                         threading.Thread(target=self._process, args=(self._stop,),
+                                          name='camera-filter', daemon=True)]
+        for thread in self._threads:
+            thread.start()
+
+    def setFilter(self, func, settings=None):
+        self._filter = (func, dict(settings or {}))
+
+    def isRunning(self):
+        return any(thread.is_alive() for thread in self._threads)
+
+    def stop(self):
+        self._stop.set()
+        for thread in self._threads:
+            thread.join()
+        self._threads = []
+
+    def dropped(self):
+        """ Frames replaced before the filter or the display took them. """
+        return self._frames.replaced + self._results.replaced
+
+    def takeFrame(self):
+        return self._results.take(0)
+
+    def frameShown(self):
+        with self._display_lock:
+            self._display_pending = bool(self._results)
+        if self._display_pending:
+            self.frameAvailable.emit()
+
+    def _capture(self, camera, stop):
+        index = 0
+        try:
+            while not stop.is_set():
+                # grab() waits for the next frame of the device; the frame exists from then
+                # on, the wait is the frame interval and not latency
+                ok = camera.grab()
+                start = time.perf_counter()
+                if ok:
+                    ok, image = camera.retrieve()
+                if not ok:
+                    self.failed.emit('The camera stopped delivering frames')
+                    break
+                self._frames.put(Frame(index, image, None, start, {'capture': time.perf_counter() - start}))
+                index += 1
+        finally:
+            camera.release()
+            stop.set()
+
+    def _process(self, stop):
+        try:
+            while not stop.is_set():
+                frame = self._frames.take(0.1)
+                if frame is None:
+                    continue
+                func, settings = self._filter
+                start = time.perf_counter()
+                result = frame.image if func is None else func(frame.image, **settings)
+                converted = time.perf_counter()
+                # The BGR to BGRA conversion of the display is done here, off the GUI thread
+                display = to_display_buffer(result)
+                timings = dict(frame.timings, filter=converted - start, convert=time.perf_counter() - converted)
+                self._results.put(frame._replace(image=result, display=display, timings=timings))
+
+                with self._display_lock:
+                    announce = not self._display_pending
+                    self._display_pending = True
+                if announce:
+                    self.frameAvailable.emit()
+        except Exception:
+            stop.set()
+            self.failed.emit(traceback.format_exc())
+
+
+class LatencyStats():
+    """ Per-stage and end-to-end latency and frame rate over the frames shown in the last
+        window seconds. """
+
+    def __init__(self, window=1.0):
+        self.window = window
+        self._frames = deque() # (shown at, timings, end-to-end seconds)
+
+    def record(self, frame, shown_at):
+        self._frames.append((shown_at, frame.timings, shown_at - frame.captured))
+        while self._frames and self._frames[0][0] < shown_at - self.window:
+            self._frames.popleft()
+
+    def fps(self):
+        if len(self._frames) < 2:
+            return 0.0
+        return (len(self._frames) - 1) / (self._frames[-1][0] - self._frames[0][0])
+
+    def latency(self):
+        """ {stage: mean milliseconds} with 'end-to-end' for capture start to painted. """
+        if not self._frames:
+            return {}
+        result = {stage: 1000 * sum(x[1].get(stage, 0.0) for x in self._frames) / len(self._frames)
+                  for stage in STAGES}
+        result['end-to-end'] = 1000 * sum(x[2] for x in self._frames) / len(self._frames)
+        return result
+
+    def summary(self, dropped=0):
+        latency = self.latency()
+        stages = ' | '.join(f'{stage} {latency.get(stage, 0.0):.1f} ms' for stage in STAGES)
+        return (f"{stages}\nend-to-end {latency.get('end-to-end', 0.0):.1f} ms | "
+                f"{self.fps():.1f} fps | {dropped} dropped")
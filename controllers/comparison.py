@@ -0,0 +1,107 @@
+import inspect
+import os
+import time
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from .cache import image_digest
+from .gradient import gradient
+from .precision import DEFAULT_PRECISION
+from .registry import FILTERS
+from .scale_space import hessian_eigenvalues, clear_cache
+from .transformation import to_grayscale, normalize_to_uint8
+
+""" Several filters of the registry applied to one image at once, for side-by-side comparison.
+    The grayscale image is made once. The intermediates that several filters have in
+    common are computed first, in parallel: the x/y derivatives of every gradient family
+    (combined, vertical and horizontal are all read from them) and the Hessian eigenvalues
+    of every ridge scale (kept in the scale-space cache the ridge filters read from). The
+    filters then run concurrently on top of them. """
+
+# Settings for the filters that have no default for some of their arguments
+DEFAULT_SETTINGS = {'canny_button': {'threshold1': 0.15, 'threshold2': 0.35}}
+
+GRADIENT_FAMILIES = {'sobel_button': 'sobel',
+                     'scharr_button': 'scharr',
+                     'prewitt_button': 'prewitt',
+                     'farid_button': 'farid'}
+RIDGE_FILTERS = ('hessian_button', 'sato_button', 'meijering_button')
+# cv_ridge_filter takes its settings as one positional dict and has no defaults to compare with
+COMPARABLE_FILTERS = [key for key in FILTERS if key != 'cvridgefilter_button']
+
+ComparisonResult = namedtuple('ComparisonResult', ['key', 'settings', 'image', 'seconds'])
+ComparisonReport = namedtuple('ComparisonReport', ['results', 'wall_s', 'task_s', 'sequential_s'])
+
+
+def complete_settings(key, settings=None):
+    """ settings with the defaults of the filter (and DEFAULT_SETTINGS) filled in. """
+    func = FILTERS[key]
+    settings = {**DEFAULT_SETTINGS.get(key, {}), **(settings or {})}
+    arguments = inspect.signature(func).bind(None, **settings)
+    arguments.apply_defaults()
+    return dict(list(arguments.arguments.items())[1:])
+
+
+def _gradient_key(key, settings):
+    family = GRADIENT_FAMILIES[key]
+    kernel_size = settings.get('kernel_size', 3) if family == 'sobel' else 3
+    return family, kernel_size, settings.get('precision', DEFAULT_PRECISION)
+
+
+def _ridge_scales(settings):
+    precision = settings.get('precision', DEFAULT_PRECISION)
+    return {(sigma, precision) for sigma in (settings['min_sigma'], settings['sigmas'])}
+
+
+def compare_filters(image, entries, workers=None, sequential=False):
+    """ entries: [(registry key, settings), ...]. Returns a ComparisonReport whose results
+        are in the order of entries. task_s is the sum of the times of every task (shared
+        intermediates and filters). With sequential, the filters are afterwards also run
+        one after the other the way single Applies run them, with a cold scale-space cache,
+        and sequential_s is their total time; otherwise it is None. """
+    workers = workers or os.cpu_count() or 1
+    entries = [(key, complete_settings(key, settings)) for key, settings in entries]
+    start = time.perf_counter()
+    gray = to_grayscale(image)
+    digest = image_digest(gray)
+
+    gradient_keys = list({_gradient_key(key, settings) for key, settings in entries if key in GRADIENT_FAMILIES})
+    ridge_scales = set()
+    for key, settings in entries:
+        if key in RIDGE_FILTERS:
+            ridge_scales |= _ridge_scales(settings)
+
+    def timed(func, *args):
+        task_start = time.perf_counter()
+        return func(*args), time.perf_counter() - task_start
+
+    with ThreadPoolExecutor(workers) as pool:
+        # Shared intermediates first, every one of them exactly once
+        shared = [pool.submit(timed, gradient, gray, family, kernel_size, 'xy', precision)
+                  for family, kernel_size, precision in gradient_keys]
+        shared += [pool.submit(timed, hessian_eigenvalues, gray, sigma, digest, True, precision)
+                   for sigma, precision in ridge_scales]
+        shared = [x.result() for x in shared]
+        gradients = dict(zip(gradient_keys, (x[0] for x in shared)))
+        task_s = sum(x[1] for x in shared)
+
+        def run(entry):
+            key, settings = entry
+            if key in GRADIENT_FAMILIES:
+                components = gradients[_gradient_key(key, settings)]
+                result, seconds = timed(lambda: normalize_to_uint8(components.response(settings['direction'])))
+            else:
+                result, seconds = timed(lambda: FILTERS[key](gray, **settings))
+            return ComparisonResult(key, settings, result, seconds)
+
+        results = list(pool.map(run, entries))
+    wall = time.perf_counter() - start
+    task_s += sum(x.seconds for x in results)
+
+    sequential_s = None
+    if sequential:
+        clear_cache()
+        sequential_start = time.perf_counter()
+        for key, settings in entries:
+            FILTERS[key](image, **settings)
+        sequential_s = time.perf_counter() - sequential_start
+    return ComparisonReport(results, wall, task_s, sequential_s)
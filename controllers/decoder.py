@@ -0,0 +1,127 @@
+from PyQt5.QtCore import QObject, QRunnable, QThreadPool, pyqtSignal, pyqtSlot
+import os
+import traceback
+from .cache import LRUCache
+from .loaders import load_image
+
+""" Decoding of the images of the list off the GUI thread.
+    The image asked for is decoded first; the neighbours of the list item (the next and
+    previous ones, nearest first) are decoded speculatively at a lower priority into a
+    decoded-image LRU bounded in bytes, so that stepping through a folder finds them
+    ready. Prefetches that are no longer around the current item are dropped before they
+    start. Entries are keyed by path, modification time and size, an edited file is
+    decoded again. """
+
+PREFETCH_COUNT = 2
+DECODED_CACHE_BYTES = 512 * 2**20
+REQUEST_PRIORITY = 1
+PREFETCH_PRIORITY = 0
+
+
+def decode_image(path):
+    """ The image as ImageViewer.loadImage reads it, None when it cannot be decoded. """
+    return load_image(path)
+
+
+class DecodeSignals(QObject):
+    decoded = pyqtSignal(object, object) # cache key, image
+    failed = pyqtSignal(object, str)
+
+
+class DecodeJob(QRunnable):
+    def __init__(self, key, signals):
+        super().__init__()
+        self.setAutoDelete(False)
+        self.key = key
+        self.signals = signals
+
+    @pyqtSlot()
+    def run(self):
+        try:
+            image = decode_image(self.key[0])
+        except Exception: # escaping run() would abort the application
+            self.signals.failed.emit(self.key, traceback.format_exc())
+            return
+        if image is None:
+            self.signals.failed.emit(self.key, f"Cannot decode image: {self.key[0]}")
+        else:
+            self.signals.decoded.emit(self.key, image)
+
+
+class ImageDecoder(QObject):
+    """ request(path) delivers the decoded image through imageReady, right away when it is
+        cached. prefetch(paths) decodes the paths in the background in the given order. """
+    imageReady = pyqtSignal(str, object) # path, image
+    failed = pyqtSignal(str, str)        # path, message
+
+    def __init__(self, max_bytes=DECODED_CACHE_BYTES, max_workers=2):
+        super().__init__()
+        self._cache = LRUCache(max_bytes)
+        self._pool = QThreadPool()
+        self._pool.setMaxThreadCount(max_workers)
+        self._jobs = {}      # key -> DecodeJob queued or running
+        self._wanted = None  # key of the requested image
+        self._signals = DecodeSignals()
+        self._signals.decoded.connect(self._on_decoded)
+        self._signals.failed.connect(self._on_failed)
+
+    @staticmethod
+    def key(path):
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return (path, None, None)
+        return (path, stat.st_mtime_ns, stat.st_size)
+
+    def request(self, path):
+        key = self.key(path)
+        image = self._cache.get(key)
+        if image is not None:
+            self._wanted = None
+            self.imageReady.emit(path, image)
+            return
+        self._wanted = key
+        job = self._jobs.get(key)
+        if job is not None:
+            # A queued prefetch of the same image is moved to the front
+            if not self._pool.tryTake(job):
+                return
+        self._start(key, REQUEST_PRIORITY)
+
+    def prefetch(self, paths):
+        keys = [self.key(path) for path in paths]
+        # Queued prefetches of images which are no longer neighbours are dropped
+        for key, job in list(self._jobs.items()):
+            if key not in keys and key != self._wanted and self._pool.tryTake(job):
+                del self._jobs[key]
+        for key in keys:
+            if key not in self._jobs and key not in self._cache:
+                self._start(key, PREFETCH_PRIORITY)
+
+    def clear(self):
+        """ Forgets the decoded images and drops the jobs that have not started. """
+        for key, job in list(self._jobs.items()):
+            if self._pool.tryTake(job):
+                del self._jobs[key]
+        self._wanted = None
+        self._cache.clear()
+
+    def _start(self, key, priority):
+        job = DecodeJob(key, self._signals)
+        self._jobs[key] = job
+        self._pool.start(job, priority)
+
+    @pyqtSlot(object, object)
+    def _on_decoded(self, key, image):
+        self._jobs.pop(key, None)
+        self._cache.put(key, image)
+        if key == self._wanted:
+            self._wanted = None
+            self.imageReady.emit(key[0], image)
+
+    @pyqtSlot(object, str)
+    def _on_failed(self, key, message):
+        self._jobs.pop(key, None)
+        if key == self._wanted:
+            self._wanted = None
+            self.failed.emit(key[0], message)
@@ -0,0 +1,47 @@
+import os
+
+""" The QItemObject class is used to store the information about the images in the directory. 
+    It is used to populate the QTreeWidget with the images. 
+    Data is stored in the following format: [name, extension, path] """
+
+class QItemObject():
+    EXTENSIONS = ["PNG", "JPG", "JPEG", "GIF", "BMP", "TIF", "TIFF", "NPY", "RAW"]
+
+    def __init__(self, path: str):
+        self.path = path
+        self.categories = ['name', 'extension', 'path'] # the order of the information
+
+    def __checkExtension(self):
+        extension = self.__getExtension().upper()
+        return extension in self.EXTENSIONS
+    
+    def __getExtension(self):
+        return os.path.splitext(self.path)[1][1:]
+        
+    def __getData(self):
+        filename = os.path.basename(self.path).split('.')[0]
+        extension = os.path.basename(self.path).split('.')[1]
+        
+        return [filename, extension, self.path]
+        
+    def data(self):
+        if self.__checkExtension():
+            file_data = self.__getData()        
+            return file_data
+        return None
+
+
+def iter_images(directory):
+    """ Yields the QItemObjects of the supported images in the directory as they are found. """
+    with os.scandir(directory) as entries:
+        for entry in entries:
+            if not entry.is_file():
+                continue
+            item = QItemObject(entry.path)
+            if item.data():
+                yield item
+
+
+def list_images(directory):
+    """ Returns the QItemObjects of all the supported images in the directory. """
+    return list(iter_images(directory))
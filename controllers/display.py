@@ -0,0 +1,81 @@
+from PyQt5.QtGui import QImage
+import functools
+import cv2
+import numpy as np
+
+""" Mapping of 16-bit and float images to the 8 bits of the screen.
+    A display window (low, high) is stretched over 0..255, values outside it saturate.
+    16-bit images go through a 65536-entry lookup table, floats are scaled in one pass.
+    The window is only for display; the images are kept and filtered at their native depth.
+    to_display_buffer makes the 8-bit buffer and the QImage over it that the viewer paints. """
+
+# Default window: these percentiles of the values, so that a few hot pixels do not flatten the image
+AUTO_PERCENTILES = (0.5, 99.5)
+# Pixels sampled for the automatic window of large images
+AUTO_SAMPLES = 2**20
+
+
+def auto_window(image, percentiles=AUTO_PERCENTILES, max_samples=AUTO_SAMPLES):
+    """ (low, high) from the percentiles of a strided sample of the finite values. """
+    step = max(1, int(np.sqrt(image.shape[0] * image.shape[1] / max_samples)))
+    sample = np.asarray(image[::step, ::step])
+    if sample.dtype.kind == 'f':
+        sample = sample[np.isfinite(sample)]
+    if sample.size == 0:
+        return 0.0, 1.0
+    low, high = (float(x) for x in np.percentile(sample, percentiles))
+    if high <= low:
+        high = low + 1
+    return low, high
+
+
+@functools.lru_cache(maxsize=8)
+def window_lut(dtype, low, high):
+    """ uint8 lookup table of every value of an integer dtype of at most 16 bits. """
+    info = np.iinfo(dtype)
+    values = np.arange(info.min, info.max + 1, dtype=np.float32)
+    lut = np.clip((values - low) * (255 / (high - low)), 0, 255)
+    return np.round(lut).astype(np.uint8)
+
+
+def apply_window(image, window):
+    """ uint8 image showing window (low, high) of image. 8-bit images without a window are
+        returned as they are. """
+    image = np.asarray(image)
+    if window is None:
+        if image.dtype == np.uint8:
+            return image
+        window = auto_window(image)
+    low, high = window
+    if image.dtype.kind in 'ui' and image.dtype.itemsize <= 2:
+        lut = window_lut(image.dtype.str, low, high)
+        if image.dtype.kind == 'i':
+            # The table starts at the smallest value of the type
+            image = image.astype(np.int32) - np.iinfo(image.dtype).min
+        return lut.take(image)
+    scaled = np.subtract(image, low, dtype=np.float32)
+    scaled *= 255 / (high - low)
+    np.clip(scaled, 0, 255, out=scaled)
+    return scaled.astype(np.uint8)
+
+
+def to_display_buffer(numpy_img):
+    """ Returns (buffer, QImage) where the QImage reads the pixels of buffer without copying.
+        Grayscale images are shared as they are, BGR images are converted once to BGRA,
+        which is the byte order of QImage.Format_RGB32 that QPainter draws fastest.
+        16-bit and float images are mapped to 8 bits over their automatic display window.
+        The QImage is only valid while buffer is alive. """
+    numpy_img = apply_window(numpy_img, None)
+    if numpy_img.ndim == 2:
+        buffer = np.ascontiguousarray(numpy_img)
+        image_format = QImage.Format_Grayscale8
+    elif numpy_img.shape[2] == 4:
+        buffer = np.ascontiguousarray(numpy_img)
+        image_format = QImage.Format_ARGB32
+    else:
+        buffer = cv2.cvtColor(numpy_img, cv2.COLOR_BGR2BGRA)
+        image_format = QImage.Format_RGB32
+
+    height, width = buffer.shape[:2]
+    q_image = QImage(buffer.data, width, height, buffer.strides[0], image_format)
+    return buffer, q_image
@@ -0,0 +1,101 @@
+from collections import namedtuple
+import cv2
+import numpy as np
+from .precision import DEFAULT_PRECISION, float_type, as_float
+from .profiling import stage
+
+""" One engine for the first-derivative filters (Sobel, Scharr, Prewitt, Farid).
+    Every family is a pair of 1D correlation kernels, a derivative and a smoothing one,
+    applied with cv2.sepFilter2D: x = derivative along the rows then smoothing along the
+    columns, y the other way round. Sobel and Scharr take their kernels from OpenCV and
+    give the same values as cv2.Sobel / cv2.Scharr; Prewitt and Farid use the weights and
+    the border mode of skimage.filters.prewitt / farid. """
+
+PREWITT_KERNELS = (np.array([-1.0, 0.0, 1.0]),
+                   np.full(3, 1 / 3))
+# Farid & Simoncelli 5-tap derivative and interpolator
+FARID_KERNELS = (np.array([-0.109603762960254, -0.276690988455557, 0.0, 0.276690988455557, 0.109603762960254]),
+                 np.array([0.0376593171958126, 0.249153396177344, 0.426374573253687, 0.249153396177344, 0.0376593171958126]))
+
+FAMILIES = ('sobel', 'scharr', 'prewitt', 'farid')
+
+
+def gradient_kernels(family, kernel_size=3):
+    """ (derivative, smoothing, border) of a kernel family, kernel_size is only used by Sobel. """
+    match family:
+        case 'sobel':
+            derivative, smoothing = cv2.getDerivKernels(1, 0, kernel_size, ktype=cv2.CV_64F)
+            return derivative, smoothing, cv2.BORDER_DEFAULT
+        case 'scharr':
+            derivative, smoothing = cv2.getDerivKernels(1, 0, cv2.FILTER_SCHARR, ktype=cv2.CV_64F)
+            return derivative, smoothing, cv2.BORDER_DEFAULT
+        case 'prewitt':
+            return (*PREWITT_KERNELS, cv2.BORDER_REFLECT)
+        case 'farid':
+            return (*FARID_KERNELS, cv2.BORDER_REFLECT)
+
+    raise ValueError(f"Unknown gradient family: {family}. Use one of: {', '.join(FAMILIES)}")
+
+
+def gradient_input(image, precision=DEFAULT_PRECISION):
+    # OpenCV derivatives of a float image stay in its type, 8-bit images go to any depth directly
+    if image.dtype.kind == 'f':
+        return as_float(image, precision)
+    return image
+
+
+class Gradient(namedtuple('Gradient', ['x', 'y'])):
+    """ The x and y derivatives, with the polar forms computed from them on demand. """
+
+    def magnitude(self, out=None):
+        return cv2.magnitude(self.x, self.y, out)
+
+    def direction(self, degrees=False):
+        """ Angle of the gradient in [0, 2 pi) (or [0, 360) degrees). """
+        return cv2.phase(self.x, self.y, angleInDegrees=degrees)
+
+    def polar(self, degrees=False):
+        """ (magnitude, direction) in one pass. """
+        return cv2.cartToPolar(self.x, self.y, angleInDegrees=degrees)
+
+    def response(self, direction='combined'):
+        """ The response of gradient_response for direction, the components are left as they
+            are so that one Gradient can serve several directions. """
+        match direction:
+            case "combined":
+                return self.magnitude()
+            case "vertical":
+                return self.x
+            case "horizontal":
+                return self.y
+
+        raise ValueError(f"Unknown direction: {direction}")
+
+
+def gradient(image, family='sobel', kernel_size=3, axes='xy', precision=DEFAULT_PRECISION):
+    """ Gradient of a grayscale image. Only the components in axes ('x', 'y' or 'xy') are
+        computed, the other one is None. """
+    derivative, smoothing, border = gradient_kernels(family, kernel_size)
+    depth = float_type(precision)[1]
+    image = gradient_input(image, precision)
+    with stage('gradient'):
+        x = cv2.sepFilter2D(image, depth, derivative, smoothing, borderType=border) if 'x' in axes else None
+        y = cv2.sepFilter2D(image, depth, smoothing, derivative, borderType=border) if 'y' in axes else None
+    return Gradient(x, y)
+
+
+def gradient_response(image, family='sobel', kernel_size=3, direction='combined', precision=DEFAULT_PRECISION):
+    """ What the gradient filters show: the magnitude ('combined'), the x derivative
+        ('vertical' edges) or the y derivative ('horizontal' edges). """
+    match direction:
+        case "combined":
+            components = gradient(image, family, kernel_size, 'xy', precision)
+            return components.magnitude(out=components.x)
+
+        case "vertical":
+            return gradient(image, family, kernel_size, 'x', precision).x
+
+        case "horizontal":
+            return gradient(image, family, kernel_size, 'y', precision).y
+
+    raise ValueError(f"Unknown direction: {direction}")
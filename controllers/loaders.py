@@ -0,0 +1,223 @@
+import json
+import os
+import threading
+import cv2
+import numpy as np
+from .cache import LRUCache
+
+""" Readers for large scientific images that open without reading the pixels.
+
+    .npy files and raw binary files (described by a JSON sidecar header) are memory
+    mapped; uncompressed TIFFs are memory mapped through tifffile, compressed or tiled ones
+    are read segment by segment on demand by TiffRegion. All of them are array-likes that
+    the tiled filters (tiling.open_source) slice region by region, so only the pixels of
+    the regions in use are ever read. Colour TIFFs are given in OpenCV's BGR order like
+    everything else. Other formats go through cv2.imread.
+
+    Raw sidecar header, next to scan.raw as scan.raw.json or scan.json:
+        {"shape": [height, width], "dtype": "uint16", "offset": 0, "byteorder": "<"}
+    shape may have a third axis for channels, offset (bytes to skip) and byteorder
+    ('<' little, '>' big endian) are optional. """
+
+LOADER_EXTENSIONS = ('.npy', '.raw', '.tif', '.tiff')
+# Decoded TIFF segments kept for neighbouring regions (their halos overlap)
+SEGMENT_CACHE_BYTES = 64 * 2**20
+
+
+def is_large_format(path):
+    return os.path.splitext(path)[1].lower() in LOADER_EXTENSIONS
+
+
+def raw_header_path(path):
+    """ The sidecar header of a raw file, None when there is none. """
+    for candidate in (path + '.json', os.path.splitext(path)[0] + '.json'):
+        if os.path.isfile(candidate):
+            return candidate
+    return None
+
+
+def open_npy(path):
+    return np.load(path, mmap_mode='r')
+
+
+def open_raw(path, header=None):
+    """ np.memmap of a raw file, header is the sidecar dict (read from the sidecar file
+        when None). Raises ValueError when the header is missing or does not fit the file. """
+    if header is None:
+        header_path = raw_header_path(path)
+        if header_path is None:
+            raise ValueError(f"No header for the raw file {path} (expected {path}.json)")
+        with open(header_path) as f:
+            header = json.load(f)
+    try:
+        shape = tuple(int(x) for x in header['shape'])
+        dtype = np.dtype(header['dtype']).newbyteorder(header.get('byteorder', '='))
+    except (KeyError, TypeError) as e:
+        raise ValueError(f"Invalid raw header for {path}: {e}") from None
+    offset = int(header.get('offset', 0))
+    expected = offset + int(np.prod(shape)) * dtype.itemsize
+    if os.path.getsize(path) < expected:
+        raise ValueError(f"{path} is smaller than its header describes ({expected} bytes)")
+    return np.memmap(path, dtype=dtype, mode='r', offset=offset, shape=shape)
+
+
+class TiffRegion():
+    """ Read-only array-like over the first page of a TIFF: slicing reads and decodes only
+        the strips or tiles the region touches. Supports [y0:y1, x0:x1] (and a channel
+        index for multi-channel images), which is what the tiled filters use, and strided
+        slices like [::step, ::step] of the thumbnails. """
+
+    def __init__(self, path, cache_bytes=SEGMENT_CACHE_BYTES):
+        import tifffile # only needed for TIFFs
+        self.path = path
+        self._tiff = tifffile.TiffFile(path)
+        self._page = self._tiff.pages[0]
+        self._lock = threading.Lock()
+        self._segments = LRUCache(cache_bytes)
+        self.shape = self._page.shape
+        self.dtype = np.dtype(self._page.dtype)
+        self.ndim = len(self.shape)
+        self.itemsize = self.dtype.itemsize
+        if self._page.is_tiled:
+            self._segment_shape = (self._page.tilelength, self._page.tilewidth)
+        else:
+            self._segment_shape = (self._page.rowsperstrip, self.shape[1])
+        self._across = -(-self.shape[1] // self._segment_shape[1])
+
+    def __array__(self, dtype=None):
+        return np.asarray(self[:, :], dtype=dtype)
+
+    def close(self):
+        self._tiff.close()
+
+    def _segment(self, index):
+        segment = self._segments.get(index)
+        if segment is not None:
+            return segment
+        with self._lock:
+            handle = self._tiff.filehandle
+            handle.seek(self._page.dataoffsets[index])
+            data = handle.read(self._page.databytecounts[index])
+        segment = self._page.decode(data, index, jpegtables=self._page.jpegtables)[0]
+        # (length, width, samples) whatever the depth and sample axes of the decoder
+        segment = segment.reshape(segment.shape[-3], segment.shape[-2], -1)
+        self._segments.put(index, segment)
+        return segment
+
+    def __getitem__(self, key):
+        if not isinstance(key, tuple):
+            key = (key,)
+        rows, columns = (tuple(key) + (slice(None),) * 2)[:2]
+        rest = key[2:]
+        y0, y1, y_step = rows.indices(self.shape[0])
+        x0, x1, x_step = columns.indices(self.shape[1])
+        if self._page.planarconfig != 1 or y_step < 0 or x_step < 0:
+            # Separate planes or reversed access: the page is read as a whole
+            return self._page.asarray()[key]
+
+        channels = self.shape[2] if self.ndim == 3 else 1
+        if y_step > 1 or x_step > 1:
+            out = self._strided(np.arange(y0, y1, y_step), np.arange(x0, x1, x_step), channels)
+        else:
+            out = self._region(y0, y1, x0, x1, channels)
+        if self.ndim == 2:
+            out = out[..., 0]
+        elif channels == 3:
+            out = out[..., ::-1] # RGB to BGR
+        return out[(slice(None), slice(None)) + rest] if rest else out
+
+    def _strided(self, ys, xs, channels):
+        """ Every ys row and xs column (e.g. for a thumbnail), only the segments holding
+            one of them are decoded. """
+        out = np.empty((len(ys), len(xs), channels), dtype=self.dtype)
+        length, width = self._segment_shape
+        for row in np.unique(ys // length):
+            yi = np.nonzero(ys // length == row)[0]
+            for column in np.unique(xs // width):
+                xi = np.nonzero(xs // width == column)[0]
+                segment = self._segment(int(row) * self._across + int(column))
+                out[np.ix_(yi, xi)] = segment[np.ix_(ys[yi] - row * length, xs[xi] - column * width)]
+        return out
+
+    def _region(self, y0, y1, x0, x1, channels):
+        out = np.empty((max(y1 - y0, 0), max(x1 - x0, 0), channels), dtype=self.dtype)
+        length, width = self._segment_shape
+        for row in range(y0 // length, -(-y1 // length) if y1 > y0 else 0):
+            for column in range(x0 // width, -(-x1 // width) if x1 > x0 else 0):
+                segment = self._segment(row * self._across + column)
+                sy0, sx0 = row * length, column * width
+                # The intersection of the region and the segment, in image coordinates
+                iy0, iy1 = max(y0, sy0), min(y1, sy0 + segment.shape[0])
+                ix0, ix1 = max(x0, sx0), min(x1, sx0 + segment.shape[1])
+                if iy0 < iy1 and ix0 < ix1:
+                    out[iy0 - y0:iy1 - y0, ix0 - x0:ix1 - x0] = segment[iy0 - sy0:iy1 - sy0, ix0 - sx0:ix1 - sx0]
+        return out
+
+
+def read_tiff(path):
+    """ The whole TIFF through OpenCV, for the files tifffile cannot decode. """
+    image = cv2.imread(path, cv2.IMREAD_UNCHANGED)
+    if image is None:
+        raise ValueError(f'Cannot read {path}')
+    return image
+
+
+def open_tiff(path):
+    """ np.memmap of an uncompressed contiguous TIFF, a TiffRegion otherwise. TIFFs that
+        tifffile cannot decode (LZW and the other codecs need imagecodecs) are read in
+        full by OpenCV, as before the large formats were supported. """
+    try:
+        import tifffile # only needed for TIFFs
+        image = tifffile.memmap(path, page=0, mode='r')
+    except ImportError:
+        return read_tiff(path)
+    except Exception:
+        try:
+            region = TiffRegion(path)
+            region[:1, :1] # decodes the first segment: is the codec available?
+        except Exception:
+            return read_tiff(path)
+        return region
+    if image.ndim == 3 and image.shape[2] == 3:
+        return image[..., ::-1] # RGB to BGR, a view
+    return image
+
+
+def open_image(path):
+    """ The image at path as an array-like, without reading the pixels of the large formats
+        (see LOADER_EXTENSIONS). Raises ValueError when it cannot be read. """
+    match os.path.splitext(path)[1].lower():
+        case '.npy':
+            return open_npy(path)
+        case '.raw':
+            return open_raw(path)
+        case '.tif' | '.tiff':
+            return open_tiff(path)
+    image = cv2.imread(path, cv2.IMREAD_UNCHANGED)
+    if image is None:
+        raise ValueError(f'Cannot read {path}')
+    return image
+
+
+def load_image(path):
+    """ The image at path for the viewer and the filters: an ndarray (a memmap for the large
+        formats, a TiffRegion read in full) or None when it cannot be read. Colour images
+        and the formats OpenCV reads are decoded as cv2.imread does by default. """
+    if not is_large_format(path):
+        return cv2.imread(path)
+    try:
+        image = open_image(path)
+    except (OSError, ValueError):
+        return None
+    if isinstance(image, TiffRegion):
+        try:
+            image = image[:, :]
+        except Exception:
+            return cv2.imread(path, cv2.IMREAD_UNCHANGED)
+    if image.ndim == 3:
+        # Contiguous BGR pixels, as the rest of the application expects of colour images.
+        # 8-bit colour TIFFs are decoded by OpenCV, which reads .npy and raw files as nothing.
+        if image.dtype == np.uint8 and os.path.splitext(path)[1].lower() in ('.tif', '.tiff'):
+            return cv2.imread(path)
+        return np.ascontiguousarray(image)
+    return np.asarray(image)
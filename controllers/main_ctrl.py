@@ -1,37 +1,13 @@
 from PyQt5.QtCore import QObject, pyqtSlot
 from PyQt5 import QtWidgets
-import os
 from views.widgets.options_menu import HessianMenu, CVRidgeMenu, ScharrMenu, SobelMenu, CannyMenu, SatoMenu, MeijeringMenu, PrewittMenu, FaridMenu
-from .transformation import hessian_filter, sobel_filter, scharr_filter, cv_ridge_filter, canny_edge_detection, sato_filter, meijering_filter, prewitt_filter, farid_filter
-""" The QItemObject class is used to store the information about the images in the directory. 
-    It is used to populate the QTreeWidget with the images. 
-    Data is stored in the following format: [name, extension, path] """
-
-class QItemObject():
-    EXTENSIONS = ["PNG", "JPG", "JPEG", "GIF", "BMP"]
-
-    def __init__(self, path: str):
-        self.path = path
-        self.categories = ['name', 'extension', 'path'] # the order of the information
-
-    def __checkExtension(self):
-        extension = self.__getExtension().upper()
-        return extension in self.EXTENSIONS
-    
-    def __getExtension(self):
-        return os.path.splitext(self.path)[1][1:]
-        
-    def __getData(self):
-        filename = os.path.basename(self.path).split('.')[0]
-        extension = os.path.basename(self.path).split('.')[1]
-        
-        return [filename, extension, self.path]
-        
-    def data(self):
-        if self.__checkExtension():
-            file_data = self.__getData()        
-            return file_data
-        return None
+import os
+from .registry import FILTERS
+from .cache import ResultCache
+from .pipeline import Pipeline
+from .directory import QItemObject
+from .thumbnails import DirectoryLoader
+from .decoder import ImageDecoder, PREFETCH_COUNT
 
 
 # Perform any operations on the data from Model
@@ -88,24 +64,23 @@ class EdgeDetectionController(QObject):
                        'prewitt_button': PrewittMenu,
                        'farid_button': FaridMenu,
                        'hessian_button': HessianMenu,
+                       'scale_space_button': HessianMenu,
                        'cvridgefilter_button': CVRidgeMenu}
         
-        self._filters = {'sobel_button': sobel_filter,
-                         'scharr_button': scharr_filter,
-                         'canny_button': canny_edge_detection,
-                         'sato_button': sato_filter,
-                         'meijering_button': meijering_filter,
-                         'prewitt_button': prewitt_filter,
-                         'farid_button': farid_filter,
-                         'hessian_button': hessian_filter,
-                         'cvridgefilter_button': cv_ridge_filter}
+        self._filters = dict(FILTERS)
+        # Results of previously seen (image, filter, settings) are reused instead of recomputed,
+        # EDGE_DETECTION_CACHE_DIR enables an additional on-disk tier
+        self._cache = ResultCache(directory=os.environ.get('EDGE_DETECTION_CACHE_DIR'))
+        self._pipeline = Pipeline()
+        self._current_filter = None
         
     @pyqtSlot(str)
     def on_button_clicked(self, button_name):
         if button_name in self._menus:
             print(f"The button has its own Menu: {button_name}.")
             class_name = self._menus.get(button_name)()
-            class_name.TRANS_FUNC = self._filters.get(button_name)
+            class_name.TRANS_FUNC = self._cache.wrap(button_name, self._filters.get(button_name))
+            self._current_filter = button_name
             self._model.current_menu = class_name
             
             # print(type(class_name))
@@ -116,6 +91,67 @@ class EdgeDetectionController(QObject):
     @pyqtSlot(dict)
     def on_settings_applied(self, settings):
         self._model.current_settings = settings
+    
+    @pyqtSlot(dict)
+    def on_settings_previewed(self, settings):
+        self._model.preview_settings = settings
+    
+    @pyqtSlot(dict)
+    def on_pipeline_step_added(self, settings):
+        try:
+            self._pipeline.append(self._current_filter, **settings)
+        except KeyError as e:
+            print(e.args[0])
+            return
+        self._model.pipeline_steps = list(self._pipeline.steps)
+    
+    @pyqtSlot(float)
+    def on_gaussian_step_added(self, sigma):
+        self._pipeline.append('gaussian', sigma=sigma)
+        self._model.pipeline_steps = list(self._pipeline.steps)
+    
+    @pyqtSlot()
+    def on_pipeline_step_removed(self):
+        if len(self._pipeline):
+            self._pipeline.remove()
+            self._model.pipeline_steps = list(self._pipeline.steps)
+    
+    @pyqtSlot()
+    def on_pipeline_cleared(self):
+        self._pipeline.clear()
+        self._model.pipeline_steps = []
+    
+    @pyqtSlot()
+    def on_pipeline_applied(self):
+        if len(self._pipeline):
+            # A copy, so that editing the steps does not change a run in progress
+            self._model.apply_pipeline(self._pipeline.copy())
+    
+    @pyqtSlot(list, bool)
+    def on_comparison_requested(self, keys, sequential):
+        # The filter of the open menu is compared with its current settings, the others with their defaults
+        entries = []
+        for key in keys:
+            settings = {}
+            if key == self._current_filter and self._model.current_menu is not None:
+                settings = self._model.current_menu.getSettings()
+            entries.append((key, settings))
+        if entries:
+            self._model.compare_filters(entries, sequential)
+    
+    def _frame_filter(self):
+        # Frames are not memoized: the uncached filter of the open menu, or none
+        if self._current_filter is None:
+            return None, {}
+        return self._filters[self._current_filter], self._model.current_menu.getSettings()
+    
+    @pyqtSlot(str, str)
+    def on_stream_requested(self, source, output):
+        self._model.start_stream(source, *self._frame_filter(), output or None)
+    
+    @pyqtSlot(str)
+    def on_camera_requested(self, device):
+        self._model.start_camera(device, *self._frame_filter())
 
 
 
@@ -123,6 +159,12 @@ class DirectoryController(QObject):
     def __init__(self, model):
         super().__init__()
         self._model = model
+        self._loader = DirectoryLoader()
+        self._loader.batchReady.connect(self.on_scan_batch)
+        self._loader.thumbnailReady.connect(self._model.set_thumbnail)
+        self._decoder = ImageDecoder()
+        self._decoder.imageReady.connect(self._model.set_decoded_image)
+        self._decoder.failed.connect(self._model.set_decode_failed)
     
     @pyqtSlot(bool)
     def change_directory(self):
@@ -137,22 +179,47 @@ class DirectoryController(QObject):
     def populate_list(self, directory):
         """ Populate the list with images from the directory.
             The available extensions are defined in the QItemObject class,
-            which also handles the validation of the files in the directory. """
-        images = []
-        for file in os.listdir(directory):
-            path = os.path.join(directory, file)
-            item = QItemObject(path)
-            if item.data():
-                images.append(item)
-        
-        listItems = [QtWidgets.QTreeWidgetItem(x.data()) for x in images]
-        self._model.tree_items = listItems
+            which also handles the validation of the files in the directory.
+            The directory is scanned in the background and the list grows batch by batch. """
+        self._model.tree_items = []
+        self._decoder.clear()
+        if directory:
+            self._loader.load(directory)
+        else:
+            self._loader.cancel()
+    
+    @pyqtSlot(list)
+    def on_scan_batch(self, batch):
+        listItems = [QtWidgets.QTreeWidgetItem(x) for x in batch]
+        self._model.add_tree_items(listItems)
+        for data in batch:
+            self._loader.requestThumbnail(data[2])
 
     @pyqtSlot(QtWidgets.QTreeWidgetItem, int)
     def on_item_clicked(self, item, column):
         # Get the path of the image
         path = item.text(2)
         self._model.current_image_path = path
+        # Decoded in the background, the neighbours are prepared for the next step through the list
+        self._decoder.request(path)
+        self._decoder.prefetch(self.neighbour_paths(item))
+    
+    @pyqtSlot(QtWidgets.QTreeWidgetItem, QtWidgets.QTreeWidgetItem)
+    def on_current_item_changed(self, current, previous):
+        # Arrow keys in the list, a mouse click is followed by itemClicked
+        if current is not None and not QtWidgets.QApplication.mouseButtons():
+            self.on_item_clicked(current, 0)
+    
+    def neighbour_paths(self, item, count=PREFETCH_COUNT):
+        """ Paths of the count next and previous items, nearest first, the next one before the previous one. """
+        tree = item.treeWidget()
+        index = tree.indexOfTopLevelItem(item)
+        paths = []
+        for distance in range(1, count + 1):
+            for neighbour in (index + distance, index - distance):
+                if 0 <= neighbour < tree.topLevelItemCount():
+                    paths.append(tree.topLevelItem(neighbour).text(2))
+        return paths
 
     
 # Controller does not know about the view 
\ No newline at end of file
@@ -0,0 +1,125 @@
+from collections import namedtuple
+from .cache import LRUCache, image_digest, settings_key
+from .precision import DEFAULT_PRECISION, float_type
+from .scale_space import frangi_response, sato_response, meijering_response
+from .transformation import (to_grayscale, normalize_to_uint8, ridge_to_uint8, gaussian_response, canny_response,
+                             sobel_response, scharr_response, prewitt_response, farid_response,
+                             scale_space_response)
+
+""" Chains of filters run as one transformation.
+    The input is converted to grayscale once, the steps pass float responses to each
+    other and only the result of the last step is brought to uint8. The output of every
+    step is cached under the image and the steps leading to it, so changing step N of a
+    pipeline reruns steps N onward and reuses the ones before it. """
+
+# response: float grayscale -> float, finish: how the last response becomes an image
+Step = namedtuple('Step', ['response', 'finish'])
+
+
+def _ridge_step(response):
+    def step(image, black_ridges=False, sigmas=10, min_sigma=1, precision=DEFAULT_PRECISION):
+        return response(image, sigmas=(min_sigma, sigmas), black_ridges=black_ridges, precision=precision)
+    return step
+
+
+def _canny_step(image, threshold1, threshold2, sigma=3, precision=DEFAULT_PRECISION):
+    return canny_response(image, threshold1, threshold2, sigma, precision).astype(float_type(precision)[0])
+
+
+STEPS = {'gaussian': Step(gaussian_response, normalize_to_uint8),
+         'sobel': Step(sobel_response, normalize_to_uint8),
+         'scharr': Step(scharr_response, normalize_to_uint8),
+         'prewitt': Step(prewitt_response, normalize_to_uint8),
+         'farid': Step(farid_response, normalize_to_uint8),
+         'canny': Step(_canny_step, normalize_to_uint8),
+         'hessian': Step(_ridge_step(frangi_response), ridge_to_uint8),
+         'sato': Step(_ridge_step(sato_response), ridge_to_uint8),
+         'meijering': Step(_ridge_step(meijering_response), ridge_to_uint8),
+         'scale_space': Step(scale_space_response, ridge_to_uint8)}
+
+
+def step_name(name):
+    """ Accepts the step name ('sobel') and the registry key ('sobel_button'). """
+    name = name[:-len('_button')] if name.endswith('_button') else name
+    if name not in STEPS:
+        raise KeyError(f"'{name}' cannot be used in a pipeline. Available steps: {', '.join(STEPS)}")
+    return name
+
+
+class Pipeline():
+    """ Ordered list of (step name, settings). Calling it runs the steps on an image.
+        precision is the float type of the intermediates, a step can override it in its settings. """
+
+    def __init__(self, steps=(), max_bytes=512 * 2**20, precision=DEFAULT_PRECISION):
+        self.steps = []
+        self.precision = precision
+        self._cache = LRUCache(max_bytes)
+        for name, settings in steps:
+            self.append(name, **settings)
+
+    def __len__(self):
+        return len(self.steps)
+
+    def __repr__(self):
+        return ' -> '.join(f'{name}({settings_key(settings)})' for name, settings in self.steps)
+
+    def append(self, name, **settings):
+        self.steps.append((step_name(name), settings))
+
+    def replace(self, index, name, **settings):
+        self.steps[index] = (step_name(name), settings)
+
+    def remove(self, index=-1):
+        return self.steps.pop(index)
+
+    def clear(self):
+        self.steps = []
+
+    def copy(self):
+        """ The same steps, sharing the stage cache with this pipeline. """
+        pipeline = Pipeline(max_bytes=0, precision=self.precision)
+        pipeline.steps = list(self.steps)
+        pipeline._cache = self._cache
+        return pipeline
+
+    def clearCache(self):
+        self._cache.clear()
+
+    def _keys(self, digest):
+        """ Cache key of the output of every step: the image and all the steps up to it. """
+        prefix = (digest, self.precision)
+        keys = []
+        for name, settings in self.steps:
+            prefix = prefix + ((name, settings_key(settings)),)
+            keys.append(prefix)
+        return keys
+
+    def response(self, image):
+        """ Float output of the last step. """
+        if not self.steps:
+            raise ValueError('The pipeline is empty')
+        digest = image_digest(image)
+        keys = self._keys(digest)
+
+        # Start after the last step whose output is still cached
+        start, response = 0, None
+        for i in range(len(keys) - 1, -1, -1):
+            response = self._cache.get(keys[i])
+            if response is not None:
+                start = i + 1
+                break
+        if response is None:
+            key = ('grayscale', digest, self.precision)
+            response = self._cache.get(key)
+            if response is None:
+                response = to_grayscale(image).astype(float_type(self.precision)[0])
+                self._cache.put(key, response)
+
+        for i in range(start, len(self.steps)):
+            name, settings = self.steps[i]
+            response = STEPS[name].response(response, **{'precision': self.precision, **settings})
+            self._cache.put(keys[i], response)
+        return response
+
+    def __call__(self, image):
+        return STEPS[self.steps[-1][0]].finish(self.response(image))
@@ -0,0 +1,23 @@
+import cv2
+import numpy as np
+
+""" Floating point precision of the filter computations.
+    float32 halves the memory traffic of every intermediate and is accurate enough for
+    results that end up as 8-bit images; float64 is kept as an opt-in for analysis. """
+
+DEFAULT_PRECISION = 'float32'
+PRECISIONS = {'float32': (np.float32, cv2.CV_32F),
+              'float64': (np.float64, cv2.CV_64F)}
+
+
+def float_type(precision):
+    """ (numpy dtype, OpenCV depth) of a precision name. """
+    try:
+        return PRECISIONS[precision]
+    except KeyError:
+        raise ValueError(f"Unknown precision: {precision}. Use one of: {', '.join(PRECISIONS)}") from None
+
+
+def as_float(image, precision):
+    """ The image in the floating point type of the precision, values are kept as they are. """
+    return image.astype(float_type(precision)[0], copy=False)
@@ -0,0 +1,50 @@
+import cv2
+
+""" Downscaled previews for the progressive display of a transformation.
+    The preview is sized to what the ImageViewer can actually show, and the settings
+    measured in pixels (kernel sizes, Gaussian sigmas) are scaled with the image so the
+    preview looks like a shrunk version of the full-resolution result. """
+
+# A preview is not worth an extra job when it is almost as large as the image
+MAX_PREVIEW_FACTOR = 0.75
+SOBEL_KERNELS = (1, 3, 5, 7)
+
+
+def preview_factor(image_shape, viewport_size, view_scale=1.0):
+    """ Factor to shrink the image to the number of pixels the viewport shows at view_scale. """
+    height, width = image_shape[:2]
+    viewport_width, viewport_height = viewport_size
+    factor = max(viewport_width / width, viewport_height / height) * view_scale
+    return min(factor, 1.0)
+
+
+def downscale(image, factor):
+    height, width = image.shape[:2]
+    size = (max(1, round(width * factor)), max(1, round(height * factor)))
+    return cv2.resize(image, size, interpolation=cv2.INTER_AREA)
+
+
+def _odd_kernel(kernel_size, factor):
+    return min(SOBEL_KERNELS, key=lambda x: abs(x - kernel_size * factor))
+
+
+def scale_settings(settings, factor):
+    """ Settings for an image shrunk by factor. Thresholds (quantiles) and directions do not change. """
+    scaled = dict(settings)
+    if 'kernel_size' in scaled:
+        scaled['kernel_size'] = _odd_kernel(scaled['kernel_size'], factor)
+    if 'sigma' in scaled:
+        scaled['sigma'] = max(scaled['sigma'] * factor, 0.5)
+    if 'sigmas' in scaled:
+        # Ridge filters run over (min_sigma, sigmas), both scale with the image
+        scaled['sigmas'] = max(scaled['sigmas'] * factor, 0.5)
+        scaled['min_sigma'] = max(scaled.get('min_sigma', 1) * factor, 0.5)
+    return scaled
+
+
+def make_preview(image, settings, viewport_size, view_scale=1.0):
+    """ (preview image, scaled settings, factor), or None when the image is small enough already. """
+    factor = preview_factor(image.shape, viewport_size, view_scale)
+    if factor > MAX_PREVIEW_FACTOR:
+        return None
+    return downscale(image, factor), scale_settings(settings, factor), factor
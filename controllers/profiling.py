@@ -0,0 +1,32 @@
+import threading
+import time
+from contextlib import contextmanager
+
+""" Optional per-stage timing of the transformations. stage() costs nothing unless a
+    record_stages() block is active on the same thread (the benchmarks use it). """
+
+_local = threading.local()
+
+
+@contextmanager
+def stage(name):
+    recorder = getattr(_local, 'recorder', None)
+    if recorder is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        recorder[name] = recorder.get(name, 0.0) + time.perf_counter() - start
+
+
+@contextmanager
+def record_stages():
+    """ Collects {stage name: seconds} of every stage() entered inside the block. """
+    previous = getattr(_local, 'recorder', None)
+    _local.recorder = {}
+    try:
+        yield _local.recorder
+    finally:
+        _local.recorder = previous
@@ -0,0 +1,178 @@
+from PyQt5.QtCore import QObject, QRunnable, QThreadPool, pyqtSignal, pyqtSlot
+from PyQt5.QtGui import QImage
+import itertools
+import math
+import os
+import threading
+import traceback
+import cv2
+import numpy as np
+from .display import apply_window
+
+""" Mip pyramid of an image cut into fixed-size tiles, for the viewer of large images.
+    Level 0 is the image itself, every next level halves both sides (INTER_AREA), until
+    the whole image fits in one tile. Levels are built on first use, tiles are converted
+    to QImages in a thread pool and delivered one by one, tagged with a generation number
+    so that tiles of a previous image are discarded. """
+
+TILE_SIZE = 512
+# Types cv2.resize takes, the others (int32, uint32, int64, float16, bool) are resized as float32
+RESIZE_DTYPES = (np.uint8, np.uint16, np.int16, np.float32, np.float64)
+
+
+class MipPyramid():
+    def __init__(self, image, tile_size=TILE_SIZE):
+        self.tile_size = tile_size
+        self.height, self.width = image.shape[:2]
+        self._levels = [image]
+        self._lock = threading.Lock()
+
+        self.shapes = [(self.height, self.width)]
+        while max(self.shapes[-1]) > tile_size:
+            height, width = self.shapes[-1]
+            self.shapes.append(((height + 1) // 2, (width + 1) // 2))
+
+    @property
+    def level_count(self):
+        return len(self.shapes)
+
+    def levelFor(self, level_of_detail):
+        """ The coarsest level that still has at least one pixel per screen pixel. """
+        if level_of_detail >= 1:
+            return 0
+        level = int(math.floor(math.log2(1 / level_of_detail)))
+        return min(level, self.level_count - 1)
+
+    def scale(self, level):
+        """ Size of a pixel of the level in image (scene) pixels, (x, y). """
+        height, width = self.shapes[level]
+        return self.width / width, self.height / height
+
+    def tileGrid(self, level):
+        height, width = self.shapes[level]
+        return math.ceil(width / self.tile_size), math.ceil(height / self.tile_size)
+
+    def tileRect(self, level, tx, ty):
+        """ (x, y, width, height) of the tile in the pixels of its level. """
+        height, width = self.shapes[level]
+        x, y = tx * self.tile_size, ty * self.tile_size
+        return x, y, min(self.tile_size, width - x), min(self.tile_size, height - y)
+
+    def tilesIn(self, level, x0, y0, x1, y1):
+        """ Tiles of the level covering the image rectangle [x0, x1) x [y0, y1). """
+        sx, sy = self.scale(level)
+        columns, rows = self.tileGrid(level)
+        step_x, step_y = self.tile_size * sx, self.tile_size * sy
+        first_x, last_x = max(0, int(x0 // step_x)), min(columns - 1, int(math.ceil(x1 / step_x)) - 1)
+        first_y, last_y = max(0, int(y0 // step_y)), min(rows - 1, int(math.ceil(y1 / step_y)) - 1)
+        return [(tx, ty) for ty in range(first_y, last_y + 1) for tx in range(first_x, last_x + 1)]
+
+    def level(self, level):
+        with self._lock:
+            while len(self._levels) <= level:
+                height, width = self.shapes[len(self._levels)]
+                source = self._levels[-1]
+                if source.dtype not in RESIZE_DTYPES:
+                    source = source.astype(np.float32)
+                self._levels.append(cv2.resize(source, (width, height), interpolation=cv2.INTER_AREA))
+            return self._levels[level]
+
+    def tile(self, level, tx, ty):
+        x, y, width, height = self.tileRect(level, tx, ty)
+        return self.level(level)[y:y + height, x:x + width]
+
+
+def tile_to_qimage(tile):
+    """ Detached QImage of a grayscale or BGR tile in a format QPainter draws directly. """
+    height, width = tile.shape[:2]
+    if tile.ndim == 2:
+        tile = tile.copy()
+        image_format = QImage.Format_Grayscale8
+    elif tile.shape[2] == 4:
+        tile = tile.copy()
+        image_format = QImage.Format_ARGB32
+    else:
+        tile = cv2.cvtColor(tile, cv2.COLOR_BGR2BGRA)
+        image_format = QImage.Format_RGB32
+    return QImage(tile.data, width, height, tile.strides[0], image_format).copy()
+
+
+class TileSignals(QObject):
+    ready = pyqtSignal(int, int, int, int, QImage) # generation, level, tx, ty
+    failed = pyqtSignal(int, int, int, int, str)
+
+
+class TileJob(QRunnable):
+    def __init__(self, generation, pyramid, level, tx, ty, signals, window=None):
+        super().__init__()
+        self.window = window
+        self.generation = generation
+        self.pyramid = pyramid
+        self.level = level
+        self.tx = tx
+        self.ty = ty
+        self.signals = signals
+
+    @pyqtSlot()
+    def run(self):
+        try:
+            tile = apply_window(self.pyramid.tile(self.level, self.tx, self.ty), self.window)
+            q_image = tile_to_qimage(tile)
+        except Exception: # escaping run() would abort the application
+            self.signals.failed.emit(self.generation, self.level, self.tx, self.ty, traceback.format_exc())
+            return
+        self.signals.ready.emit(self.generation, self.level, self.tx, self.ty, q_image)
+
+
+class TileLoader(QObject):
+    """ Makes the tiles of the current image in the background. """
+    tileReady = pyqtSignal(int, int, int, QImage) # level, tx, ty, tile
+
+    def __init__(self, tile_size=TILE_SIZE, max_workers=None):
+        super().__init__()
+        self.tile_size = tile_size
+        self.pyramid = None
+        self.window = None
+        self._pool = QThreadPool()
+        self._pool.setMaxThreadCount(max_workers or max(1, (os.cpu_count() or 2) - 1))
+        self._generations = itertools.count(1)
+        self._generation = 0
+        self._requests = itertools.count()
+        self._pending = set()
+        self._signals = TileSignals()
+        self._signals.ready.connect(self._on_ready)
+        self._signals.failed.connect(self._on_failed)
+
+    def setImage(self, image, window=None):
+        """ window: the display window of 16-bit and float images (see display.apply_window),
+            the pyramid itself keeps the native depth. """
+        self.window = window
+        self._pool.clear()
+        self._pending.clear()
+        self._generation = next(self._generations)
+        self.pyramid = None if image is None else MipPyramid(image, self.tile_size)
+
+    def requestTile(self, level, tx, ty):
+        key = (level, tx, ty)
+        if self.pyramid is None or key in self._pending:
+            return
+        self._pending.add(key)
+        # The latest requests are for what is on screen now, they go first
+        self._pool.start(TileJob(self._generation, self.pyramid, level, tx, ty, self._signals, self.window),
+                         next(self._requests) % 2**31)
+
+    def isPending(self, level, tx, ty):
+        return (level, tx, ty) in self._pending
+
+    @pyqtSlot(int, int, int, int, QImage)
+    def _on_ready(self, generation, level, tx, ty, q_image):
+        if generation == self._generation:
+            self._pending.discard((level, tx, ty))
+            self.tileReady.emit(level, tx, ty, q_image)
+
+    @pyqtSlot(int, int, int, int, str)
+    def _on_failed(self, generation, level, tx, ty, message):
+        if generation == self._generation:
+            # Requested again the next time it is painted
+            self._pending.discard((level, tx, ty))
+            print(message)
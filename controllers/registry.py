@@ -0,0 +1,28 @@
+from .transformation import hessian_filter, sobel_filter, scharr_filter, cv_ridge_filter, canny_edge_detection, sato_filter, meijering_filter, prewitt_filter, farid_filter, scale_space_filter
+
+""" The registry of the available transformations, keyed by the name of the menu button
+    that selects them. It is kept free of Qt so that headless tools can import it. """
+
+FILTERS = {'sobel_button': sobel_filter,
+           'scharr_button': scharr_filter,
+           'canny_button': canny_edge_detection,
+           'sato_button': sato_filter,
+           'meijering_button': meijering_filter,
+           'prewitt_button': prewitt_filter,
+           'farid_button': farid_filter,
+           'hessian_button': hessian_filter,
+           'scale_space_button': scale_space_filter,
+           'cvridgefilter_button': cv_ridge_filter}
+
+
+def filter_key(name):
+    """ Accepts both the registry key ('sobel_button') and the short name ('sobel'). """
+    key = name if name.endswith('_button') else f'{name}_button'
+    if key not in FILTERS:
+        available = ', '.join(x[:-len('_button')] for x in FILTERS)
+        raise KeyError(f"Unknown filter '{name}'. Available filters: {available}")
+    return key
+
+
+def get_filter(name):
+    return FILTERS[filter_key(name)]
@@ -0,0 +1,225 @@
+from collections import namedtuple
+import cv2
+import numpy as np
+from skimage.feature import hessian_matrix, hessian_matrix_eigvals
+from .cache import LRUCache, image_digest
+from .precision import DEFAULT_PRECISION, float_type, as_float
+from .profiling import stage
+
+""" Gaussian scale space shared by the ridge filters.
+    hessian_filter, sato_filter and meijering_filter all start from the Hessian of the
+    same grayscale image at the same scales. The second-derivative stack and its
+    eigenvalues are computed once per (image, sigma) and kept in an LRU, so switching
+    between the ridge filters on one image only repeats the final per-filter response.
+    The responses reproduce skimage's frangi/hessian, sato and meijering (to the last bit
+    with precision='float64', the default float32 differs by rounding).
+    HessianScaleSpace is the lighter float32 engine behind the automatic scale selection. """
+
+_cache = LRUCache(max_bytes=2 * 2**30)
+
+# Frangi's background is where the vesselness is 0 in float64: 1 - exp(-x) rounds to 0 for
+# x below 2^-54 and exp(-y) underflows for y above 745. float32 reaches 0 much earlier, so
+# its background is found from the exponents instead of the values.
+FLOAT64_STRUCTURE_MIN = 2.0**-54
+FLOAT64_EXPONENT_MAX = 745.0
+
+
+def set_cache_size(max_bytes):
+    _cache.max_bytes = max_bytes
+    if max_bytes == 0:
+        _cache.clear()
+
+
+def clear_cache():
+    _cache.clear()
+
+
+def hessian_elements(image, sigma, digest=None, cache=True, precision=DEFAULT_PRECISION):
+    """ (Hrr, Hrc, Hcc) second derivatives of the Gaussian-smoothed image. """
+    key = None
+    if cache:
+        key = ('hessian', digest or image_digest(image), float(sigma), precision)
+        elements = _cache.get(key)
+        if elements is not None:
+            return elements
+    with stage('hessian'):
+        # The same conversion as the skimage ridge filters: values are kept, not rescaled to [0, 1]
+        elements = tuple(hessian_matrix(as_float(image, precision), sigma, mode='reflect', cval=0,
+                                        use_gaussian_derivatives=True))
+    if cache:
+        _cache.put(key, elements)
+    return elements
+
+
+def hessian_eigenvalues(image, sigma, digest=None, cache=True, precision=DEFAULT_PRECISION):
+    """ Eigenvalues of the Hessian at scale sigma in decreasing order, shape (2, H, W). """
+    key = None
+    if cache:
+        digest = digest or image_digest(image)
+        key = ('eigenvalues', digest, float(sigma), precision)
+        eigvals = _cache.get(key)
+        if eigvals is not None:
+            return eigvals
+    elements = hessian_elements(image, sigma, digest, cache, precision)
+    with stage('eigenvalues'):
+        eigvals = hessian_matrix_eigvals(list(elements))
+    if cache:
+        _cache.put(key, eigvals)
+    return eigvals
+
+
+def ridge_eigenvalues(image, sigma, black_ridges, digest=None, cache=True, precision=DEFAULT_PRECISION):
+    """ The ridge filters look for bright ridges on -image unless black_ridges is set.
+        The Hessian of -image is -H, so its eigenvalues are the negated ones in reverse order. """
+    eigvals = hessian_eigenvalues(image, sigma, digest, cache, precision)
+    if black_ridges:
+        return eigvals
+    return -eigvals[::-1]
+
+
+def frangi_response(image, sigmas, black_ridges=True, beta=0.5, gamma=15, cache=True, precision=DEFAULT_PRECISION):
+    """ skimage.filters.hessian: Frangi vesselness with background (<= 0) set to 1. """
+    digest = image_digest(image) if cache else None
+    dtype = float_type(precision)[0]
+    filtered_max = np.zeros(image.shape, dtype=dtype)
+    foreground = np.zeros(image.shape, dtype=bool) if dtype != np.float64 else None
+    for sigma in sigmas:
+        eigvals = ridge_eigenvalues(image, sigma, black_ridges, digest, cache, precision)
+        with stage('response'):
+            # Sort the two eigenvalues by magnitude
+            swap = np.abs(eigvals[0]) > np.abs(eigvals[1])
+            lambda1 = np.where(swap, eigvals[1], eigvals[0])
+            lambda2 = np.maximum(np.where(swap, eigvals[0], eigvals[1]), 1e-10)
+
+            # In place where possible, every temporary is a full image
+            r_b = np.abs(lambda1, out=lambda1)
+            r_b /= lambda2
+            r_b *= r_b
+            r_b /= -(2 * beta ** 2)
+            if foreground is not None:
+                blob_kept = r_b > -FLOAT64_EXPONENT_MAX
+            vals = np.exp(r_b, out=r_b)
+            s = np.square(eigvals[0])
+            s += np.square(eigvals[1])
+            s /= -(2 * gamma ** 2)
+            if foreground is not None:
+                foreground |= blob_kept & (s < -FLOAT64_STRUCTURE_MIN)
+            s = np.exp(s, out=s)
+            vals *= 1.0 - s
+            np.maximum(filtered_max, vals, out=filtered_max)
+
+    filtered_max[filtered_max <= 0 if foreground is None else ~foreground] = 1
+    return filtered_max
+
+
+def sato_response(image, sigmas, black_ridges=True, cache=True, precision=DEFAULT_PRECISION):
+    """ skimage.filters.sato: in 2D the tubeness is the largest eigenvalue clipped at 0, times sigma^2. """
+    digest = image_digest(image) if cache else None
+    filtered_max = np.zeros(image.shape, dtype=float_type(precision)[0])
+    for sigma in sigmas:
+        eigvals = ridge_eigenvalues(image, sigma, black_ridges, digest, cache, precision)
+        with stage('response'):
+            vals = np.maximum(eigvals[0], 0)
+            vals *= sigma ** 2
+            np.maximum(filtered_max, vals, out=filtered_max)
+    return filtered_max
+
+
+def meijering_scales(image, sigmas, black_ridges=True, alpha=None, cache=True, precision=DEFAULT_PRECISION):
+    """ Per-scale neuriteness of skimage.filters.meijering before its per-scale normalization. """
+    alpha = 1 / (image.ndim + 1) if alpha is None else alpha
+    digest = image_digest(image) if cache else None
+    for sigma in sigmas:
+        eigvals = ridge_eigenvalues(image, sigma, black_ridges, digest, cache, precision)
+        with stage('response'):
+            vals0 = eigvals[0] + alpha * eigvals[1]
+            vals1 = alpha * eigvals[0] + eigvals[1]
+            vals = np.where(np.abs(vals1) > np.abs(vals0), vals1, vals0)
+            yield np.maximum(vals, 0, out=vals)
+
+
+def meijering_response(image, sigmas, black_ridges=True, alpha=None, cache=True, precision=DEFAULT_PRECISION):
+    """ skimage.filters.meijering: every scale is divided by its maximum before taking the max. """
+    filtered_max = np.zeros(image.shape, dtype=float_type(precision)[0])
+    for vals in meijering_scales(image, sigmas, black_ridges, alpha, cache, precision):
+        max_val = vals.max()
+        if max_val > 0:
+            vals /= max_val
+        np.maximum(filtered_max, vals, out=filtered_max)
+    return filtered_max
+
+
+def gaussian_derivative_kernels(sigma, truncate=4.0):
+    """ Gaussian, first and second derivative of Gaussian as float32 correlation kernels
+        (the way cv2.sepFilter2D applies them), truncated at truncate * sigma. """
+    radius = max(1, int(truncate * sigma + 0.5))
+    x = np.arange(-radius, radius + 1, dtype=np.float64)
+    g0 = np.exp(-x ** 2 / (2 * sigma ** 2))
+    g0 /= g0.sum()
+    g1 = x / sigma ** 2 * g0
+    g2 = (x ** 2 / sigma ** 4 - 1 / sigma ** 2) * g0
+    g2 -= g2.mean() # a constant image has no curvature
+    return g0.astype(np.float32), g1.astype(np.float32), g2.astype(np.float32)
+
+
+class HessianScaleSpace():
+    """ Hessian of one grayscale image at successive scales, float32 by default.
+        The second derivatives are separable derivative-of-Gaussian filters and the
+        eigenvalues of the symmetric 2x2 matrices are computed in closed form. All the
+        arrays are allocated once and overwritten for every sigma, so the results of
+        hessian() and eigenvalues() are only valid until the next call. """
+
+    def __init__(self, image, precision=DEFAULT_PRECISION):
+        dtype, self.depth = float_type(precision)
+        self.image = np.ascontiguousarray(image, dtype=dtype)
+        shape = self.image.shape
+        self.hrr = np.empty(shape, dtype)
+        self.hrc = np.empty(shape, dtype)
+        self.hcc = np.empty(shape, dtype)
+        self.lambda1 = np.empty(shape, dtype)
+        self.lambda2 = np.empty(shape, dtype)
+        self._root = np.empty(shape, dtype)
+
+    def hessian(self, sigma, normalized=True):
+        """ (Hrr, Hrc, Hcc), multiplied by sigma^2 when normalized so that scales can be compared. """
+        g0, g1, g2 = gaussian_derivative_kernels(sigma)
+        with stage('hessian'):
+            # sepFilter2D(src, ddepth, kernelX (columns), kernelY (rows))
+            cv2.sepFilter2D(self.image, self.depth, g0, g2, dst=self.hrr, borderType=cv2.BORDER_REFLECT)
+            cv2.sepFilter2D(self.image, self.depth, g1, g1, dst=self.hrc, borderType=cv2.BORDER_REFLECT)
+            cv2.sepFilter2D(self.image, self.depth, g2, g0, dst=self.hcc, borderType=cv2.BORDER_REFLECT)
+            if normalized:
+                for element in (self.hrr, self.hrc, self.hcc):
+                    element *= sigma ** 2
+        return self.hrr, self.hrc, self.hcc
+
+    def eigenvalues(self):
+        """ (lambda1, lambda2), lambda1 >= lambda2, of the last computed Hessian:
+            (a + c) / 2 +- sqrt(((a - c) / 2)^2 + b^2) for [[a, b], [b, c]]. """
+        with stage('eigenvalues'):
+            np.subtract(self.hrr, self.hcc, out=self._root)
+            self._root *= 0.5
+            cv2.magnitude(self._root, self.hrc, self._root)
+            np.add(self.hrr, self.hcc, out=self.lambda1)
+            self.lambda1 *= 0.5
+            np.subtract(self.lambda1, self._root, out=self.lambda2)
+            self.lambda1 += self._root
+        return self.lambda1, self.lambda2
+
+
+ScaleSelection = namedtuple('ScaleSelection', ['sigma', 'score', 'eigenvalues', 'hessian'])
+
+
+def select_scale(image, sigmas, normalized=True, precision=DEFAULT_PRECISION):
+    """ The sigma at which the smallest Hessian eigenvalue reaches its largest maximum,
+        with copies of the eigenvalues (2, H, W) and Hessian elements (3, H, W) at that sigma. """
+    scale_space = HessianScaleSpace(image, precision)
+    best = None
+    for sigma in sigmas:
+        hessian = scale_space.hessian(sigma, normalized)
+        eigvals = scale_space.eigenvalues()
+        score = float(eigvals[1].max())
+        if best is None or score > best.score:
+            # The buffers are overwritten by the next sigma, the best one is kept as a copy
+            best = ScaleSelection(sigma, score, np.stack(eigvals), np.stack(hessian))
+    return best
@@ -0,0 +1,227 @@
+import itertools
+import os
+import queue
+import threading
+import time
+import traceback
+from collections import namedtuple
+from PyQt5.QtCore import QObject, pyqtSignal, pyqtSlot
+import cv2
+
+""" Streaming of video files and numbered image sequences through a filter.
+
+    A reader thread decodes frames into a bounded queue and a filter thread takes them
+    out, filters them and hands them to the display. When the filter cannot keep up the
+    reader drops the oldest queued frame instead of waiting, so the display follows the
+    video in real time at a lower rate. Files and image sequences are read at their frame
+    rate, frames are only dropped when the filter is slower than the video. A filtered
+    output video needs every frame, so while writing one the reader waits for the filter
+    instead. The display is fed one frame at a time: a frame finished while the previous
+    one has not been shown yet is not sent (frameShown() acknowledges a shown frame).
+    Signals still queued from a stopped stream are dropped once another one has started. """
+
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.bmp', '.tif', '.tiff')
+# Frame rate of the output video when the source does not tell its own
+DEFAULT_FPS = 25.0
+
+StreamStats = namedtuple('StreamStats', ['read', 'processed', 'dropped', 'displayed', 'seconds', 'fps'])
+
+_END = object()
+
+
+def open_capture(source):
+    """ cv2.VideoCapture of a video file, of the numbered image sequence starting at an
+        image (frame_0001.png, or a printf pattern like frame_%04d.png) or of a camera
+        index. Raises OSError when it cannot be opened. """
+    if isinstance(source, int):
+        capture = cv2.VideoCapture(source)
+    elif '%' in source or os.path.splitext(source)[1].lower() in IMAGE_EXTENSIONS:
+        # OpenCV takes the number in the file name as the first index of the sequence
+        capture = cv2.VideoCapture(source, cv2.CAP_IMAGES)
+    else:
+        capture = cv2.VideoCapture(source)
+    if not capture.isOpened():
+        raise OSError(f"Cannot open video source: {source}")
+    return capture
+
+
+class FrameStream(QObject):
+    """ Runs one stream at a time: start(), then frameReady for every displayed frame,
+        statsChanged about once a second and finished with the final StreamStats. """
+    frameReady = pyqtSignal(object, int) # filtered frame, index in the source
+    statsChanged = pyqtSignal(object)
+    finished = pyqtSignal(object)
+    failed = pyqtSignal(str)
+    # From the filter thread, tagged with the stream they belong to
+    _frameReady = pyqtSignal(int, object, int)
+    _statsChanged = pyqtSignal(int, object)
+    _finished = pyqtSignal(int, object)
+    _failed = pyqtSignal(int, str)
+
+    def __init__(self, queue_size=4, parent=None):
+        super().__init__(parent)
+        self.queue_size = queue_size
+        self._stream_ids = itertools.count(1)
+        self._stream_id = 0
+        self._frameReady.connect(self._on_frame_ready)
+        self._statsChanged.connect(self._on_stats_changed)
+        self._finished.connect(self._on_finished)
+        self._failed.connect(self._on_failed)
+        self._threads = []
+        self._stop = threading.Event()
+        self._filter = (None, {})
+        self._display_pending = False
+
+    def start(self, source, func=None, settings=None, output=None, fourcc='mp4v'):
+        """ Streams source (see open_capture) through func(frame, **settings), frames are
+            shown unfiltered when func is None. With output the filtered frames are also
+            written to that video file. """
+        self.stop()
+        capture = open_capture(source)
+        self._stop = threading.Event()
+        self._filter = (func, dict(settings or {}))
+        self._display_pending = False
+        self._counts = {'read': 0, 'processed': 0, 'dropped': 0, 'displayed': 0}
+        self._start_time = time.perf_counter()
+        self._stream_id = next(self._stream_ids)
+
+        frames = queue.Queue(self.queue_size)
+        fps = capture.get(cv2.CAP_PROP_FPS) or DEFAULT_FPS
+        writer = (output, cv2.VideoWriter_fourcc(*fourcc), fps) if output else None
+        # A camera delivers at its own rate, a file as fast as it decodes
+        interval = 1 / fps if writer is None and not isinstance(source, int) else 0.0
+        read_args = (capture, frames, writer is None, interval, self._stop)
+        process_args = (frames, writer, self._stream_id, self._stop)
+        self._threads = [threading.Thread(target=self._read, args=read_args, name='stream-read', daemon=True),
+                         threading.Thread(target=self._process, args=process_args, name='stream-filter', daemon=True)]
+        for thread in self._threads:
+            thread.start()
+
+    def setFilter(self, func, settings=None):
+        """ Filter of the next frames, the stream keeps running. """
+        self._filter = (func, dict(settings or {}))
+
+    def frameShown(self):
+        self._counts['displayed'] += 1
+        self._display_pending = False
+
+    def isRunning(self):
+        return any(thread.is_alive() for thread in self._threads)
+
+    def stop(self):
+        self._stop.set()
+        for thread in self._threads:
+            thread.join()
+        self._threads = []
+
+    def stats(self):
+        seconds = time.perf_counter() - self._start_time
+        counts = self._counts
+        return StreamStats(counts['read'], counts['processed'], counts['dropped'], counts['displayed'],
+                           seconds, counts['processed'] / seconds if seconds else 0.0)
+
+    def _read(self, capture, frames, drop, interval, stop):
+        next_frame = time.perf_counter()
+        try:
+            while not stop.is_set():
+                if interval:
+                    # Paced to the frame rate of the source
+                    delay = next_frame - time.perf_counter()
+                    if delay > 0 and stop.wait(delay):
+                        break
+                    next_frame = max(next_frame + interval, time.perf_counter() - interval)
+                ok, frame = capture.read()
+                if not ok:
+                    break
+                self._counts['read'] += 1
+                index = self._counts['read'] - 1
+                if drop:
+                    try:
+                        frames.put_nowait((index, frame))
+                    except queue.Full:
+                        # Backpressure: the oldest waiting frame makes room for the newest
+                        try:
+                            frames.get_nowait()
+                            self._counts['dropped'] += 1
+                        except queue.Empty:
+                            pass
+                        frames.put_nowait((index, frame))
+                else:
+                    while not stop.is_set():
+                        try:
+                            frames.put((index, frame), timeout=0.1)
+                            break
+                        except queue.Full:
+                            pass
+        finally:
+            capture.release()
+            # The filter thread is the only other consumer, there is room after a short wait
+            while not stop.is_set():
+                try:
+                    frames.put(_END, timeout=0.1)
+                    break
+                except queue.Full:
+                    pass
+
+    def _process(self, frames, output, stream_id, stop):
+        writer = None
+        last_report = time.perf_counter()
+        try:
+            while not stop.is_set():
+                try:
+                    item = frames.get(timeout=0.1)
+                except queue.Empty:
+                    continue
+                if item is _END:
+                    break
+                index, frame = item
+                func, settings = self._filter
+                result = frame if func is None else func(frame, **settings)
+                self._counts['processed'] += 1
+
+                if output is not None:
+                    if writer is None:
+                        path, fourcc, fps = output
+                        height, width = result.shape[:2]
+                        writer = cv2.VideoWriter(path, fourcc, fps, (width, height), result.ndim == 3)
+                        if not writer.isOpened():
+                            raise OSError(f"Cannot write video: {path}")
+                    writer.write(result)
+
+                if not self._display_pending:
+                    self._display_pending = True
+                    self._frameReady.emit(stream_id, result, index)
+
+                now = time.perf_counter()
+                if now - last_report >= 1.0:
+                    last_report = now
+                    self._statsChanged.emit(stream_id, self.stats())
+        except Exception:
+            stop.set()
+            self._failed.emit(stream_id, traceback.format_exc())
+        finally:
+            if writer is not None:
+                writer.release()
+            self._finished.emit(stream_id, self.stats())
+
+    # Relayed on the thread of the stream object, so a stale stream is known for sure
+
+    @pyqtSlot(int, object, int)
+    def _on_frame_ready(self, stream_id, frame, index):
+        if stream_id == self._stream_id:
+            self.frameReady.emit(frame, index)
+
+    @pyqtSlot(int, object)
+    def _on_stats_changed(self, stream_id, stats):
+        if stream_id == self._stream_id:
+            self.statsChanged.emit(stats)
+
+    @pyqtSlot(int, object)
+    def _on_finished(self, stream_id, stats):
+        if stream_id == self._stream_id:
+            self.finished.emit(stats)
+
+    @pyqtSlot(int, str)
+    def _on_failed(self, stream_id, message):
+        if stream_id == self._stream_id:
+            self.failed.emit(message)
@@ -0,0 +1,205 @@
+import argparse
+import itertools
+import json
+import os
+import sys
+import time
+from collections import namedtuple, defaultdict
+from concurrent.futures import ProcessPoolExecutor
+import cv2
+import numpy as np
+from .cache import settings_key
+from .comparison import GRADIENT_FAMILIES, complete_settings
+from .gradient import gradient
+from .registry import FILTERS, filter_key
+from .transformation import to_grayscale, normalize_to_uint8, canny_maxima, canny_hysteresis, display_images_in_grid
+
+""" Parameter sweeps: one filter of the registry over the Cartesian product of ranges of
+    its settings, e.g. Canny threshold1 x threshold2 x sigma or the Hessian sigmas.
+
+    The points are grouped by the settings their expensive intermediate depends on and
+    every worker process gets whole groups, so the intermediate is made once per group:
+    the smoothed gradient and its maxima of Canny (per sigma), the x/y derivatives of the
+    gradient filters (per kernel size, for all directions) and, through the scale-space
+    cache of the process, the Hessian eigenvalues of the ridge filters (per scale). The
+    time of a point includes the intermediate when it was the first of its group.
+
+    Example (what the __main__ block of transformation.py used to do):
+        python -m controllers.sweep canny img/messi.jpg --set threshold1=0.6,0.7,0.82 \
+            --set threshold2=0.9 --set sigma=1 -o canny_sweep.png """
+
+SweepPoint = namedtuple('SweepPoint', ['settings', 'image', 'seconds'])
+Sweep = namedtuple('Sweep', ['key', 'points', 'wall_s'])
+
+# shared: the settings the intermediate depends on, intermediate(gray, settings) makes it
+# and finish(intermediate, settings) the result of one point
+Engine = namedtuple('Engine', ['shared', 'intermediate', 'finish'])
+
+
+def _canny_finish(maxima, settings):
+    edges = canny_hysteresis(*maxima, settings['threshold1'], settings['threshold2']).astype(np.uint8)
+    edges *= 255
+    return edges
+
+
+def _gradient_engine(family):
+    return Engine(('kernel_size', 'precision'),
+                  lambda gray, s: gradient(gray, family, s.get('kernel_size', 3), 'xy', s['precision']),
+                  lambda components, s: normalize_to_uint8(components.response(s['direction'])))
+
+
+ENGINES = {'canny_button': Engine(('sigma', 'precision'),
+                                  lambda gray, s: canny_maxima(gray, s['sigma'], s['precision']),
+                                  _canny_finish),
+           **{key: _gradient_engine(family) for key, family in GRADIENT_FAMILIES.items()}}
+
+# The filters without an engine reuse the caches of the worker process, points agreeing on
+# these settings run in the same process. Every point of the ridge filters computes the
+# min_sigma scale, whatever its sigmas: a sigmas sweep is one group that makes it once.
+# scale_space does not go through the cache, its points are spread over the processes.
+GROUP_SETTINGS = {'hessian_button': ('min_sigma', 'precision'),
+                  'sato_button': ('min_sigma', 'precision'),
+                  'meijering_button': ('min_sigma', 'precision')}
+
+
+def parameter_grid(ranges):
+    """ Every combination of the values in ranges ({setting: values}), a single value is a
+        range of one. """
+    names = list(ranges)
+    values = [x if isinstance(x, (list, tuple, range, np.ndarray)) else [x] for x in ranges.values()]
+    return [dict(zip(names, combination)) for combination in itertools.product(*values)]
+
+
+def _group_key(key, settings):
+    engine = ENGINES.get(key)
+    names = engine.shared if engine is not None else GROUP_SETTINGS.get(key)
+    if names is None: # nothing to share, every point is its own group
+        return settings_key(settings)
+    return settings_key({name: settings.get(name) for name in names})
+
+
+def _run_groups(key, gray, groups):
+    """ Runs in a worker process: [[(index, settings), ...], ...] -> [(index, image, seconds), ...] """
+    engine = ENGINES.get(key)
+    results = []
+    for group in groups:
+        intermediate = None
+        for index, settings in group:
+            start = time.perf_counter()
+            if engine is None:
+                image = FILTERS[key](gray, **settings)
+            else:
+                if intermediate is None:
+                    intermediate = engine.intermediate(gray, settings)
+                image = engine.finish(intermediate, settings)
+            results.append((index, image, time.perf_counter() - start))
+    return results
+
+
+def sweep(image, name, ranges, workers=None):
+    """ Applies the filter name (registry key or short name) to image at every point of
+        parameter_grid(ranges), the other settings keep their defaults. Returns a Sweep
+        with the points in the order of the grid. """
+    key = filter_key(name)
+    points = [complete_settings(key, settings) for settings in parameter_grid(ranges)]
+    workers = min(workers or os.cpu_count() or 1, len(points)) or 1
+
+    start = time.perf_counter()
+    gray = to_grayscale(image)
+    groups = defaultdict(list)
+    for index, settings in enumerate(points):
+        groups[_group_key(key, settings)].append((index, settings))
+    # Whole groups to every process, the largest first to balance the work
+    buckets = [[] for _ in range(workers)]
+    for i, group in enumerate(sorted(groups.values(), key=len, reverse=True)):
+        buckets[i % workers].append(group)
+
+    results = [None] * len(points)
+    with ProcessPoolExecutor(workers) as pool:
+        for bucket in pool.map(_run_groups, itertools.repeat(key), itertools.repeat(gray),
+                               [x for x in buckets if x]):
+            for index, result, seconds in bucket:
+                results[index] = SweepPoint(points[index], result, seconds)
+    return Sweep(key, results, time.perf_counter() - start)
+
+
+def varying_settings(result):
+    """ The names of the settings that differ between the points. """
+    names = result.points[0].settings if result.points else {}
+    return [name for name in names if len({settings_key(x.settings[name]) for x in result.points}) > 1]
+
+
+def contact_sheet(result, path=None, columns=None, dpi=150):
+    """ All points of a sweep in one image, titled with the settings that vary and the time. """
+    names = varying_settings(result)
+    titles = [', '.join(f'{name}={point.settings[name]}' for name in names) + f' ({point.seconds * 1000:.0f} ms)'
+              for point in result.points]
+    grid_shape = None
+    if columns is not None:
+        grid_shape = (-(-len(result.points) // columns), columns)
+    return display_images_in_grid([x.image for x in result.points], titles, grid_shape, path, dpi)
+
+
+def timings(result):
+    """ JSON-ready report: the settings and the time of every point, and the totals. """
+    return {'filter': result.key,
+            'points': [{'settings': x.settings, 'seconds': x.seconds} for x in result.points],
+            'wall_s': result.wall_s,
+            'sum_s': sum(x.seconds for x in result.points)}
+
+
+def parse_range(text):
+    """ 'a,b,c' is a list of values, 'start:stop:step' the numbers from start to stop
+        included. Values are JSON (numbers, true/false) or plain strings. """
+    def value(x):
+        try:
+            return json.loads(x)
+        except ValueError:
+            return x
+    if text.count(':') == 2:
+        start, stop, step = (float(x) for x in text.split(':'))
+        numbers = np.arange(start, stop + step / 2, step)
+        return [x.item() for x in numbers.round(10)]
+    return [value(x) for x in text.split(',')]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('filter', help='filter name, e.g. canny, hessian')
+    parser.add_argument('image', help='path of the input image')
+    parser.add_argument('--set', action='append', default=[], metavar='NAME=VALUES',
+                        help="a setting and its values: 'a,b,c' or 'start:stop:step' (repeatable)")
+    parser.add_argument('--workers', type=int, help='worker processes, default: one per CPU')
+    parser.add_argument('--columns', type=int)
+    parser.add_argument('-o', '--output', required=True, help='contact sheet (.png, .pdf, ...)')
+    parser.add_argument('--timings', help='per-point timings as JSON, default: next to the contact sheet')
+    args = parser.parse_args(argv)
+
+    image = cv2.imread(args.image, cv2.IMREAD_COLOR)
+    if image is None:
+        parser.error(f"Cannot read image: {args.image}")
+    ranges = {}
+    for item in args.set:
+        name, _, values = item.partition('=')
+        if not values:
+            parser.error(f"Expected NAME=VALUES, got: {item}")
+        ranges[name] = parse_range(values)
+    try:
+        result = sweep(image, args.filter, ranges, args.workers)
+    except KeyError as e:
+        parser.error(e.args[0])
+    except TypeError as e: # a setting the filter does not have
+        parser.error(str(e))
+
+    contact_sheet(result, args.output, args.columns)
+    report = timings(result)
+    timings_path = args.timings or os.path.splitext(args.output)[0] + '_timings.json'
+    with open(timings_path, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f"{len(result.points)} points in {report['wall_s']:.2f} s "
+          f"({report['sum_s']:.2f} s of work) -> {args.output}, {timings_path}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
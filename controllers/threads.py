@@ -0,0 +1,132 @@
+import os
+from contextlib import contextmanager, nullcontext
+import cv2
+from .registry import filter_key
+
+""" Thread counts of the libraries the filters run on.
+
+    OpenCV (Sobel, Scharr, GaussianBlur, equalizeHist...) has its own thread pool, NumPy and
+    SciPy use the BLAS / OpenMP pools for a few operations, and the skimage parts of the
+    filters are single-threaded: those only scale through the tiled engine, which runs the
+    tiles of one filter on several worker threads. All three can be set here, at runtime or
+    from the environment when the application starts:
+
+        EDGE_DETECTION_OPENCV_THREADS=4      cv2.setNumThreads
+        EDGE_DETECTION_BLAS_THREADS=1        BLAS / OpenMP pools
+        EDGE_DETECTION_FILTER_WORKERS=2,hessian=8,sato=8
+                                             tile workers, for all filters and per filter
+
+    The BLAS pools are limited through threadpoolctl when it is installed. Without it the
+    usual environment variables are set, which only the libraries loaded afterwards read. """
+
+BLAS_VARIABLES = ('OMP_NUM_THREADS', 'OPENBLAS_NUM_THREADS', 'MKL_NUM_THREADS',
+                  'BLIS_NUM_THREADS', 'VECLIB_MAXIMUM_THREADS', 'NUMEXPR_NUM_THREADS')
+
+_filter_workers = {} # registry key -> tile workers, None -> every other filter
+_blas_limits = None  # the active threadpoolctl limits, kept alive
+
+
+def set_opencv_threads(count):
+    """ Threads of OpenCV's pool, 1 runs its functions on the calling thread. """
+    cv2.setNumThreads(count)
+
+
+def opencv_threads():
+    return cv2.getNumThreads()
+
+
+def set_blas_threads(count):
+    """ Limits the BLAS / OpenMP pools. Returns False when threadpoolctl is missing and only
+        the environment variables could be set. """
+    global _blas_limits
+    try:
+        from threadpoolctl import threadpool_limits
+    except ImportError:
+        for name in BLAS_VARIABLES:
+            os.environ[name] = str(count)
+        return False
+    _blas_limits = threadpool_limits(limits=count)
+    return True
+
+
+def blas_threads():
+    """ Largest thread count of the loaded BLAS / OpenMP pools, None when unknown. """
+    try:
+        from threadpoolctl import threadpool_info
+    except ImportError:
+        value = os.environ.get('OMP_NUM_THREADS')
+        return int(value) if value and value.isdigit() else None
+    counts = [x['num_threads'] for x in threadpool_info()]
+    return max(counts) if counts else None
+
+
+def set_filter_workers(workers):
+    """ workers: a number of tile workers for every filter, or {filter name: workers} where
+        the name None sets the default of the filters not listed. """
+    if not isinstance(workers, dict):
+        workers = {None: workers}
+    for name, count in workers.items():
+        _filter_workers[None if name is None else filter_key(name)] = int(count)
+
+
+def filter_workers(key, default=1):
+    """ Tile workers of the filter key (registry key or short name). """
+    key = filter_key(key)
+    return _filter_workers.get(key, _filter_workers.get(None, default))
+
+
+def configure(opencv=None, blas=None, workers=None):
+    """ Sets what is not None, see set_opencv_threads, set_blas_threads and set_filter_workers. """
+    if opencv is not None:
+        set_opencv_threads(opencv)
+    if blas is not None:
+        set_blas_threads(blas)
+    if workers is not None:
+        set_filter_workers(workers)
+
+
+def parse_workers(text):
+    """ '4' -> {None: 4}, '2,hessian=8' -> {None: 2, 'hessian': 8} """
+    workers = {}
+    for item in text.split(','):
+        name, _, count = item.rpartition('=')
+        workers[name.strip() or None] = int(count)
+    return workers
+
+
+def configure_from_environment(environ=None):
+    """ Applies the EDGE_DETECTION_*_THREADS / _WORKERS variables that are set. """
+    environ = os.environ if environ is None else environ
+    opencv = environ.get('EDGE_DETECTION_OPENCV_THREADS')
+    blas = environ.get('EDGE_DETECTION_BLAS_THREADS')
+    workers = environ.get('EDGE_DETECTION_FILTER_WORKERS')
+    configure(opencv=int(opencv) if opencv else None,
+              blas=int(blas) if blas else None,
+              workers=parse_workers(workers) if workers else None)
+
+
+def thread_info():
+    return {'cpu_count': os.cpu_count(),
+            'opencv_threads': opencv_threads(),
+            'blas_threads': blas_threads(),
+            'filter_workers': {key or 'default': count for key, count in _filter_workers.items()}}
+
+
+@contextmanager
+def thread_limits(opencv=None, blas=None):
+    """ OpenCV and BLAS thread counts inside the block only. """
+    previous = opencv_threads()
+    if opencv is not None:
+        set_opencv_threads(opencv)
+    blas_limits = nullcontext()
+    if blas is not None:
+        try:
+            from threadpoolctl import threadpool_limits
+            blas_limits = threadpool_limits(limits=blas)
+        except ImportError:
+            pass
+    try:
+        with blas_limits:
+            yield
+    finally:
+        set_opencv_threads(previous)
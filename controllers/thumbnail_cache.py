@@ -0,0 +1,101 @@
+import os
+import sqlite3
+import sys
+import threading
+import time
+
+""" Persistent thumbnail cache: one SQLite file holding the encoded thumbnails.
+    An entry is valid only while the file keeps the size and modification time it had
+    when the thumbnail was made; stale entries are deleted when they are looked up.
+    The least recently used entries are evicted above max_bytes. """
+
+DEFAULT_MAX_BYTES = 256 * 2**20
+
+
+def default_cache_path():
+    if sys.platform == 'win32':
+        base = os.environ.get('LOCALAPPDATA', os.path.expanduser('~'))
+    else:
+        base = os.environ.get('XDG_CACHE_HOME', os.path.expanduser('~/.cache'))
+    return os.path.join(base, 'mvc-edge-detection', 'thumbnails.sqlite')
+
+
+class ThumbnailCache():
+    SCHEMA = '''CREATE TABLE IF NOT EXISTS thumbnails (
+                    path TEXT NOT NULL,
+                    thumbnail_size INTEGER NOT NULL,
+                    file_size INTEGER NOT NULL,
+                    mtime_ns INTEGER NOT NULL,
+                    data BLOB NOT NULL,
+                    last_used REAL NOT NULL,
+                    PRIMARY KEY (path, thumbnail_size))'''
+
+    def __init__(self, path=None, max_bytes=DEFAULT_MAX_BYTES):
+        self.path = path or default_cache_path()
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+
+        if self.path != ':memory:':
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        # One connection shared by the thumbnail threads, serialized by the lock
+        self._connection = sqlite3.connect(self.path, check_same_thread=False, timeout=10)
+        with self._lock, self._connection:
+            self._connection.execute('PRAGMA journal_mode=WAL')
+            self._connection.execute(self.SCHEMA)
+            self._connection.execute('CREATE INDEX IF NOT EXISTS thumbnails_last_used ON thumbnails (last_used)')
+            self._nbytes = self._connection.execute(
+                'SELECT COALESCE(SUM(LENGTH(data)), 0) FROM thumbnails').fetchone()[0]
+
+    def get(self, path, thumbnail_size, stat=None):
+        """ The encoded thumbnail, or None when missing or made from an older version of the file. """
+        stat = stat or os.stat(path)
+        with self._lock, self._connection:
+            row = self._connection.execute(
+                'SELECT file_size, mtime_ns, data FROM thumbnails WHERE path = ? AND thumbnail_size = ?',
+                (path, thumbnail_size)).fetchone()
+            if row is None:
+                return None
+            file_size, mtime_ns, data = row
+            if file_size != stat.st_size or mtime_ns != stat.st_mtime_ns:
+                self._connection.execute('DELETE FROM thumbnails WHERE path = ? AND thumbnail_size = ?',
+                                         (path, thumbnail_size))
+                self._nbytes -= len(data)
+                return None
+            self._connection.execute('UPDATE thumbnails SET last_used = ? WHERE path = ? AND thumbnail_size = ?',
+                                     (time.time(), path, thumbnail_size))
+            return bytes(data)
+
+    def put(self, path, thumbnail_size, data, stat=None):
+        stat = stat or os.stat(path)
+        with self._lock, self._connection:
+            previous = self._connection.execute(
+                'SELECT LENGTH(data) FROM thumbnails WHERE path = ? AND thumbnail_size = ?',
+                (path, thumbnail_size)).fetchone()
+            self._connection.execute(
+                'INSERT OR REPLACE INTO thumbnails VALUES (?, ?, ?, ?, ?, ?)',
+                (path, thumbnail_size, stat.st_size, stat.st_mtime_ns, sqlite3.Binary(data), time.time()))
+            self._nbytes += len(data) - (previous[0] if previous else 0)
+            if self._nbytes > self.max_bytes:
+                self._evict()
+
+    def _evict(self):
+        # Down to 90% of the limit, so that eviction does not run on every insert
+        target = int(self.max_bytes * 0.9)
+        rows = self._connection.execute(
+            'SELECT rowid, LENGTH(data) FROM thumbnails ORDER BY last_used').fetchall()
+        doomed = []
+        for rowid, nbytes in rows:
+            if self._nbytes <= target:
+                break
+            doomed.append((rowid,))
+            self._nbytes -= nbytes
+        self._connection.executemany('DELETE FROM thumbnails WHERE rowid = ?', doomed)
+
+    def clear(self):
+        with self._lock, self._connection:
+            self._connection.execute('DELETE FROM thumbnails')
+            self._nbytes = 0
+
+    def close(self):
+        with self._lock:
+            self._connection.close()
@@ -0,0 +1,237 @@
+from PyQt5.QtCore import QObject, QRunnable, QThreadPool, QByteArray, QBuffer, QIODevice, Qt, pyqtSignal, pyqtSlot
+from PyQt5.QtGui import QImage, QImageReader
+import itertools
+import os
+import sqlite3
+import traceback
+import math
+import cv2
+import numpy as np
+from .directory import iter_images
+from .loaders import is_large_format, open_image
+from .thumbnail_cache import ThumbnailCache
+
+""" Background directory scanning and thumbnail decoding for the image list.
+    The scanner streams the directory entries in batches, the thumbnails are decoded in
+    a thread pool at reduced resolution and delivered one by one as they finish. Both are
+    tagged with a generation number so that opening another directory discards them.
+    Decoded thumbnails are stored in the persistent ThumbnailCache, which is consulted
+    before decoding anything. """
+
+THUMBNAIL_SIZE = 64
+SCAN_BATCH = 256
+
+# JPEG can be decoded directly at 1/2, 1/4 or 1/8 of the resolution (DCT scaling)
+REDUCED_MODES = ((8, cv2.IMREAD_REDUCED_COLOR_8),
+                 (4, cv2.IMREAD_REDUCED_COLOR_4),
+                 (2, cv2.IMREAD_REDUCED_COLOR_2),
+                 (1, cv2.IMREAD_COLOR))
+
+
+def decode_large_thumbnail(path, size=THUMBNAIL_SIZE):
+    """ Thumbnail of a .npy, raw or TIFF scan from every n-th pixel, the file is not read in full. """
+    try:
+        image = open_image(path)
+    except ValueError:
+        return None
+    step = max(1, math.ceil(max(image.shape[:2]) / size))
+    image = np.ascontiguousarray(image[::step, ::step])
+    if image.dtype != np.uint8:
+        image = cv2.normalize(image, None, 0, 255, cv2.NORM_MINMAX, cv2.CV_8U)
+    height, width = image.shape[:2]
+    if image.ndim == 2:
+        return QImage(image.data, width, height, image.strides[0], QImage.Format_Grayscale8).copy()
+    image = np.ascontiguousarray(cv2.cvtColor(image[..., :3], cv2.COLOR_BGR2RGB))
+    return QImage(image.data, width, height, image.strides[0], QImage.Format_RGB888).copy()
+
+
+def decode_thumbnail(path, size=THUMBNAIL_SIZE):
+    """ QImage of at most size x size pixels, or None when the file cannot be decoded. """
+    if is_large_format(path):
+        return decode_large_thumbnail(path, size)
+    image = None
+    for reduction, mode in REDUCED_MODES:
+        image = cv2.imread(path, mode)
+        if image is None:
+            break
+        # A reduced decode of a small image would end up smaller than the thumbnail
+        if reduction == 1 or min(image.shape[:2]) >= size:
+            break
+
+    if image is None:
+        # Formats OpenCV does not read (GIF) go through Qt, which can scale while decoding
+        reader = QImageReader(path)
+        original = reader.size()
+        if original.isValid():
+            reader.setScaledSize(original.scaled(size, size, Qt.KeepAspectRatio))
+        q_image = reader.read()
+        return None if q_image.isNull() else q_image
+
+    height, width = image.shape[:2]
+    scale = size / max(height, width)
+    if scale < 1:
+        image = cv2.resize(image, (max(1, round(width * scale)), max(1, round(height * scale))),
+                           interpolation=cv2.INTER_AREA)
+    image = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
+    height, width = image.shape[:2]
+    # copy() detaches the QImage from the numpy buffer
+    return QImage(image.data, width, height, image.strides[0], QImage.Format_RGB888).copy()
+
+
+def encode_thumbnail(q_image):
+    data = QByteArray()
+    buffer = QBuffer(data)
+    buffer.open(QIODevice.WriteOnly)
+    q_image.save(buffer, 'PNG')
+    buffer.close()
+    return bytes(data)
+
+
+class ScannerSignals(QObject):
+    batchReady = pyqtSignal(int, list)
+    finished = pyqtSignal(int)
+    error = pyqtSignal(int, str)
+
+
+class DirectoryScanner(QRunnable):
+    def __init__(self, generation, directory, batch_size=SCAN_BATCH):
+        super().__init__()
+        self.generation = generation
+        self.directory = directory
+        self.batch_size = batch_size
+        self.cancelled = False
+        self.signals = ScannerSignals()
+
+    @pyqtSlot()
+    def run(self):
+        try:
+            batch = []
+            for item in iter_images(self.directory):
+                if self.cancelled:
+                    return
+                batch.append(item.data())
+                if len(batch) == self.batch_size:
+                    self.signals.batchReady.emit(self.generation, batch)
+                    batch = []
+            if batch:
+                self.signals.batchReady.emit(self.generation, batch)
+        except OSError:
+            self.signals.error.emit(self.generation, traceback.format_exc())
+        self.signals.finished.emit(self.generation)
+
+
+class ThumbnailSignals(QObject):
+    ready = pyqtSignal(int, str, QImage)
+    failed = pyqtSignal(int, str, str) # generation, path, message
+
+
+class ThumbnailJob(QRunnable):
+    def __init__(self, generation, path, size, signals, cache=None):
+        super().__init__()
+        self.generation = generation
+        self.path = path
+        self.size = size
+        self.signals = signals
+        self.cache = cache
+
+    def cached(self, stat):
+        try:
+            data = self.cache.get(self.path, self.size, stat)
+        except sqlite3.Error:
+            return None
+        if data is None:
+            return None
+        q_image = QImage.fromData(data)
+        return None if q_image.isNull() else q_image
+
+    @pyqtSlot()
+    def run(self):
+        try:
+            stat = os.stat(self.path)
+            q_image = self.cached(stat) if self.cache is not None else None
+            if q_image is None:
+                q_image = decode_thumbnail(self.path, self.size)
+                if q_image is not None and self.cache is not None:
+                    self.cache.put(self.path, self.size, encode_thumbnail(q_image), stat)
+        except (OSError, sqlite3.Error, cv2.error):
+            q_image = None
+        except Exception:
+            # An exception escaping run() would abort the application
+            self.signals.failed.emit(self.generation, self.path, traceback.format_exc())
+            return
+        if q_image is not None:
+            self.signals.ready.emit(self.generation, self.path, q_image)
+
+
+class DirectoryLoader(QObject):
+    """ Scans a directory and loads the thumbnails of its images in the background. """
+    batchReady = pyqtSignal(list)            # [[name, extension, path], ...]
+    scanFinished = pyqtSignal()
+    thumbnailReady = pyqtSignal(str, QImage) # path, thumbnail
+
+    def __init__(self, thumbnail_size=THUMBNAIL_SIZE, max_workers=None, cache=None):
+        super().__init__()
+        self.thumbnail_size = thumbnail_size
+        if cache is None:
+            try:
+                cache = ThumbnailCache()
+            except (OSError, sqlite3.Error) as e:
+                print(f'The thumbnail cache is disabled: {e}')
+        self._cache = cache
+        self._scan_pool = QThreadPool()
+        self._scan_pool.setMaxThreadCount(1)
+        self._thumbnail_pool = QThreadPool()
+        self._thumbnail_pool.setMaxThreadCount(max_workers or max(1, (os.cpu_count() or 2) - 1))
+
+        self._generations = itertools.count(1)
+        self._generation = 0
+        self._scanner = None
+        self._thumbnail_signals = ThumbnailSignals()
+        self._thumbnail_signals.ready.connect(self._on_thumbnail_ready)
+        self._thumbnail_signals.failed.connect(self._on_thumbnail_failed)
+
+    def load(self, directory):
+        self.cancel()
+        self._generation = next(self._generations)
+        self._scanner = DirectoryScanner(self._generation, directory)
+        self._scanner.signals.batchReady.connect(self._on_batch)
+        self._scanner.signals.finished.connect(self._on_finished)
+        self._scanner.signals.error.connect(self._on_error)
+        self._scan_pool.start(self._scanner)
+
+    def cancel(self):
+        if self._scanner is not None:
+            self._scanner.cancelled = True
+            self._scanner = None
+        # Thumbnails of the previous directory which have not started yet are dropped
+        self._thumbnail_pool.clear()
+
+    def requestThumbnail(self, path):
+        self._thumbnail_pool.start(ThumbnailJob(self._generation, path, self.thumbnail_size,
+                                                self._thumbnail_signals, self._cache))
+
+    @pyqtSlot(int, list)
+    def _on_batch(self, generation, batch):
+        if generation == self._generation:
+            self.batchReady.emit(batch)
+
+    @pyqtSlot(int)
+    def _on_finished(self, generation):
+        if generation == self._generation:
+            self._scanner = None
+            self.scanFinished.emit()
+
+    @pyqtSlot(int, str)
+    def _on_error(self, generation, message):
+        if generation == self._generation:
+            print(message)
+
+    @pyqtSlot(int, str, QImage)
+    def _on_thumbnail_ready(self, generation, path, q_image):
+        if generation == self._generation:
+            self.thumbnailReady.emit(path, q_image)
+
+    @pyqtSlot(int, str, str)
+    def _on_thumbnail_failed(self, generation, path, message):
+        if generation == self._generation:
+            print(f'Cannot make the thumbnail of {path}:\n{message}')
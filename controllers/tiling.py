@@ -0,0 +1,310 @@
+import math
+import os
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+import cv2
+import numpy as np
+from scipy import ndimage as ndi
+from skimage.feature import canny
+from skimage.filters import gaussian
+from skimage.util import img_as_float, img_as_float32
+from .loaders import open_image
+from .precision import DEFAULT_PRECISION
+from .registry import filter_key
+from .scale_space import frangi_response, sato_response, meijering_scales
+from .threads import filter_workers
+from .transformation import to_grayscale, sobel_response, scharr_response, prewitt_response, farid_response
+
+""" Tiled execution of the transformations for images that do not fit in memory.
+
+    The source (an array, or a .npy, raw or TIFF file opened by loaders) is cut into
+    tiles sized from a memory budget. Every tile is read with a halo wide enough for the
+    filter's kernel (kernel size or largest sigma), filtered, cropped and written into a
+    float32 scratch array that is memory-mapped when it does not fit in the budget either.
+    The normalizations that need the whole image (min/max stretch, histogram equalization,
+    Canny's quantile thresholds, Meijering's per-scale maximum) are done from statistics
+    gathered over all tiles, so the stitched output matches the untiled filters up to the
+    halo truncation of the Gaussian kernels and Canny's hysteresis across tile borders. """
+
+DEFAULT_MEMORY_BUDGET = 512 * 2**20
+MIN_TILE = 64
+
+
+class TiledFilter():
+    """ How one registry filter is run tile by tile.
+        response(gray, settings, context) returns a float map, or a (k, h, w) stack for
+        filters that need per-scale statistics; finish is one of 'minmax', 'ridge', 'edges'. """
+
+    def __init__(self, response, halo, bytes_per_pixel, finish, scales=1, prepare=None):
+        self.response = response
+        self.halo = halo
+        self.bytes_per_pixel = bytes_per_pixel
+        self.finish = finish
+        self.scales = scales
+        self.prepare = prepare
+
+
+def _precision(settings):
+    return settings.get('precision', DEFAULT_PRECISION)
+
+
+def _ridge_sigmas(settings):
+    return (settings.get('min_sigma', 1), settings.get('sigmas', 10))
+
+
+def _ridge_halo(settings):
+    # The Hessian is two Gaussian derivative passes of sigma / sqrt(2), each cut at 5 sigma
+    return int(math.ceil(2 * 5 * max(_ridge_sigmas(settings)) / math.sqrt(2))) + 2
+
+
+def _canny_float(gray, precision=DEFAULT_PRECISION):
+    # skimage.feature.canny works on img_as_float values (8 and 16-bit scaled to [0, 1]),
+    # absolute thresholds are in that range
+    return img_as_float32(gray) if precision == 'float32' else img_as_float(gray)
+
+
+def _canny_magnitude(gray, sigma, precision=DEFAULT_PRECISION):
+    """ The gradient magnitude skimage's canny thresholds (mode='constant' with bleed-over correction). """
+    image = _canny_float(gray, precision)
+    smoothed = gaussian(image, sigma=sigma, mode='constant', preserve_range=False)
+    smoothed /= gaussian(np.ones_like(image), sigma=sigma, mode='constant', preserve_range=False) + np.finfo(image.dtype).eps
+    magnitude = ndi.sobel(smoothed, axis=0) ** 2
+    magnitude += ndi.sobel(smoothed, axis=1) ** 2
+    return np.sqrt(magnitude, out=magnitude)
+
+
+CANNY_BINS = 8192
+CANNY_MAX_MAGNITUDE = 4 * math.sqrt(2) # Sobel of values in [0, 1]
+
+
+def _canny_prepare(engine, settings):
+    """ First pass: histogram of the magnitude over all tiles to turn the quantiles into absolute thresholds. """
+    histogram = np.zeros(CANNY_BINS, dtype=np.int64)
+    for tile, window in engine.read_tiles():
+        magnitude = engine.crop(_canny_magnitude(to_grayscale(window), settings.get('sigma', 3), _precision(settings)), tile)
+        histogram += np.histogram(magnitude, bins=CANNY_BINS, range=(0, CANNY_MAX_MAGNITUDE))[0]
+
+    cumulative = np.cumsum(histogram) / histogram.sum()
+    edges = np.linspace(0, CANNY_MAX_MAGNITUDE, CANNY_BINS + 1)
+    def quantile(q):
+        return edges[min(np.searchsorted(cumulative, q) + 1, CANNY_BINS)]
+    return {'low_threshold': quantile(settings['threshold1']),
+            'high_threshold': quantile(settings['threshold2'])}
+
+
+def _canny_response(gray, settings, context):
+    edges = canny(_canny_float(gray, _precision(settings)), sigma=settings.get('sigma', 3), use_quantiles=False, **context)
+    return edges.astype(np.float32)
+
+
+TILED_FILTERS = {
+    'sobel_button': TiledFilter(
+        lambda gray, s, _: sobel_response(gray, s.get('kernel_size', 3), s.get('direction', 'combined'), _precision(s)),
+        lambda s: s.get('kernel_size', 3) // 2 + 1, 40, 'minmax'),
+    'scharr_button': TiledFilter(
+        lambda gray, s, _: scharr_response(gray, s.get('direction', 'combined'), _precision(s)),
+        lambda s: 2, 40, 'minmax'),
+    'prewitt_button': TiledFilter(
+        lambda gray, s, _: prewitt_response(gray, s.get('direction', 'combined'), _precision(s)),
+        lambda s: 2, 40, 'minmax'),
+    'farid_button': TiledFilter(
+        lambda gray, s, _: farid_response(gray, s.get('direction', 'combined'), _precision(s)),
+        lambda s: 3, 40, 'minmax'),
+    'canny_button': TiledFilter(
+        _canny_response,
+        # Gaussian cut at 4 sigma, Sobel, non-maximum suppression and some room for the hysteresis
+        lambda s: int(math.ceil(4 * s.get('sigma', 3))) + 8, 96, 'edges', prepare=_canny_prepare),
+    'hessian_button': TiledFilter(
+        lambda gray, s, _: frangi_response(gray, _ridge_sigmas(s), s.get('black_ridges', False), cache=False,
+                                           precision=_precision(s)),
+        _ridge_halo, 120, 'ridge'),
+    'sato_button': TiledFilter(
+        lambda gray, s, _: sato_response(gray, _ridge_sigmas(s), s.get('black_ridges', False), cache=False,
+                                         precision=_precision(s)),
+        _ridge_halo, 120, 'ridge'),
+    'meijering_button': TiledFilter(
+        lambda gray, s, _: np.stack(list(meijering_scales(gray, _ridge_sigmas(s), s.get('black_ridges', False), cache=False,
+                                                         precision=_precision(s)))),
+        _ridge_halo, 136, 'ridge', scales=2),
+}
+
+
+def open_source(source):
+    """ Arrays (np.memmap, TiffRegion) as they are, paths through loaders.open_image:
+        .npy, raw and TIFF files are opened without reading them. """
+    if not isinstance(source, str):
+        return source
+    return open_image(source)
+
+
+def open_output(output, shape):
+    """ uint8 result array: memory-mapped for .npy / .tif outputs, in memory otherwise. """
+    if output is None:
+        return np.empty(shape, dtype=np.uint8)
+    extension = os.path.splitext(output)[1].lower()
+    if extension == '.npy':
+        return np.lib.format.open_memmap(output, mode='w+', dtype=np.uint8, shape=shape)
+    if extension in ('.tif', '.tiff'):
+        import tifffile
+        return tifffile.memmap(output, shape=shape, dtype=np.uint8)
+    return np.empty(shape, dtype=np.uint8)
+
+
+def equalize_lut(histogram):
+    """ The lookup table cv2.equalizeHist builds from a 256-bin histogram. """
+    lut = np.zeros(256, dtype=np.uint8)
+    nonzero = np.flatnonzero(histogram)
+    if len(nonzero) == 0:
+        return lut
+    first = nonzero[0]
+    total = histogram.sum()
+    if histogram[first] == total:
+        lut[:] = first
+        return lut
+    scale = 255.0 / (total - histogram[first])
+    cumulative = np.cumsum(histogram[first + 1:])
+    lut[first + 1:] = np.clip(np.round(cumulative * scale), 0, 255).astype(np.uint8)
+    return lut
+
+
+class TiledEngine():
+    def __init__(self, source, halo, tile_size):
+        self.source = source
+        self.height, self.width = source.shape[:2]
+        self.halo = halo
+        self.tile_size = tile_size
+
+    def tiles(self):
+        """ (y0, y1, x0, x1) of the output regions, row by row. """
+        for y0 in range(0, self.height, self.tile_size):
+            for x0 in range(0, self.width, self.tile_size):
+                yield (y0, min(y0 + self.tile_size, self.height),
+                       x0, min(x0 + self.tile_size, self.width))
+
+    def window(self, tile):
+        """ The tile grown by the halo and clipped to the image, where the filters see the real border. """
+        y0, y1, x0, x1 = tile
+        return (max(y0 - self.halo, 0), min(y1 + self.halo, self.height),
+                max(x0 - self.halo, 0), min(x1 + self.halo, self.width))
+
+    def read(self, tile):
+        wy0, wy1, wx0, wx1 = self.window(tile)
+        return np.ascontiguousarray(self.source[wy0:wy1, wx0:wx1])
+
+    def read_tiles(self):
+        for tile in self.tiles():
+            yield tile, self.read(tile)
+
+    def crop(self, response, tile):
+        y0, y1, x0, x1 = tile
+        wy0, _, wx0, _ = self.window(tile)
+        return response[..., y0 - wy0:y1 - wy0, x0 - wx0:x1 - wx0]
+
+
+def tile_size_for(budget, bytes_per_pixel, halo, workers=1):
+    """ Largest square tile whose padded window fits workers times in the budget. """
+    side = int(math.sqrt(budget / workers / bytes_per_pixel)) - 2 * halo
+    return max(side, MIN_TILE)
+
+
+def run_tiled(source, name, settings, output=None, memory_budget=DEFAULT_MEMORY_BUDGET,
+              tile_size=None, workers=None, scratch_dir=None):
+    """ Applies the registry filter name to source tile by tile and returns the uint8 result
+        (a memmap when output is a .npy or .tif path, the file is written otherwise).
+        The tiles run on workers threads, by default the ones configured for the filter
+        (threads.filter_workers). """
+    key = filter_key(name)
+    if key not in TILED_FILTERS:
+        raise KeyError(f"The filter '{name}' has no tiled implementation")
+    spec = TILED_FILTERS[key]
+    workers = workers or filter_workers(key)
+
+    source = open_source(source)
+    height, width = source.shape[:2]
+    halo = spec.halo(settings)
+    channels = source.shape[2] if source.ndim == 3 else 1
+    tile_size = tile_size or tile_size_for(memory_budget, spec.bytes_per_pixel + channels * source.itemsize,
+                                           halo, workers)
+    engine = TiledEngine(source, halo, tile_size)
+    context = spec.prepare(engine, settings) if spec.prepare else None
+
+    # Raw responses, spilled to disk when they would take more than half of the budget
+    scratch_shape = (spec.scales, height, width) if spec.scales > 1 else (height, width)
+    scratch_bytes = 4 * spec.scales * height * width
+    scratch_file = None
+    if scratch_bytes > memory_budget // 2:
+        scratch_file = tempfile.NamedTemporaryFile(dir=scratch_dir, suffix='.scratch', delete=False)
+        scratch = np.memmap(scratch_file, dtype=np.float32, mode='w+', shape=scratch_shape)
+    else:
+        scratch = np.empty(scratch_shape, dtype=np.float32)
+
+    def process(tile):
+        y0, y1, x0, x1 = tile
+        response = engine.crop(spec.response(to_grayscale(engine.read(tile)), settings, context), tile)
+        scratch[..., y0:y1, x0:x1] = response
+        axes = (-2, -1)
+        return np.min(response, axis=axes), np.max(response, axis=axes)
+
+    try:
+        if workers > 1:
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                stats = list(executor.map(process, engine.tiles()))
+        else:
+            stats = [process(tile) for tile in engine.tiles()]
+        low = np.min([x[0] for x in stats], axis=0)
+        high = np.max([x[1] for x in stats], axis=0)
+
+        result = open_output(output, (height, width))
+        _finish(spec, scratch, result, low, high, tile_size)
+        if isinstance(result, np.memmap):
+            result.flush()
+        elif output is not None:
+            cv2.imwrite(output, result)
+        return result
+    finally:
+        if scratch_file is not None:
+            del scratch
+            scratch_file.close()
+            os.remove(scratch_file.name)
+
+
+def _finish(spec, scratch, result, low, high, rows):
+    """ Streams the scratch in bands of rows and writes the normalized uint8 result. """
+    height = result.shape[0]
+    bands = [(y, min(y + rows, height)) for y in range(0, height, rows)]
+
+    # Meijering: the per-scale maxima, low and high become those of the combined response
+    maxima = np.where(high > 0, high, 1)[:, None, None] if spec.scales > 1 else None
+
+    def combined(y0, y1):
+        band = np.asarray(scratch[..., y0:y1, :], dtype=np.float64)
+        if maxima is not None:
+            # Every scale divided by its global maximum, then the max over scales
+            band = np.max(band / maxima, axis=0)
+        return band
+
+    match spec.finish:
+        case 'edges':
+            for y0, y1 in bands:
+                result[y0:y1] = (combined(y0, y1) > 0).astype(np.uint8) * 255
+
+        case 'minmax':
+            # cv2.normalize(NORM_MINMAX, CV_8U)
+            scale = 255.0 / (high - low) if high > low else 0.0
+            for y0, y1 in bands:
+                result[y0:y1] = np.clip(np.round((combined(y0, y1) - low) * scale), 0, 255).astype(np.uint8)
+
+        case 'ridge':
+            # ridge_to_uint8: stretch to [0, 255], truncate, then equalize with the global histogram
+            if spec.scales > 1:
+                low = min(np.min(combined(y0, y1)) for y0, y1 in bands)
+                high = max(np.max(combined(y0, y1)) for y0, y1 in bands)
+            span = high - low if high > low else 1.0
+            histogram = np.zeros(256, dtype=np.int64)
+            for y0, y1 in bands:
+                band = ((combined(y0, y1) - low) / span * 255).astype(np.uint8)
+                result[y0:y1] = band
+                histogram += np.bincount(band.ravel(), minlength=256)
+            lut = equalize_lut(histogram)
+            for y0, y1 in bands:
+                result[y0:y1] = lut[result[y0:y1]]
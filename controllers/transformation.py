@@ -1,250 +1,198 @@
+import math
 import cv2
 import matplotlib.pyplot as plt
 import numpy as np
-from scipy.ndimage import gaussian_filter
-from skimage.filters import hessian, sato, meijering, prewitt, farid
+from scipy import ndimage as ndi
 from skimage.feature import canny
 from skimage import filters
-
-def hessian_filter(image, black_ridges=False, sigmas=10):
-    image = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
-    hessian_result = hessian(
-        image, sigmas=(1, sigmas), black_ridges=black_ridges)
-
-    # Image normalization
-    hessian_result = hessian_result - np.min(hessian_result)
-    hessian_result = hessian_result / np.max(hessian_result)
-    hessian_result = (hessian_result * 255).astype(np.uint8)
-    hessian_result = cv2.equalizeHist(hessian_result)
-    
-    return hessian_result
-
-def sobel_filter(image, kernel_size=3, direction="combined"):
-    image = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
-    convolved = None
-    match direction:
-        case "combined":
-            sobel_x = cv2.Sobel(image, cv2.CV_64F, 1, 0, ksize=kernel_size)
-            sobel_y = cv2.Sobel(image, cv2.CV_64F, 0, 1, ksize=kernel_size)
-
-            gradient_magnitude = np.sqrt(sobel_x**2 + sobel_y**2)
-            gradient_magnitude = cv2.normalize(
-                gradient_magnitude, None, 0, 255, cv2.NORM_MINMAX, cv2.CV_8U
-            )
-            convolved = gradient_magnitude
-
-        case "vertical":
-            sobel_x = cv2.Sobel(image, cv2.CV_64F, 1, 0, ksize=kernel_size)
-            sobel_x = cv2.normalize(sobel_x, None, 0, 255, cv2.NORM_MINMAX, cv2.CV_8U)
-            convolved = sobel_x
-
-        case "horizontal":
-            sobel_y = cv2.Sobel(image, cv2.CV_64F, 0, 1, ksize=kernel_size)
-            sobel_y = cv2.normalize(sobel_y, None, 0, 255, cv2.NORM_MINMAX, cv2.CV_8U)
-            convolved = sobel_y
-
-    filtered_image = convolved
-    return filtered_image
-
-def scharr_filter(image, direction="combined"):
-    image = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
-    convolved = None
-    match direction:
-        case "combined":
-            sobel_x = cv2.Scharr(image, cv2.CV_64F, 1, 0)
-            sobel_y = cv2.Scharr(image, cv2.CV_64F, 0, 1)
-
-            gradient_magnitude = np.sqrt(sobel_x**2 + sobel_y**2)
-            gradient_magnitude = cv2.normalize(
-                gradient_magnitude, None, 0, 255, cv2.NORM_MINMAX, cv2.CV_8U
-            )
-            convolved = gradient_magnitude
-
-        case "vertical":
-            sobel_x = cv2.Scharr(image, cv2.CV_64F, 1, 0)
-            sobel_x = cv2.normalize(sobel_x, None, 0, 255, cv2.NORM_MINMAX, cv2.CV_8U)
-            convolved = sobel_x
-
-        case "horizontal":
-            sobel_y = cv2.Scharr(image, cv2.CV_64F, 0, 1)
-            sobel_y = cv2.normalize(sobel_y, None, 0, 255, cv2.NORM_MINMAX, cv2.CV_8U)
-            convolved = sobel_y
-
-    filtered_image = convolved
-    return filtered_image
+from skimage.util import img_as_float32
+from .gradient import gradient_response
+from .precision import DEFAULT_PRECISION, as_float
+from .profiling import stage
+from .scale_space import frangi_response, sato_response, meijering_response, select_scale
+
+# BGR weights of cv2.COLOR_BGR2GRAY, for the types cvtColor does not take
+GRAY_WEIGHTS = np.array([0.114, 0.587, 0.299])
+
+def to_grayscale(image):
+    """ Single-channel image of the same type: grayscale images are used as they are,
+        BGR(A) images are converted at their native depth (no cast to 8 bits). """
+    if image.ndim == 2:
+        return image
+    if image.shape[2] == 1:
+        return image[..., 0]
+    with stage('grayscale'):
+        if image.dtype in (np.uint8, np.uint16, np.float32):
+            code = cv2.COLOR_BGRA2GRAY if image.shape[2] == 4 else cv2.COLOR_BGR2GRAY
+            return cv2.cvtColor(np.ascontiguousarray(image), code)
+        # float64 and the other types keep their precision
+        return image[..., :3] @ GRAY_WEIGHTS
+
+def normalize_to_uint8(response):
+    with stage('normalize'):
+        return cv2.normalize(response, None, 0, 255, cv2.NORM_MINMAX, cv2.CV_8U)
+
+def ridge_to_uint8(response):
+    # Image normalization, one temporary in the precision of the response
+    with stage('normalize'):
+        scaled = np.subtract(response, np.min(response))
+        scaled /= np.max(scaled)
+        scaled *= 255
+        response = scaled.astype(np.uint8)
+    with stage('equalize'):
+        return cv2.equalizeHist(response)
+
+def skimage_input(image, precision=DEFAULT_PRECISION):
+    # skimage filters compute in the float type of their input and turn integer images into float64
+    if precision == 'float64':
+        return image
+    return img_as_float32(image)
+
+def hessian_filter(image, black_ridges=False, sigmas=10, min_sigma=1, precision=DEFAULT_PRECISION):
+    image = to_grayscale(image)
+    hessian_result = frangi_response(
+        image, sigmas=(min_sigma, sigmas), black_ridges=black_ridges, precision=precision)
+
+    return ridge_to_uint8(hessian_result)
+
+def gradient_filter(image, family, kernel_size=3, direction="combined", precision=DEFAULT_PRECISION):
+    image = to_grayscale(image)
+    return normalize_to_uint8(gradient_response(image, family, kernel_size, direction, precision))
+
+def sobel_response(image, kernel_size=3, direction="combined", precision=DEFAULT_PRECISION):
+    return gradient_response(image, 'sobel', kernel_size, direction, precision)
+
+def sobel_filter(image, kernel_size=3, direction="combined", precision=DEFAULT_PRECISION):
+    return gradient_filter(image, 'sobel', kernel_size, direction, precision)
+
+def scharr_response(image, direction="combined", precision=DEFAULT_PRECISION):
+    return gradient_response(image, 'scharr', direction=direction, precision=precision)
+
+def scharr_filter(image, direction="combined", precision=DEFAULT_PRECISION):
+    return gradient_filter(image, 'scharr', direction=direction, precision=precision)
 
 def cv_ridge_filter(image, settings):
     cv_filter = cv2.ximgproc.RidgeDetectionFilter_create()  # here are the parameters
     ridges = cv_filter.getRidgeFilteredImage(image)
     return ridges
 
-def canny_edge_detection(image, threshold1, threshold2, sigma=3):
-    # If the image is already in grayscale, skip this step
-    if image.ndim == 3:
-        image = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
-        
-    edges = canny(image, sigma=sigma, 
-                  low_threshold=threshold1, 
-                  high_threshold=threshold2, 
-                  use_quantiles=True)
+def canny_response(image, threshold1, threshold2, sigma=3, precision=DEFAULT_PRECISION):
+    return canny(skimage_input(image, precision), sigma=sigma, 
+                 low_threshold=threshold1, 
+                 high_threshold=threshold2, 
+                 use_quantiles=True)
+
+def canny_maxima(image, sigma=3, precision=DEFAULT_PRECISION):
+    """ The part of canny_response that does not depend on the thresholds: the gradient
+        magnitude of the smoothed image and the mask of its local maxima, computed the way
+        skimage.feature.canny does. Several threshold pairs are then cheap (canny_hysteresis). """
+    image = skimage_input(image, precision)
+    with stage('canny'):
+        # With zero thresholds every local maximum is an edge
+        maxima = canny(image, sigma=sigma, low_threshold=0, high_threshold=0)
+    with stage('gradient'):
+        smoothed = filters.gaussian(image, sigma, mode='constant', cval=0, preserve_range=False)
+        # Compensation for the zeros outside the image, as in skimage
+        bleed_over = filters.gaussian(np.ones(image.shape, smoothed.dtype), sigma, mode='constant', cval=0,
+                                      preserve_range=False)
+        smoothed /= bleed_over + np.finfo(smoothed.dtype).eps
+        jsobel = ndi.sobel(smoothed, axis=1)
+        isobel = ndi.sobel(smoothed, axis=0)
+        magnitude = isobel * isobel
+        magnitude += jsobel * jsobel
+        np.sqrt(magnitude, out=magnitude)
+    return magnitude, maxima
+
+def canny_hysteresis(magnitude, maxima, threshold1, threshold2):
+    """ canny_response from canny_maxima: the thresholds are quantiles of the magnitude,
+        8-connected runs of weak edges are kept when they contain a strong one. """
+    with stage('hysteresis'):
+        low, high = np.percentile(magnitude, [100.0 * threshold1, 100.0 * threshold2])
+        low_mask = maxima & (magnitude >= low)
+        labels, count = ndi.label(low_mask, np.ones((3, 3), bool))
+        if count == 0:
+            return low_mask
+        high_mask = maxima & (magnitude >= high)
+        good_label = np.zeros(count + 1, bool)
+        good_label[1:] = ndi.sum(high_mask, labels, np.arange(1, count + 1)) > 0
+        return good_label[labels]
+
+def canny_edge_detection(image, threshold1, threshold2, sigma=3, precision=DEFAULT_PRECISION):
+    image = to_grayscale(image)
+    
+    edges = canny_response(image, threshold1, threshold2, sigma, precision)
     edges = edges.astype(np.uint8)
     edges *= 255
     return edges
 
-def sato_filter(image, black_ridges=False, sigmas=10):
-    image = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
-    sato_result = sato(
-        image, sigmas=(1, sigmas), black_ridges=black_ridges)
+def gaussian_response(image, sigma=1, precision=DEFAULT_PRECISION):
+    with stage('gaussian'):
+        return cv2.GaussianBlur(as_float(image, precision), (0, 0), sigma)
 
-    # Image normalization
-    sato_result = sato_result - np.min(sato_result)
-    sato_result = sato_result / np.max(sato_result)
-    sato_result = (sato_result * 255).astype(np.uint8)
-    sato_result = cv2.equalizeHist(sato_result)
-    
-    return sato_result
-
-def meijering_filter(image, black_ridges=False, sigmas=10):
-    image = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
-    meijering_result = meijering(
-        image, sigmas=(1, sigmas), black_ridges=black_ridges)
-
-    # Image normalization
-    meijering_result = meijering_result - np.min(meijering_result)
-    meijering_result = meijering_result / np.max(meijering_result)
-    meijering_result = (meijering_result * 255).astype(np.uint8)
-    meijering_result = cv2.equalizeHist(meijering_result)
-    
-    return meijering_result
-
-def prewitt_filter(image, direction='combined'):
-    image = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
-    convolved = None
-    match direction:
-        case "combined":
-            filtered = prewitt(image)
-            gradient_magnitude = cv2.normalize(
-                filtered, None, 0, 255, cv2.NORM_MINMAX, cv2.CV_8U
-            )
-            convolved = gradient_magnitude
-
-        case "vertical":
-            filtered = prewitt(image, axis=1)
-            gradient_magnitude = cv2.normalize(
-                filtered, None, 0, 255, cv2.NORM_MINMAX, cv2.CV_8U
-            )
-            convolved = gradient_magnitude
-
-        case "horizontal":
-            filtered = prewitt(image, axis=0)
-            gradient_magnitude = cv2.normalize(
-                filtered, None, 0, 255, cv2.NORM_MINMAX, cv2.CV_8U
-            )
-            convolved = gradient_magnitude
-
-    filtered_image = convolved
-    return filtered_image
-
-def farid_filter(image, direction='combined'):
-    image = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
-    convolved = None
-    match direction:
-        case "combined":
-            filtered = farid(image)
-            gradient_magnitude = cv2.normalize(
-                filtered, None, 0, 255, cv2.NORM_MINMAX, cv2.CV_8U
-            )
-            convolved = gradient_magnitude
-
-        case "vertical":
-            filtered = farid(image, axis=1)
-            gradient_magnitude = cv2.normalize(
-                filtered, None, 0, 255, cv2.NORM_MINMAX, cv2.CV_8U
-            )
-            convolved = gradient_magnitude
-
-        case "horizontal":
-            filtered = farid(image, axis=0)
-            gradient_magnitude = cv2.normalize(
-                filtered, None, 0, 255, cv2.NORM_MINMAX, cv2.CV_8U
-            )
-            convolved = gradient_magnitude
-
-    filtered_image = convolved
-    return filtered_image
-
-if __name__ == '__main__':
-    image = cv2.imread('img/messi.jpg', cv2.IMREAD_GRAYSCALE)
-    # image1 = canny(image, 3, 0.2, 0.85, use_quantiles=True) # good choice
-    
-    image1 = canny_edge_detection(image, 0.6, 0.9, 1)
-    image2 = canny_edge_detection(image, 0.7, 0.9, 1)
-    image3 = canny_edge_detection(image, 0.82, 0.9, 1)
-    
-    fig, axes = plt.subplots(2, 2, figsize=(8,8))
-    
-    axes[0,0].imshow(image, cmap='gray')
-    axes[0,1].imshow(image1, cmap='gray')
-    axes[1,0].imshow(image2, cmap='gray')
-    axes[1,1].imshow(image3, cmap='gray')
-    
-    plt.tight_layout()
-    plt.savefig('./transform_testing/canny_test.png', dpi=300)
-    plt.show()
-    
-def display_images_in_grid(images, titles, grid_shape=(2, 2)):
-    fig, axes = plt.subplots(grid_shape[0], grid_shape[1], figsize=(8, 8))
+def sato_filter(image, black_ridges=False, sigmas=10, min_sigma=1, precision=DEFAULT_PRECISION):
+    image = to_grayscale(image)
+    sato_result = sato_response(
+        image, sigmas=(min_sigma, sigmas), black_ridges=black_ridges, precision=precision)
 
-    for i, (img, title) in enumerate(zip(images, titles)):
-        ax = axes[i // grid_shape[1], i % grid_shape[1]]
-        ax.imshow(img, cmap="gray", interpolation="nearest")
-        ax.set_title(title)
-        ax.axis("off")
+    return ridge_to_uint8(sato_result)
+
+def meijering_filter(image, black_ridges=False, sigmas=10, min_sigma=1, precision=DEFAULT_PRECISION):
+    image = to_grayscale(image)
+    meijering_result = meijering_response(
+        image, sigmas=(min_sigma, sigmas), black_ridges=black_ridges, precision=precision)
+
+    return ridge_to_uint8(meijering_result)
+
+def prewitt_response(image, direction='combined', precision=DEFAULT_PRECISION):
+    return gradient_response(image, 'prewitt', direction=direction, precision=precision)
+
+def prewitt_filter(image, direction='combined', precision=DEFAULT_PRECISION):
+    return gradient_filter(image, 'prewitt', direction=direction, precision=precision)
 
-    plt.tight_layout()
-    plt.savefig("./transform_testing/hessian_test3.png", dpi=300)
-    plt.show()
-
-def hessian_scale_space(image, sigmas): 
-    max_output = float("-inf")
-    max_sigma = None
-    max_hessian = None
-
-    for sigma in sigmas:
-        # Apply Gaussian filter to the image with the current sigma
-        smoothed_image = gaussian_filter(image, sigma=sigma)
-
-        # Compute second derivatives
-        f_xx = np.gradient(np.gradient(smoothed_image, axis=0), axis=0)
-        f_yy = np.gradient(np.gradient(smoothed_image, axis=1), axis=1)
-        f_xy = np.gradient(np.gradient(smoothed_image, axis=0), axis=1)
-
-        # Initialize Hessian matrix for each pixel
-        hessian = np.empty((image.shape[0], image.shape[1], 2, 2))
-
-        # Fill the Hessian matrix
-        hessian[..., 0, 0] = f_xx
-        hessian[..., 0, 1] = f_xy
-        hessian[..., 1, 0] = f_xy
-        hessian[..., 1, 1] = f_yy
-
-        # Compute eigenvalues of the Hessian
-        eigenvalues = np.linalg.eigvalsh(hessian)
-
-        # Get the maximum eigenvalue
-        i1 = eigenvalues[..., 0]
-        max_i1 = np.max(i1)
-
-        # Check if the current output is greater than the maximum output so far
-        if max_i1 > max_output:
-            max_output = max_i1
-            max_sigma = sigma
-            max_hessian = hessian
-
-    # Show the filtered image with the maximum sigma
-    plt.imshow(gaussian_filter(image, sigma=max_sigma), cmap="gray")
-    plt.title(f"Filtered Image (Sigma = {max_sigma})")
-    plt.axis("off")
-    plt.show()
-
-    return max_output, max_hessian
\ No newline at end of file
+def farid_response(image, direction='combined', precision=DEFAULT_PRECISION):
+    return gradient_response(image, 'farid', direction=direction, precision=precision)
+
+def farid_filter(image, direction='combined', precision=DEFAULT_PRECISION):
+    return gradient_filter(image, 'farid', direction=direction, precision=precision)
+
+def display_images_in_grid(images, titles, grid_shape=None, path=None, dpi=300):
+    """ The images side by side in a grid of (rows, columns), square by default. Saved to
+        path when one is given, otherwise shown in a window. Returns the figure. """
+    if grid_shape is None:
+        columns = math.ceil(math.sqrt(len(images)))
+        grid_shape = (math.ceil(len(images) / columns), columns)
+    rows, columns = grid_shape
+    fig, axes = plt.subplots(rows, columns, figsize=(4 * columns, 4 * rows), squeeze=False)
+
+    for ax in axes.flat:
+        ax.axis("off")
+    for ax, img, title in zip(axes.flat, images, titles):
+        ax.imshow(img, cmap="gray", interpolation="nearest")
+        ax.set_title(title, fontsize=8)
+
+    fig.tight_layout()
+    if path is None:
+        plt.show()
+    else:
+        fig.savefig(path, dpi=dpi)
+        plt.close(fig)
+    return fig
+
+def hessian_scale_space(image, sigmas, normalized=True, precision=DEFAULT_PRECISION):
+    """ Best scale of the image: the sigma at which the smallest Hessian eigenvalue reaches
+        its largest maximum (see scale_space.select_scale), with sigma^2-normalized
+        derivatives unless normalized is False. """
+    return select_scale(to_grayscale(image), sigmas, normalized, precision)
+
+def scale_space_response(image, black_ridges=False, sigmas=10, min_sigma=1, precision=DEFAULT_PRECISION):
+    """ Ridge strength at the automatically selected scale among min_sigma..sigmas. """
+    # Unit steps; the previews pass fractional sigmas, scaled with the image
+    scales = np.arange(min_sigma, max(min_sigma, sigmas) + 1e-6, 1.0)
+    selection = hessian_scale_space(image, scales, precision=precision)
+    lambda1, lambda2 = selection.eigenvalues
+    # Bright ridges curve down across the ridge (strongly negative lambda2), dark ones up
+    return np.maximum(lambda1, 0) if black_ridges else np.maximum(-lambda2, 0)
+
+def scale_space_filter(image, black_ridges=False, sigmas=10, min_sigma=1, precision=DEFAULT_PRECISION):
+    image = to_grayscale(image)
+    return ridge_to_uint8(scale_space_response(image, black_ridges, sigmas, min_sigma, precision))
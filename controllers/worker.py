@@ -0,0 +1,180 @@
+from PyQt5.QtCore import QObject, QRunnable, QThreadPool, QTimer, pyqtSignal, pyqtSlot
+import itertools
+import traceback
+
+""" Background execution of the functions from controllers/transformation.py.
+    Every job is tagged with a key (usually the ImageViewer that asked for it).
+    Submitting a new job for a key supersedes the previous one: a job still waiting
+    in the pool is taken out of it, a job that is already running is flagged and its
+    result is dropped when it arrives (Python code cannot be interrupted mid-call). """
+
+
+class WorkerSignals(QObject):
+    finished = pyqtSignal(int, object)
+    error = pyqtSignal(int, str)
+    cancelled = pyqtSignal(int)
+
+
+class FilterWorker(QRunnable):
+    def __init__(self, job_id, func, image, settings):
+        super().__init__()
+        self.job_id = job_id
+        self.func = func
+        self.image = image
+        self.settings = settings
+        self.cancelled = False
+        self.signals = WorkerSignals()
+
+    def cancel(self):
+        self.cancelled = True
+
+    @pyqtSlot()
+    def run(self):
+        # Every run ends with exactly one signal, the executor forgets the job on it
+        if self.cancelled:
+            self.signals.cancelled.emit(self.job_id)
+            return
+        try:
+            result = self.func(self.image, **self.settings)
+        except Exception:
+            self.signals.error.emit(self.job_id, traceback.format_exc())
+            return
+        if self.cancelled:
+            self.signals.cancelled.emit(self.job_id)
+        else:
+            self.signals.finished.emit(self.job_id, result)
+
+
+class FilterExecutor(QObject):
+    resultReady = pyqtSignal(object, object) # key, filtered image
+    jobFailed = pyqtSignal(object, str)      # key, traceback
+    busyChanged = pyqtSignal(bool)
+
+    def __init__(self, max_workers=None):
+        super().__init__()
+        self._pool = QThreadPool()
+        if max_workers:
+            self._pool.setMaxThreadCount(max_workers)
+
+        self._ids = itertools.count(1)
+        self._jobs = {}    # job_id -> (key, worker)
+        self._latest = {}  # key -> job_id of the only job whose result is still wanted
+        self._busy = False
+
+    def submit(self, key, func, image, settings, priority=0):
+        """ Run func(image, **settings) in the pool, superseding any pending job for key. """
+        self._drop(key)
+
+        job_id = next(self._ids)
+        worker = FilterWorker(job_id, func, image, dict(settings))
+        worker.signals.finished.connect(self._on_finished)
+        worker.signals.error.connect(self._on_error)
+        worker.signals.cancelled.connect(self._on_cancelled)
+
+        self._jobs[job_id] = (key, worker)
+        self._latest[key] = job_id
+        self._pool.start(worker, priority)
+        self._update_busy()
+        return job_id
+
+    def cancel(self, key):
+        self._drop(key)
+        self._update_busy()
+
+    def cancelAll(self):
+        for key in list(self._latest):
+            self.cancel(key)
+
+    def isBusy(self):
+        return bool(self._latest)
+
+    def waitForDone(self, msecs=-1):
+        return self._pool.waitForDone(msecs)
+
+    def _drop(self, key):
+        job_id = self._latest.pop(key, None)
+        if job_id is None:
+            return
+        _, worker = self._jobs[job_id]
+        worker.cancel()
+        # A job which has not started yet can be removed from the queue right away,
+        # a running one is forgotten when it ends (_on_cancelled, or its result or error)
+        if self._pool.tryTake(worker):
+            self._jobs.pop(job_id)
+
+    def _update_busy(self):
+        if self._busy != self.isBusy():
+            self._busy = self.isBusy()
+            self.busyChanged.emit(self._busy)
+
+    def _finish_job(self, job_id):
+        key, _ = self._jobs.pop(job_id, (None, None))
+        wanted = key is not None and self._latest.get(key) == job_id
+        if wanted:
+            del self._latest[key]
+            self._update_busy()
+        return key, wanted
+
+    @pyqtSlot(int, object)
+    def _on_finished(self, job_id, result):
+        key, wanted = self._finish_job(job_id)
+        if wanted:
+            self.resultReady.emit(key, result)
+
+    @pyqtSlot(int, str)
+    def _on_error(self, job_id, message):
+        key, wanted = self._finish_job(job_id)
+        if wanted:
+            self.jobFailed.emit(key, message)
+
+    @pyqtSlot(int)
+    def _on_cancelled(self, job_id):
+        self._jobs.pop(job_id, None)
+
+
+class CoalescingScheduler(QObject):
+    """ Feeds a FilterExecutor with bursts of requests (e.g. a slider being dragged).
+        Requests are debounced for a few milliseconds, at most one job per key is in flight
+        and everything requested meanwhile collapses into the latest request, which starts
+        as soon as the running job delivers. """
+
+    def __init__(self, executor, debounce_ms=15):
+        super().__init__()
+        self._executor = executor
+        self._pending = {}     # key -> (func, image, settings)
+        self._in_flight = set()
+
+        self._timer = QTimer(self)
+        self._timer.setSingleShot(True)
+        self._timer.setInterval(debounce_ms)
+        self._timer.timeout.connect(self._dispatch)
+
+        executor.resultReady.connect(self._on_done)
+        executor.jobFailed.connect(self._on_failed)
+
+    def request(self, key, func, image, settings):
+        self._pending[key] = (func, image, settings)
+        self._timer.start()
+
+    def cancel(self, key):
+        self._pending.pop(key, None)
+        if key in self._in_flight:
+            self._in_flight.discard(key)
+            self._executor.cancel(key)
+
+    def _dispatch(self):
+        for key in [x for x in self._pending if x not in self._in_flight]:
+            func, image, settings = self._pending.pop(key)
+            self._in_flight.add(key)
+            self._executor.submit(key, func, image, settings, priority=2)
+
+    @pyqtSlot(object, object)
+    def _on_done(self, key, _):
+        if key in self._in_flight:
+            self._in_flight.discard(key)
+            if key in self._pending:
+                self._dispatch()
+
+    @pyqtSlot(object, str)
+    def _on_failed(self, key, message):
+        self._on_done(key, message)
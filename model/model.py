@@ -1,5 +1,5 @@
 from PyQt5.QtCore import QObject, pyqtSignal
-from PyQt5 import QtWidgets
+from PyQt5 import QtWidgets, QtGui
 
 # Contains signals
 # Contains data 
@@ -9,14 +9,24 @@ from PyQt5 import QtWidgets
 class Model(QObject):
     directory_changed = pyqtSignal(str)
     tree_items_changed = pyqtSignal(list)
+    tree_items_added = pyqtSignal(list)
+    thumbnail_ready = pyqtSignal(str, QtGui.QImage)
     
     add_new_tab = pyqtSignal(int)
     tabs_count_changed = pyqtSignal(int)
     current_path_changed = pyqtSignal(str)
+    image_decoded = pyqtSignal(str, object)
+    image_decode_failed = pyqtSignal(str, str)
 
     current_menu_changed = pyqtSignal(QtWidgets.QWidget)
     current_apply_button_changed = pyqtSignal()
     settings_changed = pyqtSignal(dict)
+    preview_settings_changed = pyqtSignal(dict)
+    pipeline_changed = pyqtSignal(list)
+    pipeline_applied = pyqtSignal(object)
+    comparison_requested = pyqtSignal(list, bool)
+    stream_requested = pyqtSignal(object, object, dict, object)
+    camera_requested = pyqtSignal(str, object, dict)
 
     def __init__(self):
         super().__init__()
@@ -35,6 +45,8 @@ class Model(QObject):
         self._current_apply_button = None    
         self._current_transformation = None
         self._current_settings = None
+        self._preview_settings = None
+        self._pipeline_steps = []
 
     @property
     def directory(self):
@@ -53,6 +65,13 @@ class Model(QObject):
     def tree_items(self, value):
         self._tree_items = value
         self.tree_items_changed.emit(value)
+    
+    def add_tree_items(self, items):
+        self._tree_items.extend(items)
+        self.tree_items_added.emit(items)
+    
+    def set_thumbnail(self, path, image):
+        self.thumbnail_ready.emit(path, image)
         
     @property
     def current_image_tab_index(self):
@@ -88,6 +107,13 @@ class Model(QObject):
         self._current_image_path = value
         self.current_path_changed.emit(value)
         
+    def set_decoded_image(self, path, image):
+        self._current_image = image
+        self.image_decoded.emit(path, image)
+    
+    def set_decode_failed(self, path, message):
+        self.image_decode_failed.emit(path, message)
+        
     @property
     def current_menu(self):
         return self._current_menu
@@ -121,4 +147,34 @@ class Model(QObject):
     @current_settings.setter
     def current_settings(self, value):
         self._current_settings = value
-        self.settings_changed.emit(value)
\ No newline at end of file
+        self.settings_changed.emit(value)
+        
+    @property
+    def preview_settings(self):
+        return self._preview_settings
+    
+    @preview_settings.setter
+    def preview_settings(self, value):
+        self._preview_settings = value
+        self.preview_settings_changed.emit(value)
+    
+    @property
+    def pipeline_steps(self):
+        return self._pipeline_steps
+    
+    @pipeline_steps.setter
+    def pipeline_steps(self, value):
+        self._pipeline_steps = value
+        self.pipeline_changed.emit(value)
+    
+    def apply_pipeline(self, pipeline):
+        self.pipeline_applied.emit(pipeline)
+    
+    def compare_filters(self, entries, sequential=False):
+        self.comparison_requested.emit(entries, sequential)
+    
+    def start_stream(self, source, func, settings, output=None):
+        self.stream_requested.emit(source, func, settings, output)
+    
+    def start_camera(self, device, func, settings):
+        self.camera_requested.emit(device, func, settings)
\ No newline at end of file
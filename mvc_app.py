@@ -2,12 +2,14 @@ import sys
 from PyQt5.QtWidgets import QApplication
 from model.model import Model
 from controllers.main_ctrl import MainController
+from controllers.threads import configure_from_environment
 from views.main_view import MainView
 import resources.resources
 
 class App(QApplication):
     def __init__(self, sys_argv):
         super(App, self).__init__(sys_argv)
+        configure_from_environment()
         self.model = Model()
         self.main_controller = MainController(self.model)
         self.main_view = MainView(self.model, self.main_controller)
@@ -2,37 +2,18 @@ from PyQt5.QtWidgets import QMainWindow
 from PyQt5.QtCore import pyqtSlot
 from views.main_view_ui import Ui_MainWindow
 from controllers.main_ctrl import DirectoryController, ImageController, EdgeDetectionController
+from controllers.worker import FilterExecutor, CoalescingScheduler
+from controllers.preview import make_preview, preview_factor, downscale, scale_settings
 from PyQt5 import QtWidgets, QtGui
 from views.widgets.image_viewer import ImageViewer
-import cv2
-import numpy as np
+from views.widgets.compare_dialog import CompareDialog
+from functools import partial
+from controllers.comparison import COMPARABLE_FILTERS, compare_filters
+from controllers.stream import FrameStream
+from controllers.camera import LiveCamera, LatencyStats
+import os
+import time
 
-def sobel_filter(image, kernel_size=3, direction="combined"):
-        image = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
-        convolved = None
-        match direction:
-            case "combined":
-                sobel_x = cv2.Sobel(image, cv2.CV_64F, 1, 0, ksize=kernel_size)
-                sobel_y = cv2.Sobel(image, cv2.CV_64F, 0, 1, ksize=kernel_size)
-
-                gradient_magnitude = np.sqrt(sobel_x**2 + sobel_y**2)
-                gradient_magnitude = cv2.normalize(
-                    gradient_magnitude, None, 0, 255, cv2.NORM_MINMAX, cv2.CV_8U
-                )
-                convolved = gradient_magnitude
-
-            case "vertical":
-                sobel_x = cv2.Sobel(image, cv2.CV_64F, 1, 0, ksize=kernel_size)
-                sobel_x = cv2.normalize(sobel_x, None, 0, 255, cv2.NORM_MINMAX, cv2.CV_8U)
-                convolved = sobel_x
-
-            case "horizontal":
-                sobel_y = cv2.Sobel(image, cv2.CV_64F, 0, 1, ksize=kernel_size)
-                sobel_y = cv2.normalize(sobel_y, None, 0, 255, cv2.NORM_MINMAX, cv2.CV_8U)
-                convolved = sobel_y
-
-        filtered_image = convolved
-        return filtered_image
 # How to use:
 # - connect widgets to controller
 # - listen for model event signals
@@ -47,7 +28,8 @@ MENU_BUTTONS = ['canny_button',
                 'farid_button', 
                 'hessian_button', 
                 'cvridgefilter_button',
-                'frangi_button']
+                'frangi_button',
+                'scale_space_button']
 
 class MainView(QMainWindow):
     def __init__(self, model, main_controller):
@@ -59,15 +41,28 @@ class MainView(QMainWindow):
         self._directory_controller = DirectoryController(self._model)
         self._image_controller = ImageController(self._model)
         self._edge_detection_controller = EdgeDetectionController(self._model)
+        self._filter_executor = FilterExecutor()
+        self._live_scheduler = CoalescingScheduler(self._filter_executor)
+        self._live_sources = {} # viewer -> (source image, factor, downscaled source)
+        self._stream = FrameStream()
+        self._stream_viewer = None
+        self._stream_frame = None
+        self._camera = LiveCamera()
+        self._camera_viewer = None
+        self._camera_frame = None
+        self._camera_stats = LatencyStats()
+        self._tree_items_by_path = {}
         
         # UIs
         self._ui = Ui_MainWindow()
         self._ui.setupUi(self)
+        self.setupScaleSpaceButton()
 
         # 1. Connect widgets to their controllers
         self._ui.open_dir_button.clicked.connect(self._directory_controller.change_directory)
         self._ui.image_viewer_tabs.tabBarClicked.connect(self._image_controller.on_tab_bar_clicked)
         self._ui.image_list.itemClicked.connect(self._directory_controller.on_item_clicked)
+        self._ui.image_list.currentItemChanged.connect(self._directory_controller.on_current_item_changed)
         for button_name in MENU_BUTTONS:
             button = getattr(self._ui, button_name)
             button.clicked.connect(lambda _, name=button_name: self._edge_detection_controller.on_button_clicked(name))
@@ -75,13 +70,60 @@ class MainView(QMainWindow):
         # 2. Listen to the model signals
         self._model.directory_changed.connect(self._directory_controller.populate_list)
         self._model.tree_items_changed.connect(self.on_tree_items_changed) 
+        self._model.tree_items_added.connect(self.on_tree_items_added)
+        self._model.thumbnail_ready.connect(self.on_thumbnail_ready)
         self._model.add_new_tab.connect(self.add_new_tab)
         self._model.current_path_changed.connect(self.on_current_path_changed)
+        self._model.image_decoded.connect(self.on_image_decoded)
+        self._model.image_decode_failed.connect(self.on_image_decode_failed)
         self._model.current_menu_changed.connect(self.on_current_menu_changed)
         self._model.settings_changed.connect(self.on_settings_changed)
+        self._model.preview_settings_changed.connect(self.on_preview_settings_changed)
+        self._model.pipeline_changed.connect(self.on_pipeline_changed)
+        self._model.pipeline_applied.connect(self.on_pipeline_applied)
+        self._model.comparison_requested.connect(self.on_comparison_requested)
+        self._model.stream_requested.connect(self.on_stream_requested)
+        self._model.camera_requested.connect(self.on_camera_requested)
+        
+        # 3. Listen to the background filter jobs
+        self._filter_executor.resultReady.connect(self.on_filter_finished)
+        self._filter_executor.jobFailed.connect(self.on_filter_failed)
+        self._filter_executor.busyChanged.connect(self.on_filter_busy_changed)
+        self._stream.frameReady.connect(self.on_stream_frame)
+        self._stream.statsChanged.connect(self.on_stream_stats)
+        self._stream.finished.connect(self.on_stream_finished)
+        self._stream.failed.connect(lambda message: self.on_filter_failed(None, message))
+        self._camera.frameAvailable.connect(self.on_camera_frame)
+        self._camera.failed.connect(lambda message: self.on_filter_failed(None, message))
         
+        self.setupPipelineMenu()
+        self.setupCompareAction()
+        self.setupStreamMenu()
         self.apply_default_settings()
 
+    def setupScaleSpaceButton(self):
+        # Not in the Designer file: ridges at the automatically selected Hessian scale
+        button = QtWidgets.QPushButton('Best scale', self._ui.tab)
+        button.setObjectName('scale_space_button')
+        self._ui.gridLayout_2.addWidget(button, 5, 0, 1, 1)
+        self._ui.scale_space_button = button
+
+    def setupPipelineMenu(self):
+        self._pipeline_menu = self._ui.menubar.addMenu('Pipeline')
+        self._pipeline_menu.aboutToShow.connect(self.on_pipeline_menu_shown)
+        self._pipeline_steps = []
+
+    def setupCompareAction(self):
+        self._ui.menubar.addAction('Compare filters...', self.on_compare_clicked)
+        self._compare_checked = []
+
+    def setupStreamMenu(self):
+        menu = self._ui.menubar.addMenu('Stream')
+        menu.addAction('Open video or sequence...', self.on_open_stream)
+        menu.addAction('Open and write filtered video...', lambda: self.on_open_stream(write=True))
+        menu.addAction('Live camera...', self.on_open_camera)
+        menu.addAction('Stop', self.on_stop_stream)
+
     def apply_default_settings(self):
         self._ui.image_viewer_tabs.removeTab(0)
         self.add_new_tab(0)
@@ -92,11 +134,233 @@ class MainView(QMainWindow):
     
     @pyqtSlot(dict)
     def on_settings_changed(self, settings):
+        if self._stream.isRunning() or self._camera.isRunning():
+            # The next frames use the applied filter, uncached like the rest of the stream
+            func = self._model.current_menu.TRANS_FUNC
+            func = getattr(func, '__wrapped__', func)
+            self._stream.setFilter(func, settings)
+            self._camera.setFilter(func, settings)
+            return
         current_viewer = self._ui.image_viewer_tabs.currentWidget().children()[1]
         current_image = current_viewer.image
+        if current_image is None:
+            return
         func = self._model.current_menu.TRANS_FUNC
-        transformed_image = func(current_image, **settings)
-        current_viewer.loadImage(transformed_image)
+        
+        # Progressive display: a result sized to the viewport first, then the full resolution
+        viewport = current_viewer.viewport().size()
+        preview = make_preview(current_image, settings, (viewport.width(), viewport.height()),
+                               current_viewer.transform().m11())
+        if preview is not None:
+            preview_image, preview_settings, _ = preview
+            self._filter_executor.submit((current_viewer, 'preview'), func, preview_image, preview_settings, priority=1)
+        else:
+            self._filter_executor.cancel((current_viewer, 'preview'))
+        self._live_scheduler.cancel((current_viewer, 'live'))
+        
+        # The filter runs in the background, a newer Apply on the same viewer supersedes it
+        self._filter_executor.submit(current_viewer, func, current_image, settings)
+    
+    @pyqtSlot(dict)
+    def on_preview_settings_changed(self, settings):
+        current_viewer = self._ui.image_viewer_tabs.currentWidget().children()[1]
+        current_image = current_viewer.image
+        if current_image is None:
+            return
+        
+        # The viewport-sized source is prepared once per image, not on every slider step
+        source = self._live_sources.get(current_viewer)
+        if source is None or source[0] is not current_image:
+            viewport = current_viewer.viewport().size()
+            factor = preview_factor(current_image.shape, (viewport.width(), viewport.height()),
+                                    current_viewer.transform().m11())
+            small = downscale(current_image, factor) if factor < 1 else current_image
+            source = (current_image, factor, small)
+            self._live_sources[current_viewer] = source
+        _, factor, small = source
+        
+        func = self._model.current_menu.TRANS_FUNC
+        self._live_scheduler.request((current_viewer, 'live'), func, small, scale_settings(settings, factor))
+    
+    @pyqtSlot(list)
+    def on_pipeline_changed(self, steps):
+        self._pipeline_steps = steps
+        self._ui.statusbar.showMessage(f'Pipeline: {len(steps)} steps', 3000)
+    
+    def on_pipeline_menu_shown(self):
+        # Rebuilt every time, it lists the current steps
+        menu = self._pipeline_menu
+        menu.clear()
+        for i, (name, settings) in enumerate(self._pipeline_steps):
+            values = ', '.join(f'{key}={value}' for key, value in settings.items())
+            menu.addAction(f'{i + 1}. {name}({values})').setEnabled(False)
+        if not self._pipeline_steps:
+            menu.addAction('Use "Add to pipeline" in a filter menu').setEnabled(False)
+        menu.addSeparator()
+        menu.addAction('Add Gaussian blur...', self.on_add_gaussian_step)
+        menu.addAction('Remove last step', self._edge_detection_controller.on_pipeline_step_removed)
+        menu.addAction('Clear', self._edge_detection_controller.on_pipeline_cleared)
+        menu.addSeparator()
+        apply_action = menu.addAction('Apply pipeline', self._edge_detection_controller.on_pipeline_applied)
+        apply_action.setEnabled(bool(self._pipeline_steps))
+    
+    def on_add_gaussian_step(self):
+        sigma, ok = QtWidgets.QInputDialog.getDouble(self, 'Gaussian blur', 'Sigma', 1.0, 0.1, 100.0, 1)
+        if ok:
+            self._edge_detection_controller.on_gaussian_step_added(sigma)
+    
+    @pyqtSlot(object)
+    def on_pipeline_applied(self, pipeline):
+        current_viewer = self._ui.image_viewer_tabs.currentWidget().children()[1]
+        if current_viewer.image is None:
+            return
+        self._filter_executor.cancel((current_viewer, 'preview'))
+        self._live_scheduler.cancel((current_viewer, 'live'))
+        self._filter_executor.submit(current_viewer, pipeline, current_viewer.image, {})
+    
+    def on_compare_clicked(self):
+        labels = {key: key[:-len('_button')].replace('_', ' ').capitalize() for key in COMPARABLE_FILTERS}
+        dialog = CompareDialog(labels, self._compare_checked, self)
+        if dialog.exec_() == QtWidgets.QDialog.Accepted:
+            self._compare_checked = dialog.selectedFilters()
+            self._edge_detection_controller.on_comparison_requested(self._compare_checked, dialog.sequential())
+    
+    @pyqtSlot(list, bool)
+    def on_comparison_requested(self, entries, sequential):
+        current_viewer = self._ui.image_viewer_tabs.currentWidget().children()[1]
+        if current_viewer.image is None:
+            return
+        func = partial(compare_filters, entries=entries, sequential=sequential)
+        self._filter_executor.submit((current_viewer, 'compare'), func, current_viewer.image, {})
+    
+    def show_comparison(self, report):
+        # One tab per result, inserted before the '+' tab
+        tabs = self._ui.image_viewer_tabs
+        for result in report.results:
+            index = tabs.count() - 1
+            self.add_new_tab(index)
+            tabs.widget(index).children()[1].loadImage(result.image)
+            tabs.setTabText(index, f"{result.key[:-len('_button')]} {result.seconds:.2f} s")
+        message = f'Compared {len(report.results)} filters in {report.wall_s:.2f} s (tasks {report.task_s:.2f} s'
+        if report.sequential_s is not None:
+            message += f', sequential {report.sequential_s:.2f} s'
+        self._ui.statusbar.showMessage(message + ')')
+    
+    def on_open_stream(self, write=False):
+        source, _ = QtWidgets.QFileDialog.getOpenFileName(
+            self, 'Open video or image sequence', '',
+            'Videos and image sequences (*.mp4 *.avi *.mov *.mkv *.png *.jpg *.jpeg *.bmp *.tif *.tiff);;All files (*)')
+        if not source:
+            return
+        output = ''
+        if write:
+            output, _ = QtWidgets.QFileDialog.getSaveFileName(self, 'Write filtered video', '', 'Video (*.mp4 *.avi)')
+            if not output:
+                return
+        self._edge_detection_controller.on_stream_requested(source, output)
+    
+    @pyqtSlot(object, object, dict, object)
+    def on_stream_requested(self, source, func, settings, output):
+        self.on_stop_stream()
+        self._stream_viewer = self._ui.image_viewer_tabs.currentWidget().children()[1]
+        self._stream_frame = None
+        try:
+            self._stream.start(source, func, settings, output)
+        except OSError as e:
+            self._ui.statusbar.showMessage(str(e), 5000)
+    
+    @pyqtSlot(object, int)
+    def on_stream_frame(self, frame, index):
+        self._stream_viewer.showFrame(frame)
+        self._stream_frame = frame
+        self._stream.frameShown()
+    
+    @pyqtSlot(object)
+    def on_stream_stats(self, stats):
+        self._ui.statusbar.showMessage(f'Streaming: {stats.fps:.1f} fps, {stats.dropped} frames dropped')
+    
+    @pyqtSlot(object)
+    def on_stream_finished(self, stats):
+        self._ui.statusbar.showMessage(f'Stream: {stats.processed} frames in {stats.seconds:.1f} s, '
+                                       f'{stats.fps:.1f} fps sustained, {stats.dropped} dropped')
+        # The last frame stays as a still image the filters can be applied to
+        if self._stream_frame is not None:
+            self._stream_viewer.loadImage(self._stream_frame)
+            self._stream_frame = None
+    
+    def on_open_camera(self):
+        device, ok = QtWidgets.QInputDialog.getText(
+            self, 'Live camera', 'Camera index, or a video file to play as a camera:', text='0')
+        if ok and device:
+            self._edge_detection_controller.on_camera_requested(device)
+    
+    @pyqtSlot(str, object, dict)
+    def on_camera_requested(self, device, func, settings):
+        self.on_stop_stream()
+        self._camera_viewer = self._ui.image_viewer_tabs.currentWidget().children()[1]
+        self._camera_frame = None
+        self._camera_stats = LatencyStats()
+        try:
+            self._camera.start(device, func, settings)
+        except OSError as e:
+            self._ui.statusbar.showMessage(str(e), 5000)
+    
+    @pyqtSlot()
+    def on_camera_frame(self):
+        frame = self._camera.takeFrame()
+        if frame is None or not self._camera.isRunning():
+            return
+        start = time.perf_counter()
+        self._camera_viewer.showFrame(frame.image, frame.display)
+        # Painted right away, so that the paint time belongs to this frame
+        self._camera_viewer.viewport().repaint()
+        shown = time.perf_counter()
+        frame.timings['paint'] = shown - start
+        self._camera_stats.record(frame, shown)
+        self._camera_viewer.setOverlayText(self._camera_stats.summary(self._camera.dropped()))
+        self._camera_frame = frame.image
+        self._camera.frameShown()
+    
+    def on_stop_stream(self):
+        self._stream.stop()
+        if self._camera.isRunning():
+            self._camera.stop()
+            self._camera_viewer.setOverlayText(None)
+            self._ui.statusbar.showMessage(self._camera_stats.summary(self._camera.dropped()).replace('\n', ' | '))
+            if self._camera_frame is not None:
+                self._camera_viewer.loadImage(self._camera_frame)
+                self._camera_frame = None
+    
+    def closeEvent(self, event):
+        self._stream.stop()
+        self._camera.stop()
+        super().closeEvent(event)
+    
+    @pyqtSlot(object, object)
+    def on_filter_finished(self, key, transformed_image):
+        if isinstance(key, tuple) and key[1] == 'compare':
+            self.show_comparison(transformed_image)
+            return
+        if isinstance(key, tuple): # downscaled preview or live preview
+            viewer = key[0]
+            if viewer.image is not None:
+                viewer.showPreview(transformed_image, transformed_image.shape[1] / viewer.image.shape[1])
+            return
+        # A preview arriving after the full resolution result is of no use
+        self._filter_executor.cancel((key, 'preview'))
+        key.loadImage(transformed_image)
+    
+    @pyqtSlot(object, str)
+    def on_filter_failed(self, key, message):
+        print(message)
+        self._ui.statusbar.showMessage(message.strip().splitlines()[-1], 5000)
+    
+    @pyqtSlot(bool)
+    def on_filter_busy_changed(self, busy):
+        if busy:
+            self._ui.statusbar.showMessage('Applying filter...')
+        else:
+            self._ui.statusbar.clearMessage()
         
 
     @pyqtSlot(QtWidgets.QWidget)
@@ -107,14 +371,29 @@ class MainView(QMainWindow):
         stacked_widget.setCurrentIndex(0)
         self._model.current_apply_button = instance.applyButton
         instance.settingsApplied.connect(self._edge_detection_controller.on_settings_applied)
+        instance.settingsPreviewed.connect(self._edge_detection_controller.on_settings_previewed)
+        instance.pipelineStepAdded.connect(self._edge_detection_controller.on_pipeline_step_added)
         pass
         
 
     @pyqtSlot(list)
     def on_tree_items_changed(self, items):
+        self._ui.image_list.clear()
+        self._tree_items_by_path = {}
+        self.on_tree_items_added(items)
+    
+    @pyqtSlot(list)
+    def on_tree_items_added(self, items):
+        # Icons are filled in later by on_thumbnail_ready
         for item in items:
-            item.setIcon(0, QtGui.QIcon(item.data(2,0)))
-            self._ui.image_list.addTopLevelItem(item)
+            self._tree_items_by_path[item.data(2,0)] = item
+        self._ui.image_list.addTopLevelItems(items)
+    
+    @pyqtSlot(str, QtGui.QImage)
+    def on_thumbnail_ready(self, path, image):
+        item = self._tree_items_by_path.get(path)
+        if item is not None:
+            item.setIcon(0, QtGui.QIcon(QtGui.QPixmap.fromImage(image)))
     
     @pyqtSlot(int)
     def add_new_tab(self, index):
@@ -129,5 +408,16 @@ class MainView(QMainWindow):
         
     @pyqtSlot(str)
     def on_current_path_changed(self, path):
+        # The image itself arrives decoded in on_image_decoded
+        self._ui.statusbar.showMessage(f'Loading {os.path.basename(path)}...')
+    
+    @pyqtSlot(str, object)
+    def on_image_decoded(self, path, image):
         current_viewer = self._ui.image_viewer_tabs.currentWidget().children()[1]
-        current_viewer.loadImage(path)
\ No newline at end of file
+        current_viewer.openImage(path, image)
+        self._ui.statusbar.clearMessage()
+    
+    @pyqtSlot(str, str)
+    def on_image_decode_failed(self, path, message):
+        print(message)
+        self._ui.statusbar.showMessage(f'Cannot open {os.path.basename(path)}: {message.strip().splitlines()[-1]}', 5000)
\ No newline at end of file
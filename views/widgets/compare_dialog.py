@@ -0,0 +1,37 @@
+from PyQt5 import QtWidgets, QtCore
+
+class CompareDialog(QtWidgets.QDialog):
+    """ Picks the filters to compare on the current image, each result gets its own tab. """
+
+    def __init__(self, filters, checked=(), parent=None):
+        """ filters: {registry key: label}, the keys in checked start checked. """
+        super().__init__(parent)
+        self.setWindowTitle('Compare filters')
+
+        self.filterList = QtWidgets.QListWidget()
+        for key, label in filters.items():
+            item = QtWidgets.QListWidgetItem(label)
+            item.setData(QtCore.Qt.UserRole, key)
+            item.setFlags(item.flags() | QtCore.Qt.ItemIsUserCheckable)
+            item.setCheckState(QtCore.Qt.Checked if key in checked else QtCore.Qt.Unchecked)
+            self.filterList.addItem(item)
+
+        self.sequentialCheckbox = QtWidgets.QCheckBox('Also time a sequential run')
+        self.sequentialCheckbox.setToolTip('Runs the filters once more one after the other, for the comparison of the times')
+
+        buttons = QtWidgets.QDialogButtonBox(QtWidgets.QDialogButtonBox.Ok | QtWidgets.QDialogButtonBox.Cancel)
+        buttons.accepted.connect(self.accept)
+        buttons.rejected.connect(self.reject)
+
+        layout = QtWidgets.QVBoxLayout(self)
+        layout.addWidget(QtWidgets.QLabel('The current filter uses its menu settings, the others their defaults.'))
+        layout.addWidget(self.filterList)
+        layout.addWidget(self.sequentialCheckbox)
+        layout.addWidget(buttons)
+
+    def selectedFilters(self):
+        items = (self.filterList.item(i) for i in range(self.filterList.count()))
+        return [item.data(QtCore.Qt.UserRole) for item in items if item.checkState() == QtCore.Qt.Checked]
+
+    def sequential(self):
+        return self.sequentialCheckbox.isChecked()
@@ -0,0 +1,43 @@
+from PyQt5 import QtWidgets, QtCore
+from controllers.display import to_display_buffer
+
+
+class ImageItem(QtWidgets.QGraphicsItem):
+    """ Graphics item painting a numpy image through a QImage sharing its buffer.
+        The buffer is owned by the item, so the QImage never outlives its pixels. """
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self._buffer = None
+        self._q_image = None
+        self._rect = QtCore.QRectF()
+        self.setFlag(QtWidgets.QGraphicsItem.ItemUsesExtendedStyleOption)
+
+    def setImage(self, numpy_img, display=None):
+        """ display: the to_display_buffer() of numpy_img when it is already made. """
+        self.prepareGeometryChange()
+        if numpy_img is None:
+            self._buffer, self._q_image = None, None
+            self._rect = QtCore.QRectF()
+        else:
+            self._buffer, self._q_image = display or to_display_buffer(numpy_img)
+            self._rect = QtCore.QRectF(0, 0, self._q_image.width(), self._q_image.height())
+        self.update()
+
+    def image(self):
+        return self._buffer
+
+    def displayBytes(self):
+        return 0 if self._buffer is None else self._buffer.nbytes
+
+    def boundingRect(self):
+        return self._rect
+
+    def paint(self, painter, option, widget=None):
+        if self._q_image is None:
+            return
+        # Only the exposed part is drawn, which matters when zoomed in on a large image
+        exposed = option.exposedRect.intersected(self._rect)
+        if exposed.isEmpty():
+            return
+        painter.drawImage(exposed, self._q_image, exposed)
@@ -1,9 +1,19 @@
 from PyQt5 import QtWidgets, QtGui, QtCore
-from PyQt5.QtGui import QImage
 import cv2
 import os
 import numpy as np
+from collections import deque
 from functools import singledispatchmethod
+from .image_item import ImageItem
+from .tiled_image_item import TiledImageItem
+from controllers.loaders import load_image
+from controllers.display import apply_window, auto_window
+
+# Images above this many pixels are shown through the tiled item
+TILED_THRESHOLD = 16 * 10**6
+# Previous results kept for undo, bounded by count and by total size
+HISTORY_SIZE = 10
+HISTORY_BYTES = 1024 * 2**20
 
 class ImageViewer(QtWidgets.QGraphicsView):
     itemsDropped = QtCore.pyqtSignal(QtCore.QMimeData)
@@ -20,6 +30,21 @@ class ImageViewer(QtWidgets.QGraphicsView):
         self.filled = False
         self.scene = QtWidgets.QGraphicsScene()
         self.pan_margin = 1000
+        self._image_item = ImageItem()
+        self._tiled_item = TiledImageItem()
+        self.scene.addItem(self._image_item)
+        self.scene.addItem(self._tiled_item)
+        self._preview_item = None
+        self._overlay = None
+        # Shown range of 16-bit and float images, None for the automatic one
+        self.display_window = None
+        self.history = deque()
+        self.history_size = HISTORY_SIZE
+        self.history_bytes = HISTORY_BYTES
+        
+        self.undoShortcut = QtWidgets.QShortcut(QtGui.QKeySequence.Undo, self)
+        self.undoShortcut.setContext(QtCore.Qt.WidgetWithChildrenShortcut)
+        self.undoShortcut.activated.connect(self.undo)
         
         self.setAcceptDrops(True)
         self.dragEnterEvent = self.dragEnterEvent
@@ -66,6 +91,12 @@ class ImageViewer(QtWidgets.QGraphicsView):
         contextMenu = QtWidgets.QMenu(self)
 
         closeAction = contextMenu.addAction("Close")
+        undoAction = contextMenu.addAction("Undo")
+        undoAction.setEnabled(bool(self.history))
+        undoAction.triggered.connect(self.undo)
+        windowAction = contextMenu.addAction("Display range...")
+        windowAction.setEnabled(self.image is not None and self.image.dtype != np.uint8)
+        windowAction.triggered.connect(self.editDisplayWindow)
         zoomInAction = contextMenu.addAction("Zoom in")
         zoomOutAction = contextMenu.addAction("Zoom out")
         
@@ -80,29 +111,127 @@ class ImageViewer(QtWidgets.QGraphicsView):
     def loadImage(self, path_or_image):
         raise NotImplementedError("Unsupported input type.")
 
+    def setSceneImage(self, numpy_img):
+        '''Show numpy_img on the persistent image item.
+           The item keeps the display buffer, no pixmap copy is made. Large images go to the
+           tiled item instead, which only draws the visible tiles of a mip pyramid.
+           The scene rect is grown by pan_margin so the image can be dragged past its borders.'''
+        self.removePreview()
+        height, width = numpy_img.shape[:2]
+        tiled = height * width > TILED_THRESHOLD
+        # 8-bit images are shown as they are, deeper ones through the display window
+        window = None
+        if numpy_img.dtype != np.uint8:
+            window = self.display_window or auto_window(numpy_img)
+        self._image_item.setImage(None if tiled else apply_window(numpy_img, window))
+        self._tiled_item.setImage(numpy_img if tiled else None, window)
+        self.scene.setSceneRect(-self.pan_margin, -self.pan_margin,
+                                width + 2 * self.pan_margin, height + 2 * self.pan_margin)
+        self.setScene(self.scene)
+        self.filled = True
+
+    def showFrame(self, numpy_img, display=None):
+        '''Show a frame of a stream. Frames do not go to the undo history and the scene is
+           only set up again when the frame size changes. display is the to_display_buffer()
+           of the frame when it was made on another thread.'''
+        rect = self._image_item.boundingRect()
+        height, width = numpy_img.shape[:2]
+        if self._preview_item is None and numpy_img.dtype == np.uint8 and (rect.width(), rect.height()) == (width, height):
+            self._image_item.setImage(numpy_img, display)
+        else:
+            self.setSceneImage(numpy_img)
+
+    def setOverlayText(self, text):
+        '''Text in the top left corner of the view, above the image; None removes it.'''
+        if text is None:
+            if self._overlay is not None:
+                self._overlay.deleteLater()
+                self._overlay = None
+            return
+        if self._overlay is None:
+            self._overlay = QtWidgets.QLabel(self.viewport())
+            self._overlay.setStyleSheet("background-color: rgba(0, 0, 0, 160); color: white; padding: 4px;")
+            self._overlay.setAttribute(QtCore.Qt.WA_TransparentForMouseEvents)
+            self._overlay.move(8, 8)
+            self._overlay.show()
+        self._overlay.setText(text)
+        self._overlay.adjustSize()
+
     @loadImage.register(np.ndarray)
     def _1(self, numpy_img):
-        shape = numpy_img.shape
-        height, width = shape[0], shape[1]
-        
-        if len(shape) == 2: # the image is in grayscale
-            bytes_per_line = width
-            q_image = QImage(numpy_img.data, width, height, bytes_per_line, QImage.Format_Grayscale8)
-        else: # colored image
-            bytes_per_line = 3 * width
-            q_image = QImage(numpy_img.data, width, height, bytes_per_line, QImage.Format_RGB888).rgbSwapped()
-
-        panning_pixmap = QtGui.QPixmap(width + 2 * self.pan_margin, height + 2 * self.pan_margin)
-        panning_pixmap.fill(QtCore.Qt.transparent)
-        
-        painter = QtGui.QPainter(panning_pixmap)
-        painter.drawImage(QtCore.QPoint(self.pan_margin, self.pan_margin), q_image)
-        painter.end()
-        
-        self.scene.addPixmap(panning_pixmap)
-        self.setScene(self.scene)
+        '''Show a transformation result, the image it replaces goes to the undo history.'''
+        if self.image is not None and self.image is not numpy_img:
+            self.history.append(self.image)
+            self.trimHistory()
+        self.setSceneImage(numpy_img)
         self.image = numpy_img
-        self.filled = True
+
+    def setHistorySize(self, size, max_bytes=HISTORY_BYTES):
+        '''Number of previous results kept for undo, 0 disables the history.'''
+        self.history_size = size
+        self.history_bytes = max_bytes
+        self.trimHistory()
+
+    def trimHistory(self):
+        nbytes = sum(image.nbytes for image in self.history)
+        while self.history and (len(self.history) > self.history_size or nbytes > self.history_bytes):
+            nbytes -= self.history.popleft().nbytes
+
+    def undo(self):
+        '''Go back to the image before the last transformation.'''
+        if not self.history:
+            return False
+        self.image = self.history.pop()
+        self.setSceneImage(self.image)
+        return True
+
+    def setDisplayWindow(self, window):
+        '''(low, high) values of a 16-bit or float image stretched over the screen's 0..255,
+           None for the automatic range. The pixels themselves are not changed.'''
+        self.display_window = window
+        if self.image is not None:
+            self.setSceneImage(self.image)
+
+    def editDisplayWindow(self):
+        low, high = self.display_window or auto_window(self.image)
+        dialog = QtWidgets.QDialog(self)
+        dialog.setWindowTitle('Display range')
+        layout = QtWidgets.QFormLayout(dialog)
+        spin_boxes = []
+        for label, value in (('Black at', low), ('White at', high)):
+            spin_box = QtWidgets.QDoubleSpinBox()
+            spin_box.setRange(-1e12, 1e12)
+            spin_box.setDecimals(4 if self.image.dtype.kind == 'f' else 0)
+            spin_box.setValue(value)
+            layout.addRow(label, spin_box)
+            spin_boxes.append(spin_box)
+        buttons = QtWidgets.QDialogButtonBox(QtWidgets.QDialogButtonBox.Ok | QtWidgets.QDialogButtonBox.Cancel
+                                             | QtWidgets.QDialogButtonBox.RestoreDefaults)
+        buttons.accepted.connect(dialog.accept)
+        buttons.rejected.connect(dialog.reject)
+        buttons.button(QtWidgets.QDialogButtonBox.RestoreDefaults).clicked.connect(lambda: dialog.done(2))
+        layout.addRow(buttons)
+
+        result = dialog.exec_()
+        if result == 2:
+            self.setDisplayWindow(None)
+        elif result == QtWidgets.QDialog.Accepted and spin_boxes[1].value() > spin_boxes[0].value():
+            self.setDisplayWindow((spin_boxes[0].value(), spin_boxes[1].value()))
+
+    def showPreview(self, numpy_img, factor):
+        '''Show a downscaled result stretched over the full-size image.
+           self.image is kept, the next transformation still starts from it.'''
+        if self._preview_item is None:
+            self._preview_item = ImageItem()
+            self._preview_item.setZValue(1)
+            self.scene.addItem(self._preview_item)
+        self._preview_item.setImage(numpy_img)
+        self._preview_item.setScale(1 / factor)
+
+    def removePreview(self):
+        if self._preview_item is not None:
+            self.scene.removeItem(self._preview_item)
+            self._preview_item = None
 
     def getFilename(self, path):
         return os.path.basename(path)
@@ -110,25 +239,15 @@ class ImageViewer(QtWidgets.QGraphicsView):
     @loadImage.register(str)
     def _2(self, path):
         '''Read the image in OpenCV2'''
-        self.scene.clear()
-        self.image = cv2.imread(path)
-        self.path = path
-        shape = self.image.shape
-        height, width = shape[0], shape[1]
-        bytes_per_line = 3 * width
+        self.openImage(path, load_image(path))
 
-        q_image = QImage(self.image.data, width, height, bytes_per_line, QImage.Format_RGB888).rgbSwapped()
-
-        panning_pixmap = QtGui.QPixmap(width + 2 * self.pan_margin, height + 2 * self.pan_margin)
-        panning_pixmap.fill(QtCore.Qt.transparent)
-        
-        painter = QtGui.QPainter(panning_pixmap)
-        painter.drawImage(QtCore.QPoint(self.pan_margin, self.pan_margin), q_image)
-        painter.end()
-        
-        self.scene.addPixmap(panning_pixmap)
-        self.setScene(self.scene)
-        self.filled = True
+    def openImage(self, path, numpy_img):
+        '''Show the image of the file at path, decoded elsewhere (see controllers/decoder.py).'''
+        self.history.clear()
+        self.display_window = None
+        self.image = numpy_img
+        self.path = path
+        self.setSceneImage(self.image)
         self.imageSet.emit(self.getFilename(self.path))
         
         
@@ -5,6 +5,8 @@ WIDGET_TYPES = [QtWidgets.QSlider, QtWidgets.QCheckBox, QtWidgets.QGroupBox, QtW
 
 class MenuInterface(QtWidgets.QWidget):
     settingsApplied = QtCore.pyqtSignal(dict)
+    settingsPreviewed = QtCore.pyqtSignal(dict)
+    pipelineStepAdded = QtCore.pyqtSignal(dict)
     APPLY_BUTTON = ''
     TRANS_FUNC = None
     
@@ -13,10 +15,44 @@ class MenuInterface(QtWidgets.QWidget):
     
     def onApplyClick(self):
         self.settingsApplied.emit(self.getSettings())
+    
+    def onAddToPipelineClick(self):
+        self.pipelineStepAdded.emit(self.getSettings())
+    
+    def onValueChanged(self, *args):
+        if self.liveCheckbox.isChecked():
+            self.settingsPreviewed.emit(self.getSettings())
         
     def connectEvents(self):
         self.applyButton = self.findChild(QtWidgets.QPushButton, self.APPLY_BUTTON)
         self.applyButton.clicked.connect(self.onApplyClick)
+        self.connectLivePreview()
+        self.connectPipelineButton()
+    
+    def connectPipelineButton(self):
+        """ 'Add to pipeline' appends the filter with the current settings to the pipeline
+            (Pipeline menu of the main window) instead of applying it. """
+        self.pipelineButton = QtWidgets.QPushButton('Add to pipeline')
+        self.pipelineButton.setObjectName('add_to_pipeline_button')
+        self.pipelineButton.setSizePolicy(QtWidgets.QSizePolicy.Minimum, QtWidgets.QSizePolicy.Fixed)
+        self.layout.insertWidget(self.layout.indexOf(self.applyButton), self.pipelineButton)
+        self.pipelineButton.clicked.connect(self.onAddToPipelineClick)
+    
+    def connectLivePreview(self):
+        """ With 'Live preview' checked, every change of a slider, check box or radio button
+            emits settingsPreviewed, the Apply button still does the full resolution run. """
+        self.liveCheckbox = QtWidgets.QCheckBox('Live preview')
+        self.liveCheckbox.setObjectName('live_preview_checkbox')
+        self.layout.insertWidget(self.layout.indexOf(self.applyButton), self.liveCheckbox)
+        
+        for slider in self.findChildren(QtWidgets.QSlider):
+            if isinstance(slider, RangeSlider):
+                slider.sliderMoved.connect(self.onValueChanged)
+            else:
+                slider.valueChanged.connect(self.onValueChanged)
+        for button in self.findChildren(QtWidgets.QAbstractButton):
+            if isinstance(button, (QtWidgets.QCheckBox, QtWidgets.QRadioButton)):
+                button.toggled.connect(self.onValueChanged)
     
     def getSettings(self):
         pass
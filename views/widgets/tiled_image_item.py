@@ -0,0 +1,81 @@
+from PyQt5 import QtWidgets, QtGui, QtCore
+from controllers.cache import LRUCache
+from controllers.pyramid import TileLoader, TILE_SIZE
+
+""" Graphics item for images too large to be painted as one picture.
+    Only the tiles visible at the current zoom are drawn, from the pyramid level that has
+    about one pixel per screen pixel. Missing tiles are requested from the TileLoader and
+    drawn from a coarser level that is already available until they arrive. """
+
+TILE_CACHE_BYTES = 256 * 2**20
+
+
+class TiledImageItem(QtWidgets.QGraphicsObject):
+    def __init__(self, parent=None, tile_size=TILE_SIZE, cache_bytes=TILE_CACHE_BYTES):
+        super().__init__(parent)
+        self._rect = QtCore.QRectF()
+        self._tiles = LRUCache(cache_bytes) # (level, tx, ty) -> QPixmap
+        self._loader = TileLoader(tile_size)
+        self._loader.tileReady.connect(self.onTileReady)
+        self.setFlag(QtWidgets.QGraphicsItem.ItemUsesExtendedStyleOption)
+
+    def setImage(self, numpy_img, window=None):
+        self.prepareGeometryChange()
+        self._tiles.clear()
+        self._loader.setImage(numpy_img, window)
+        if numpy_img is None:
+            self._rect = QtCore.QRectF()
+        else:
+            height, width = numpy_img.shape[:2]
+            self._rect = QtCore.QRectF(0, 0, width, height)
+        self.update()
+
+    def boundingRect(self):
+        return self._rect
+
+    def tileSceneRect(self, level, tx, ty):
+        pyramid = self._loader.pyramid
+        sx, sy = pyramid.scale(level)
+        x, y, width, height = pyramid.tileRect(level, tx, ty)
+        return QtCore.QRectF(x * sx, y * sy, width * sx, height * sy)
+
+    def paint(self, painter, option, widget=None):
+        pyramid = self._loader.pyramid
+        if pyramid is None:
+            return
+        exposed = option.exposedRect.intersected(self._rect)
+        if exposed.isEmpty():
+            return
+
+        level = pyramid.levelFor(option.levelOfDetailFromTransform(painter.worldTransform()))
+        for tx, ty in pyramid.tilesIn(level, exposed.left(), exposed.top(), exposed.right(), exposed.bottom()):
+            target = self.tileSceneRect(level, tx, ty)
+            pixmap = self._tiles.get((level, tx, ty))
+            if pixmap is not None:
+                painter.drawPixmap(target, pixmap, QtCore.QRectF(pixmap.rect()))
+                continue
+            self._loader.requestTile(level, tx, ty)
+            self.drawFallback(painter, level, tx, ty, target)
+
+    def drawFallback(self, painter, level, tx, ty, target):
+        """ Fill target from the nearest coarser level that is in the cache. """
+        pyramid = self._loader.pyramid
+        for coarse in range(level + 1, pyramid.level_count):
+            shift = coarse - level
+            coarse_tx, coarse_ty = tx >> shift, ty >> shift
+            pixmap = self._tiles.get((coarse, coarse_tx, coarse_ty))
+            if pixmap is None:
+                continue
+            painter.save()
+            painter.setClipRect(target, QtCore.Qt.IntersectClip)
+            painter.drawPixmap(self.tileSceneRect(coarse, coarse_tx, coarse_ty), pixmap, QtCore.QRectF(pixmap.rect()))
+            painter.restore()
+            return
+        # Nothing to show yet, make sure the whole image arrives first at the coarsest level
+        self._loader.requestTile(pyramid.level_count - 1, 0, 0)
+
+    @QtCore.pyqtSlot(int, int, int, QtGui.QImage)
+    def onTileReady(self, level, tx, ty, q_image):
+        pixmap = QtGui.QPixmap.fromImage(q_image)
+        self._tiles.put((level, tx, ty), pixmap, q_image.sizeInBytes())
+        self.update(self.tileSceneRect(level, tx, ty))